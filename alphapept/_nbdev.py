@@ -38,6 +38,7 @@ index = {"print_settings": "00_settings.ipynb",
          "MS_Data_File.import_raw_DDA_data": "02_io.ipynb",
          "index_ragged_list": "02_io.ipynb",
          "MS_Data_File.read_DDA_query_data": "02_io.ipynb",
+         "gather_ragged": "02_io.ipynb",
          "raw_conversion": "02_io.ipynb",
          "get_missed_cleavages": "03_fasta.ipynb",
          "cleave_sequence": "03_fasta.ipynb",
@@ -60,27 +61,55 @@ index = {"print_settings": "00_settings.ipynb",
          "get_unique_peptides": "03_fasta.ipynb",
          "generate_peptides": "03_fasta.ipynb",
          "check_peptide": "03_fasta.ipynb",
+         "get_peptide_bounds": "03_fasta.ipynb",
+         "digest_sequence": "03_fasta.ipynb",
+         "generate_peptides_compiled": "03_fasta.ipynb",
          "get_precmass": "03_fasta.ipynb",
          "get_fragmass": "03_fasta.ipynb",
+         "get_fragmasses": "03_fasta.ipynb",
          "get_frag_dict": "03_fasta.ipynb",
          "get_spectrum": "03_fasta.ipynb",
          "get_spectra": "03_fasta.ipynb",
+         "find_fasta_record_start": "03_fasta.ipynb",
+         "find_last_fasta_record_start": "03_fasta.ipynb",
+         "count_fasta_records": "03_fasta.ipynb",
+         "parse_fasta_chunk": "03_fasta.ipynb",
+         "parse_fasta_chunks": "03_fasta.ipynb",
+         "FastaRecords": "03_fasta.ipynb",
+         "read_fasta_buffers": "03_fasta.ipynb",
+         "read_fasta_records": "03_fasta.ipynb",
          "read_fasta_file": "03_fasta.ipynb",
          "read_fasta_file_entries": "03_fasta.ipynb",
          "check_sequence": "03_fasta.ipynb",
          "add_to_pept_dict": "03_fasta.ipynb",
          "merge_pept_dicts": "03_fasta.ipynb",
+         "PeptideProteinMap": "03_fasta.ipynb",
          "generate_fasta_list": "03_fasta.ipynb",
          "generate_database": "03_fasta.ipynb",
          "generate_spectra": "03_fasta.ipynb",
          "block_idx": "03_fasta.ipynb",
          "blocks": "03_fasta.ipynb",
+         "set_known_peptides": "03_fasta.ipynb",
          "digest_fasta_block": "03_fasta.ipynb",
          "generate_database_parallel": "03_fasta.ipynb",
          "mass_dict": "10_constants.ipynb",
          "pept_dict_from_search": "03_fasta.ipynb",
          "save_database": "03_fasta.ipynb",
+         "write_pept_dict": "03_fasta.ipynb",
          "read_database": "03_fasta.ipynb",
+         "Database": "03_fasta.ipynb",
+         "digest_fasta_block_to_shard": "03_fasta.ipynb",
+         "merge_database_shards": "03_fasta.ipynb",
+         "generate_database_streaming": "03_fasta.ipynb",
+         "hash_file": "03_fasta.ipynb",
+         "get_database_key": "03_fasta.ipynb",
+         "write_database_attributes": "03_fasta.ipynb",
+         "validate_database": "03_fasta.ipynb",
+         "DatabaseCache": "03_fasta.ipynb",
+         "DATABASE_CACHE_IGNORED_SETTINGS": "03_fasta.ipynb",
+         "check_database_extension": "03_fasta.ipynb",
+         "update_database": "03_fasta.ipynb",
+         "DATABASE_EXTENDABLE_LISTS": "03_fasta.ipynb",
          "connect_centroids_unidirection": "04_feature_finding.ipynb",
          "find_centroid_connections": "04_feature_finding.ipynb",
          "convert_connections_to_array": "04_feature_finding.ipynb",
@@ -136,47 +165,93 @@ index = {"print_settings": "00_settings.ipynb",
          "compare_frags": "05_search.ipynb",
          "ppm_to_dalton": "05_search.ipynb",
          "get_idxs": "05_search.ipynb",
+         "sort_top_n": "05_search.ipynb",
+         "heap_insert": "05_search.ipynb",
+         "heap_insert_numba": "05_search.ipynb",
          "compare_spectrum_parallel": "05_search.ipynb",
+         "frag_to_bin": "05_search.ipynb",
+         "build_fragment_index": "05_search.ipynb",
+         "score_frags": "05_search.ipynb",
+         "compare_spectrum_fragment_index": "05_search.ipynb",
          "query_data_to_features": "05_search.ipynb",
+         "get_query_blocks": "05_search.ipynb",
          "get_psms": "05_search.ipynb",
          "frag_delta": "05_search.ipynb",
          "intensity_fraction": "05_search.ipynb",
          "add_column": "05_search.ipynb",
          "remove_column": "05_search.ipynb",
+         "count_hits": "05_search.ipynb",
+         "fill_hits": "05_search.ipynb",
          "get_hits": "05_search.ipynb",
+         "ION_DTYPE": "05_search.ipynb",
+         "score_psms": "06_score.ipynb",
          "score": "11_interface.ipynb",
          "LOSS_DICT": "05_search.ipynb",
          "LOSSES": "05_search.ipynb",
          "get_sequences": "05_search.ipynb",
          "get_score_columns": "05_search.ipynb",
          "plot_psms": "05_search.ipynb",
+         "get_offset_histogram": "05_search.ipynb",
+         "annotate_offsets": "05_search.ipynb",
+         "find_offset_peaks": "05_search.ipynb",
+         "get_confident_offsets": "05_search.ipynb",
+         "create_shared_database": "05_search.ipynb",
+         "attach_shared_database": "05_search.ipynb",
+         "release_shared_database": "05_search.ipynb",
+         "SHARED_DB_ARRAYS": "05_search.ipynb",
          "store_hdf": "05_search.ipynb",
          "search_db": "05_search.ipynb",
+         "read_query_data_cached": "05_search.ipynb",
          "search_fasta_block": "05_search.ipynb",
          "filter_top_n": "05_search.ipynb",
+         "extract_ions": "05_search.ipynb",
          "ion_extractor": "05_search.ipynb",
          "search_parallel": "05_search.ipynb",
+         "get_group_codes": "06_score.ipynb",
+         "get_group_order": "06_score.ipynb",
+         "get_dense_rank_grouped": "06_score.ipynb",
+         "get_dense_rank": "06_score.ipynb",
+         "get_first_per_group": "06_score.ipynb",
          "filter_score": "06_score.ipynb",
          "filter_precursor": "06_score.ipynb",
          "get_q_values": "06_score.ipynb",
+         "get_fdr": "06_score.ipynb",
          "cut_fdr": "06_score.ipynb",
+         "get_max_per_group": "06_score.ipynb",
          "cut_global_fdr": "06_score.ipynb",
          "get_x_tandem_score": "06_score.ipynb",
          "score_x_tandem": "06_score.ipynb",
          "filter_with_x_tandem": "06_score.ipynb",
          "filter_with_score": "06_score.ipynb",
-         "score_psms": "06_score.ipynb",
          "get_ML_features": "06_score.ipynb",
+         "get_training_set": "06_score.ipynb",
          "train_RF": "06_score.ipynb",
+         "get_classifier": "06_score.ipynb",
+         "get_ML_score": "06_score.ipynb",
+         "train_classifier": "06_score.ipynb",
          "score_ML": "06_score.ipynb",
          "filter_with_ML": "06_score.ipynb",
+         "CLASSIFIERS": "06_score.ipynb",
          "assign_proteins": "06_score.ipynb",
+         "get_razor_groups": "06_score.ipynb",
          "get_shared_proteins": "06_score.ipynb",
          "get_protein_groups": "06_score.ipynb",
          "perform_protein_grouping": "06_score.ipynb",
+         "get_ion_positions": "06_score.ipynb",
+         "get_ions": "06_score.ipynb",
+         "format_ion_types": "06_score.ipynb",
          "get_ion": "06_score.ipynb",
          "ion_dict": "06_score.ipynb",
          "ecdf": "06_score.ipynb",
+         "ECDFMapper": "06_score.ipynb",
+         "read_psms": "06_score.ipynb",
+         "get_classifier_path": "06_score.ipynb",
+         "get_ecdf_path": "06_score.ipynb",
+         "save_classifier": "06_score.ipynb",
+         "load_classifier": "06_score.ipynb",
+         "sample_psms": "06_score.ipynb",
+         "read_shared_psms": "06_score.ipynb",
+         "train_shared_classifier": "06_score.ipynb",
          "score_hdf": "06_score.ipynb",
          "protein_grouping_all": "06_score.ipynb",
          "remove_outliers": "07_recalibration.ipynb",
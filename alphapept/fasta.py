@@ -3,11 +3,18 @@
 __all__ = ['get_missed_cleavages', 'cleave_sequence', 'count_missed_cleavages', 'count_internal_cleavages', 'parse',
            'list_to_numba', 'get_decoy_sequence', 'swap_KR', 'swap_AL', 'get_decoys', 'add_decoy_tag', 'add_fixed_mods',
            'add_variable_mod', 'get_isoforms', 'add_variable_mods', 'add_fixed_mod_terminal', 'add_fixed_mods_terminal',
-           'add_variable_mods_terminal', 'get_unique_peptides', 'generate_peptides', 'check_peptide', 'get_precmass',
-           'get_fragmass', 'get_frag_dict', 'get_spectrum', 'get_spectra', 'read_fasta_file', 'read_fasta_file_entries',
-           'check_sequence', 'add_to_pept_dict', 'merge_pept_dicts', 'generate_fasta_list', 'generate_database',
-           'generate_spectra', 'block_idx', 'blocks', 'digest_fasta_block', 'generate_database_parallel', 'mass_dict',
-           'pept_dict_from_search', 'save_database', 'read_database']
+           'add_variable_mods_terminal', 'get_unique_peptides', 'generate_peptides', 'check_peptide',
+           'get_peptide_bounds', 'digest_sequence', 'generate_peptides_compiled', 'get_precmass', 'get_fragmass',
+           'get_fragmasses', 'get_frag_dict', 'get_spectrum', 'get_spectra', 'find_fasta_record_start',
+           'find_last_fasta_record_start', 'count_fasta_records', 'parse_fasta_chunk', 'parse_fasta_chunks',
+           'FastaRecords', 'read_fasta_buffers', 'read_fasta_records', 'read_fasta_file', 'read_fasta_file_entries',
+           'check_sequence', 'add_to_pept_dict', 'merge_pept_dicts', 'PeptideProteinMap', 'generate_fasta_list',
+           'generate_database', 'generate_spectra', 'block_idx', 'blocks', 'set_known_peptides', 'digest_fasta_block',
+           'generate_database_parallel', 'mass_dict', 'pept_dict_from_search', 'save_database', 'write_pept_dict',
+           'read_database', 'Database', 'digest_fasta_block_to_shard', 'merge_database_shards',
+           'generate_database_streaming', 'hash_file', 'get_database_key', 'write_database_attributes',
+           'validate_database', 'DatabaseCache', 'DATABASE_CACHE_IGNORED_SETTINGS', 'check_database_extension',
+           'update_database', 'DATABASE_EXTENDABLE_LISTS']
 
 # Cell
 from alphapept import constants
@@ -516,6 +523,387 @@ def check_peptide(peptide:str, AAs:set)->bool:
     else:
         return False
 
+# Cell
+import functools
+import numpy as np
+
+@njit
+def get_peptide_bounds(cutpos:np.ndarray, n_missed_cleavages:int, pep_length_min:int, pep_length_max:int)->(np.ndarray, np.ndarray):
+    """
+    Combine cleavage sites to peptides with missed cleavages in the same order as `cleave_sequence`.
+    Args:
+        cutpos (np.ndarray): positions of the cleavage sites including the start and end of the sequence.
+        n_missed_cleavages (int): the number of max missed cleavages.
+        pep_length_min (int): min peptide length.
+        pep_length_max (int): max peptide length.
+    Returns:
+        np.ndarray: start positions of the peptides.
+        np.ndarray: end positions of the peptides.
+    """
+    n_pieces = len(cutpos) - 1
+
+    n_max = n_pieces
+    for i in range(1, n_missed_cleavages + 1):
+        n_max += max(n_pieces - i - 1, 0)
+
+    starts = np.empty(n_max, dtype=np.int64)
+    ends = np.empty(n_max, dtype=np.int64)
+
+    n = 0
+    for i in range(n_missed_cleavages + 1):
+        # Missed cleavages start at the second piece, see get_missed_cleavages
+        first = 0 if i == 0 else 1
+        for k in range(first, n_pieces - i):
+            if i == 0:
+                start, end = cutpos[k], cutpos[k + 1]
+            else:
+                start, end = cutpos[k - 1], cutpos[k + i]
+            if pep_length_min <= end - start <= pep_length_max:
+                starts[n] = start
+                ends[n] = end
+                n += 1
+
+    return starts[:n], ends[:n]
+
+
+@njit
+def _append_bytes(buffer:np.ndarray, n:int, values:np.ndarray)->(np.ndarray, int):
+    """Append values to a byte buffer and grow it if needed."""
+    if n + len(values) > len(buffer):
+        new_buffer = np.empty(max(2 * len(buffer), n + len(values)), dtype=np.uint8)
+        new_buffer[:n] = buffer[:n]
+        buffer = new_buffer
+    buffer[n:n + len(values)] = values
+
+    return buffer, n + len(values)
+
+
+@njit
+def _is_upper(char:np.uint8)->bool:
+    return (char >= 65) and (char <= 90)
+
+
+@njit
+def _get_token_ends(chars:np.ndarray)->np.ndarray:
+    """Positions of the amino acids that end each token, see parse."""
+    n = 0
+    for c in chars:
+        if _is_upper(c):
+            n += 1
+
+    token_ends = np.empty(n, dtype=np.int64)
+    n = 0
+    for i in range(len(chars)):
+        if _is_upper(chars[i]):
+            token_ends[n] = i
+            n += 1
+
+    return token_ends
+
+
+@njit
+def _add_fixed_mods(chars:np.ndarray, fixed_aas:np.ndarray, fixed_mods:np.ndarray, fixed_indptr:np.ndarray)->np.ndarray:
+    """Replace amino acids with fixed modifications one modification after another, see add_fixed_mods."""
+    for m in range(len(fixed_aas)):
+        mod = fixed_mods[fixed_indptr[m]:fixed_indptr[m + 1]]
+        n_found = 0
+        for c in chars:
+            if c == fixed_aas[m]:
+                n_found += 1
+        if n_found == 0:
+            continue
+
+        new_chars = np.empty(len(chars) + n_found * (len(mod) - 1), dtype=np.uint8)
+        n = 0
+        for c in chars:
+            if c == fixed_aas[m]:
+                new_chars[n:n + len(mod)] = mod
+                n += len(mod)
+            else:
+                new_chars[n] = c
+                n += 1
+        chars = new_chars
+
+    return chars
+
+
+@njit
+def _get_decoy_chars(chars:np.ndarray, pseudo_reverse:bool, AL_swap:bool, KR_swap:bool)->np.ndarray:
+    """Reverse the tokens of a peptide, see get_decoy_sequence."""
+    token_ends = _get_token_ends(chars)
+    n_tokens = len(token_ends)
+
+    token_starts = np.empty(n_tokens, dtype=np.int64)
+    for j in range(n_tokens):
+        token_starts[j] = 0 if j == 0 else token_ends[j - 1] + 1
+
+    order = np.arange(n_tokens)[::-1].copy()
+    if pseudo_reverse:
+        order[:n_tokens - 1] = np.arange(n_tokens - 1)[::-1]
+        order[n_tokens - 1] = n_tokens - 1
+
+    # Swaps only apply to unmodified amino acids, which are tokens of length one
+    single = np.empty(n_tokens, dtype=np.uint8)
+    for j in range(n_tokens):
+        if token_starts[order[j]] == token_ends[order[j]]:
+            single[j] = chars[token_ends[order[j]]]
+        else:
+            single[j] = 0
+
+    if AL_swap:
+        i = 0
+        while i < n_tokens - 1:
+            if single[i] == 65 or single[i] == 76:
+                order[i], order[i + 1] = order[i + 1], order[i]
+                single[i], single[i + 1] = single[i + 1], single[i]
+                i += 1
+            i += 1
+
+    decoy = np.empty(token_ends[-1] + 1 if n_tokens > 0 else 0, dtype=np.uint8)
+    n = 0
+    for j in range(n_tokens):
+        token = chars[token_starts[order[j]]:token_ends[order[j]] + 1]
+        decoy[n:n + len(token)] = token
+        n += len(token)
+
+    if KR_swap and n_tokens > 0:
+        if single[n_tokens - 1] == 75:
+            decoy[n - 1] = 82
+        elif single[n_tokens - 1] == 82:
+            decoy[n - 1] = 75
+
+    return decoy[:n]
+
+
+@njit
+def _write_isoforms(
+    chars:np.ndarray,
+    var_lookup:np.ndarray,
+    var_mods:np.ndarray,
+    var_indptr:np.ndarray,
+    isoforms_max:int,
+    n_modifications_max:int,
+    suffix:np.ndarray,
+    buffer:np.ndarray,
+    n_bytes:int,
+    offsets:list,
+)->(np.ndarray, int):
+    """Write all variable modification isoforms of a peptide to the buffer, see get_isoforms."""
+    n_keys = len(var_indptr) - 1
+
+    if n_keys == 0:
+        buffer, n_bytes = _append_bytes(buffer, n_bytes, chars)
+        buffer, n_bytes = _append_bytes(buffer, n_bytes, suffix)
+        offsets.append(n_bytes)
+        return buffer, n_bytes
+
+    token_ends = _get_token_ends(chars)
+    n_tokens = len(token_ends)
+    token_starts = np.empty(n_tokens, dtype=np.int64)
+    token_mod = np.full(n_tokens, -1, dtype=np.int64)
+    for j in range(n_tokens):
+        token_starts[j] = 0 if j == 0 else token_ends[j - 1] + 1
+        if token_starts[j] == token_ends[j]:
+            token_mod[j] = var_lookup[chars[token_ends[j]]]
+
+    level = np.full((1, n_tokens), -1, dtype=np.int64)
+    level_min = np.zeros(1, dtype=np.int64)
+    n_found = 1
+    write_level = level
+    n_write = 1
+
+    iteration = 0
+    while True:
+        for p in range(n_write):
+            for j in range(n_tokens):
+                key = write_level[p, j]
+                if key >= 0:
+                    buffer, n_bytes = _append_bytes(buffer, n_bytes, var_mods[var_indptr[key]:var_indptr[key + 1]])
+                else:
+                    buffer, n_bytes = _append_bytes(buffer, n_bytes, chars[token_starts[j]:token_ends[j] + 1])
+            buffer, n_bytes = _append_bytes(buffer, n_bytes, suffix)
+            offsets.append(n_bytes)
+
+        if n_found >= isoforms_max:
+            break
+        if n_modifications_max > 0 and iteration >= n_modifications_max:
+            break
+
+        n_children = 0
+        for p in range(len(level)):
+            for j in range(level_min[p], n_tokens):
+                if token_mod[j] >= 0 and level[p, j] < 0:
+                    n_children += 1
+        if n_children == 0:
+            break
+
+        n_write = min(n_children, isoforms_max - n_found)
+        children = np.empty((n_write, n_tokens), dtype=np.int64)
+        children_min = np.empty(n_write, dtype=np.int64)
+
+        n = 0
+        for p in range(len(level)):
+            for key in range(n_keys):
+                for j in range(level_min[p], n_tokens):
+                    if n < n_write and token_mod[j] == key and level[p, j] < 0:
+                        children[n] = level[p]
+                        children[n, j] = key
+                        children_min[n] = j
+                        n += 1
+
+        n_found += n_write
+        level, level_min = children, children_min
+        write_level = children
+        iteration += 1
+
+    return buffer, n_bytes
+
+
+@njit
+def digest_sequence(
+    sequence:np.ndarray,
+    starts:np.ndarray,
+    ends:np.ndarray,
+    valid_aas:np.ndarray,
+    fixed_aas:np.ndarray,
+    fixed_mods:np.ndarray,
+    fixed_indptr:np.ndarray,
+    var_lookup:np.ndarray,
+    var_mods:np.ndarray,
+    var_indptr:np.ndarray,
+    isoforms_max:int,
+    n_modifications_max:int,
+    pseudo_reverse:bool,
+    AL_swap:bool,
+    KR_swap:bool,
+)->(np.ndarray, np.ndarray):
+    """
+    Generate modified target and decoy peptides of a sequence in the same order as `generate_peptides`.
+    Args:
+        sequence (np.ndarray): ASCII codes of the sequence.
+        starts (np.ndarray): start positions of the peptides. See get_peptide_bounds().
+        ends (np.ndarray): end positions of the peptides. See get_peptide_bounds().
+        valid_aas (np.ndarray): boolean lookup of allowed ASCII codes for amino acids.
+        fixed_aas (np.ndarray): ASCII codes of the amino acids with fixed modifications.
+        fixed_mods (np.ndarray): flat ASCII codes of the fixed modifications, modification i is stored at fixed_indptr[i]:fixed_indptr[i+1].
+        fixed_indptr (np.ndarray): indices of the fixed modifications.
+        var_lookup (np.ndarray): index of the variable modification for each ASCII code or -1.
+        var_mods (np.ndarray): flat ASCII codes of the variable modifications, modification i is stored at var_indptr[i]:var_indptr[i+1].
+        var_indptr (np.ndarray): indices of the variable modifications.
+        isoforms_max (int): max number of modified forms per peptide, including the unmodified one.
+        n_modifications_max (int): max number of variable modifications per peptide, 0 for no limit.
+        pseudo_reverse (bool): If True, reverse the decoy but keep the C-terminal amino acid.
+        AL_swap (bool): replace A with L, and vice versa.
+        KR_swap (bool): replace K with R at the C-terminal, and vice versa.
+    Returns:
+        np.ndarray: ASCII codes of all peptides.
+        np.ndarray: offsets of the peptides, peptide i is stored at offsets[i]:offsets[i+1].
+    """
+    buffer = np.empty(max(64, 64 * len(starts)), dtype=np.uint8)
+    n_bytes = 0
+    offsets = [0]
+
+    no_suffix = np.empty(0, dtype=np.uint8)
+    decoy_suffix = np.array([95, 100, 101, 99, 111, 121], dtype=np.uint8) # _decoy
+
+    for i in range(len(starts)):
+        chars = sequence[starts[i]:ends[i]]
+
+        valid = True
+        for c in chars:
+            if _is_upper(c) and not valid_aas[c]:
+                valid = False
+                break
+        if not valid:
+            continue
+
+        target = _add_fixed_mods(chars, fixed_aas, fixed_mods, fixed_indptr)
+        buffer, n_bytes = _write_isoforms(
+            target, var_lookup, var_mods, var_indptr, isoforms_max, n_modifications_max, no_suffix, buffer, n_bytes, offsets
+        )
+
+        decoy = _get_decoy_chars(chars, pseudo_reverse, AL_swap, KR_swap)
+        decoy = _add_fixed_mods(decoy, fixed_aas, fixed_mods, fixed_indptr)
+        buffer, n_bytes = _write_isoforms(
+            decoy, var_lookup, var_mods, var_indptr, isoforms_max, n_modifications_max, decoy_suffix, buffer, n_bytes, offsets
+        )
+
+    return buffer[:n_bytes], np.array(offsets, dtype=np.int64)
+
+
+def _to_ascii(string:str)->np.ndarray:
+    return np.frombuffer(string.encode('ascii'), dtype=np.uint8)
+
+
+@functools.lru_cache(maxsize=16)
+def _get_digestion_arrays(mods_fixed:tuple, mods_variable:tuple)->tuple:
+    """Encode amino acids and modifications as lookup arrays for digest_sequence."""
+    valid_aas = np.zeros(256, dtype=np.bool_)
+    for aa in constants.AAs:
+        valid_aas[ord(aa)] = True
+
+    fixed_aas = np.array([ord(_[-1]) for _ in mods_fixed], dtype=np.uint8)
+    fixed_mods = _to_ascii(''.join(mods_fixed))
+    fixed_indptr = np.zeros(len(mods_fixed) + 1, dtype=np.int64)
+    fixed_indptr[1:] = np.cumsum([len(_) for _ in mods_fixed])
+
+    mods_variable_r = {}
+    for _ in mods_variable:
+        mods_variable_r[_[-1]] = _
+
+    var_lookup = np.full(256, -1, dtype=np.int64)
+    for i, aa in enumerate(mods_variable_r):
+        var_lookup[ord(aa)] = i
+    var_mods = _to_ascii(''.join(mods_variable_r.values()))
+    var_indptr = np.zeros(len(mods_variable_r) + 1, dtype=np.int64)
+    var_indptr[1:] = np.cumsum([len(_) for _ in mods_variable_r.values()])
+
+    return valid_aas, fixed_aas, fixed_mods, fixed_indptr, var_lookup, var_mods, var_indptr
+
+
+def generate_peptides_compiled(peptide:str, **kwargs)->list:
+    """
+    Compiled version of generate_peptides that returns the same modified peptides.
+
+    Args:
+        peptide (str): the given peptide sequence.
+    Returns:
+        list (of str): all modified peptides.
+    """
+    mods_fixed = tuple(kwargs['mods_fixed'] or [])
+    mods_variable = tuple(kwargs['mods_variable'] or [])
+
+    all_strings = (peptide,) + mods_fixed + mods_variable + tuple(kwargs['mods_fixed_terminal_prot']) + tuple(kwargs['mods_variable_terminal_prot'])
+    if kwargs['mods_fixed_terminal'] or kwargs['mods_variable_terminal'] or not all(_.isascii() for _ in all_strings) or any(len(_) < 2 for _ in mods_variable):
+        return generate_peptides(peptide, **kwargs)
+
+    valid_aas, fixed_aas, fixed_mods, fixed_indptr, var_lookup, var_mods, var_indptr = _get_digestion_arrays(mods_fixed, mods_variable)
+
+    isoforms_max = max(kwargs['isoforms_max'] - 1, 0)
+    n_modifications_max = kwargs['n_modifications_max'] or 0
+
+    p = re.compile(constants.protease_dict[kwargs['protease']])
+
+    mod_peptide = add_fixed_mods_terminal([peptide], kwargs['mods_fixed_terminal_prot'])
+    mod_peptide = add_variable_mods_terminal(mod_peptide, kwargs['mods_variable_terminal_prot'])
+
+    all_peptides = []
+    for sequence in mod_peptide:
+        cutpos = np.array([0] + [m.start()+1 for m in p.finditer(sequence)] + [len(sequence)], dtype=np.int64)
+        starts, ends = get_peptide_bounds(cutpos, kwargs['n_missed_cleavages'], kwargs['pep_length_min'], kwargs['pep_length_max'])
+
+        buffer, offsets = digest_sequence(
+            _to_ascii(sequence), starts, ends, valid_aas,
+            fixed_aas, fixed_mods, fixed_indptr,
+            var_lookup, var_mods, var_indptr,
+            isoforms_max, n_modifications_max,
+            kwargs.get('pseudo_reverse', False), kwargs.get('AL_swap', False), kwargs.get('KR_swap', False)
+        )
+        text = buffer.tobytes().decode('ascii')
+        all_peptides.extend([text[s:e] for s, e in zip(offsets[:-1], offsets[1:])])
+
+    return all_peptides
+
 # Cell
 from numba import njit
 from numba.typed import List
@@ -578,6 +966,35 @@ def get_fragmass(parsed_pep:list, mass_dict:numba.typed.Dict)->tuple:
 
     return frag_masses, frag_type
 
+# Cell
+@njit
+def get_fragmasses(peptides:numba.typed.List, mass_dict:numba.typed.Dict)->tuple:
+    """
+    Calculate the masses of the fragment ions for a list of peptides in a single compiled pass
+    Args:
+        peptides (numba.typed.List of str): the (modified) peptide list.
+        mass_dict (numba.typed.Dict): key is the amino acid or the modified amino acid, and the value is the mass.
+    Returns:
+        Tuple[np.ndarray(np.float64), np.ndarray(np.int8), np.ndarray(np.int64)]: the fragment masses and the fragment types of all peptides, see get_fragmass.
+        The fragments of peptide i are stored at indices[i]:indices[i+1].
+    """
+    parsed_peptides = List()
+    indices = np.zeros(len(peptides) + 1, dtype=np.int64)
+
+    for i in range(len(peptides)):
+        parsed_pep = parse(peptides[i])
+        parsed_peptides.append(parsed_pep)
+        indices[i + 1] = indices[i] + max(len(parsed_pep) - 1, 0) * 2
+
+    frag_masses = np.zeros(indices[-1], dtype=np.float64)
+    frag_types = np.zeros(indices[-1], dtype=np.int8)
+
+    for i in range(len(parsed_peptides)):
+        if indices[i + 1] > indices[i]:
+            frag_masses[indices[i]:indices[i + 1]], frag_types[indices[i]:indices[i + 1]] = get_fragmass(parsed_peptides[i], mass_dict)
+
+    return frag_masses, frag_types, indices
+
 # Cell
 def get_frag_dict(parsed_pep:list, mass_dict:dict)->dict:
     """
@@ -648,40 +1065,333 @@ def get_spectra(peptides:numba.typed.List, mass_dict:numba.typed.Dict)->List:
     return spectra
 
 # Cell
-from Bio import SeqIO
 import os
 from glob import glob
+import gzip
 import logging
+import alphapept.performance
+import alphapept.io
+
+@njit
+def find_fasta_record_start(buffer:np.ndarray, start:int)->int:
+    """
+    Find the first FASTA record at or after a position of a byte buffer.
+    Args:
+        buffer (np.ndarray): uint8 array with the content of a FASTA file.
+        start (int): position to start searching from.
+    Returns:
+        int: position of the '>' that starts the next record, len(buffer) if there is none.
+    """
+    for i in range(start, len(buffer)):
+        if buffer[i] == 62:
+            if (i == 0) or (buffer[i-1] == 10) or (buffer[i-1] == 13):
+                return i
+    return len(buffer)
+
+
+@njit
+def find_last_fasta_record_start(buffer:np.ndarray)->int:
+    """
+    Find the last FASTA record of a byte buffer.
+    Args:
+        buffer (np.ndarray): uint8 array with the content of a FASTA file.
+    Returns:
+        int: position of the '>' that starts the last record, -1 if there is none.
+    """
+    for i in range(len(buffer) - 1, -1, -1):
+        if buffer[i] == 62:
+            if (i == 0) or (buffer[i-1] == 10) or (buffer[i-1] == 13):
+                return i
+    return -1
+
+
+@njit
+def count_fasta_records(buffer:np.ndarray)->int:
+    """
+    Count the FASTA records of a byte buffer.
+    Args:
+        buffer (np.ndarray): uint8 array with the content of a FASTA file.
+    Returns:
+        int: number of records.
+    """
+    count = 0
+    pos = find_fasta_record_start(buffer, 0)
+    while pos < len(buffer):
+        count += 1
+        pos = find_fasta_record_start(buffer, pos + 1)
+    return count
+
+
+@njit
+def parse_fasta_chunk(buffer:np.ndarray, start:int, end:int, counts:np.ndarray, sequence_indptr:np.ndarray, sequences:np.ndarray, headers:np.ndarray, record_offset:int, sequence_offset:int, header_offset:int, write:bool):
+    """
+    Parse all FASTA records in a chunk of a byte buffer in a single pass.
+    Header lines are copied without the leading '>' and terminated by a newline.
+    Whitespace and line breaks are removed from the sequences.
+    Args:
+        buffer (np.ndarray): uint8 array with the content of a FASTA file.
+        start (int): start of the chunk, needs to be the start of a record.
+        end (int): end of the chunk.
+        counts (np.ndarray): array of length 3 to store the number of records, sequence bytes and header bytes.
+        sequence_indptr (np.ndarray): start of each sequence in sequences.
+        sequences (np.ndarray): uint8 buffer for the sequences.
+        headers (np.ndarray): uint8 buffer for the headers.
+        record_offset (int): index of the first record of this chunk.
+        sequence_offset (int): position of the first sequence byte of this chunk.
+        header_offset (int): position of the first header byte of this chunk.
+        write (bool): flag to write to the buffers. If False, only counts are determined.
+    """
+    n_records = 0
+    n_sequence = 0
+    n_header = 0
+    pos = start
+
+    while pos < end:
+        line_end = pos
+        while (line_end < end) and (buffer[line_end] != 10) and (buffer[line_end] != 13):
+            line_end += 1
+
+        if buffer[pos] == 62:
+            if write:
+                sequence_indptr[record_offset + n_records] = sequence_offset + n_sequence
+                headers[header_offset + n_header: header_offset + n_header + line_end - pos - 1] = buffer[pos + 1: line_end]
+                headers[header_offset + n_header + line_end - pos - 1] = 10
+            n_records += 1
+            n_header += line_end - pos
+        elif n_records > 0:
+            for i in range(pos, line_end):
+                char = buffer[i]
+                if (char != 32) and ((char < 9) or (char > 13)):
+                    if write:
+                        sequences[sequence_offset + n_sequence] = char
+                    n_sequence += 1
+
+        # universal newlines: \n, \r and \r\n
+        if (line_end < end) and (buffer[line_end] == 13) and (line_end + 1 < end) and (buffer[line_end + 1] == 10):
+            line_end += 1
+        pos = line_end + 1
+
+    counts[0] = n_records
+    counts[1] = n_sequence
+    counts[2] = n_header
+
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def parse_fasta_chunks(idx:np.ndarray, buffer:np.ndarray, chunk_bounds:np.ndarray, counts:np.ndarray, offsets:np.ndarray, sequence_indptr:np.ndarray, sequences:np.ndarray, headers:np.ndarray, write:bool):
+    """
+    Parse chunks of a FASTA buffer in parallel. See parse_fasta_chunk.
+    Args:
+        idx (np.ndarray): Input index. Note that we are using the performance function so this is a range.
+        buffer (np.ndarray): uint8 array with the content of a FASTA file.
+        chunk_bounds (np.ndarray): start of each chunk, the last element is the end of the last chunk.
+        counts (np.ndarray): (n_chunks, 3) array to store the number of records, sequence bytes and header bytes per chunk.
+        offsets (np.ndarray): (n_chunks, 3) array with the offsets of each chunk in the output buffers.
+        sequence_indptr (np.ndarray): start of each sequence in sequences.
+        sequences (np.ndarray): uint8 buffer for the sequences.
+        headers (np.ndarray): uint8 buffer for the headers.
+        write (bool): flag to write to the buffers. If False, only counts are determined.
+    """
+    parse_fasta_chunk(buffer, chunk_bounds[idx], chunk_bounds[idx + 1], counts[idx], sequence_indptr, sequences, headers, offsets[idx, 0], offsets[idx, 1], offsets[idx, 2], write)
+
+
+class FastaRecords():
+    """
+    Compact container for the entries of FASTA files.
+    All sequences are stored in a single uint8 buffer, the sequence of entry i is sequences[sequence_indptr[i]:sequence_indptr[i+1]].
+    Header fields are stored as arrays.
+    Indexing with an integer returns the protein entry dict {id:str, name:str, description:str, sequence:str}, slicing returns a new FastaRecords object.
+    """
+    def __init__(self, sequences:np.ndarray, sequence_indptr:np.ndarray, ids:np.ndarray, names:np.ndarray, descriptions:np.ndarray):
+        self.sequences = sequences
+        self.sequence_indptr = sequence_indptr
+        self.ids = ids
+        self.names = names
+        self.descriptions = descriptions
+
+    @classmethod
+    def from_buffer(cls, buffer:np.ndarray, n_chunks:int = None):
+        """
+        Parse the content of a FASTA file in parallel chunks.
+        Text before the first record is ignored.
+        Args:
+            buffer (np.ndarray): uint8 array with the content of a FASTA file.
+            n_chunks (int, optional): number of chunks that are parsed in parallel. Defaults to four chunks per worker, with a minimum chunk size of 1 MB.
+        Returns:
+            FastaRecords: the parsed entries.
+        """
+        if n_chunks is None:
+            n_chunks = min(4 * alphapept.performance.MAX_WORKER_COUNT, len(buffer) // 2**20 + 1)
+
+        chunk_bounds = np.zeros(n_chunks + 1, dtype=np.int64)
+        for i in range(n_chunks):
+            chunk_bounds[i] = find_fasta_record_start(buffer, max(chunk_bounds[i - 1] if i > 0 else 0, i * len(buffer) // n_chunks))
+        chunk_bounds[-1] = len(buffer)
+
+        counts = np.zeros((n_chunks, 3), dtype=np.int64)
+        offsets = np.zeros((n_chunks, 3), dtype=np.int64)
+        empty = np.zeros(0, dtype=np.uint8)
+        parse_fasta_chunks(range(n_chunks), buffer, chunk_bounds, counts, offsets, np.zeros(0, dtype=np.int64), empty, empty, False)
+
+        offsets[1:] = np.cumsum(counts, axis=0)[:-1]
+        n_records, n_sequence, n_header = counts.sum(axis=0)
+
+        sequence_indptr = np.zeros(n_records + 1, dtype=np.int64)
+        sequences = np.empty(n_sequence, dtype=np.uint8)
+        headers = np.empty(n_header, dtype=np.uint8)
+        parse_fasta_chunks(range(n_chunks), buffer, chunk_bounds, counts, offsets, sequence_indptr, sequences, headers, True)
+        sequence_indptr[-1] = n_sequence
+
+        descriptions = [_.rstrip() for _ in headers.tobytes().decode(errors='replace').split('\n')[:-1]]
+        names = [_.split(None, 1)[0] if _ else '' for _ in descriptions]
+        ids = [_.split('|')[1] if '|' in _ else _ for _ in names]
+
+        return cls(sequences, sequence_indptr, np.array(ids, dtype=object), np.array(names, dtype=object), np.array(descriptions, dtype=object))
+
+    @classmethod
+    def concatenate(cls, records:list):
+        """
+        Concatenate several FastaRecords objects.
+        Args:
+            records (list of FastaRecords): records to concatenate.
+        Returns:
+            FastaRecords: the concatenated entries.
+        """
+        indptrs = [np.zeros(1, dtype=np.int64)]
+        offset = 0
+        for _ in records:
+            indptrs.append(_.sequence_indptr[1:] + offset)
+            offset += _.sequence_indptr[-1]
+
+        return cls(
+            np.concatenate([np.zeros(0, dtype=np.uint8)] + [_.sequences for _ in records]),
+            np.concatenate(indptrs),
+            *[np.concatenate([np.zeros(0, dtype=object)] + [getattr(_, field) for _ in records]) for field in ['ids', 'names', 'descriptions']]
+        )
+
+    def __len__(self)->int:
+        return len(self.ids)
+
+    def get_sequence(self, idx:int)->str:
+        """
+        Get the sequence of an entry.
+        Args:
+            idx (int): index of the entry.
+        Returns:
+            str: protein sequence.
+        """
+        return self.sequences[self.sequence_indptr[idx]:self.sequence_indptr[idx + 1]].tobytes().decode()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                return self.__class__(
+                    self.sequences[self.sequence_indptr[start]:self.sequence_indptr[stop]],
+                    self.sequence_indptr[start:stop + 1] - self.sequence_indptr[start],
+                    self.ids[key], self.names[key], self.descriptions[key]
+                )
+            selection = np.arange(start, stop, step)
+            indptr, positions = alphapept.io.gather_ragged(self.sequence_indptr, selection)
+            return self.__class__(self.sequences[positions], indptr, self.ids[key], self.names[key], self.descriptions[key])
+
+        if key < 0:
+            key += len(self)
+        if (key < 0) or (key >= len(self)):
+            raise IndexError('FastaRecords index out of range')
+
+        return {
+            "id": self.ids[key],
+            "name": self.names[key],
+            "description": self.descriptions[key],
+            "sequence": self.get_sequence(key),
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def valid_sequences(self, AAs:set)->np.ndarray:
+        """
+        Checks for all sequences whether they contain only valid AAs. See check_sequence.
+        Args:
+            AAs (set): a set of amino acid letters.
+        Returns:
+            np.ndarray: boolean mask, False if the protein sequence contains non-AA letters.
+        """
+        valid = np.zeros(256, dtype=np.bool_)
+        valid[[ord(_) for _ in AAs]] = True
+        n_invalid = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(~valid[self.sequences])])
+
+        return n_invalid[self.sequence_indptr[1:]] == n_invalid[self.sequence_indptr[:-1]]
+
+    def __repr__(self)->str:
+        return f"FastaRecords with {len(self):,} entries and {len(self.sequences):,} AAs"
+
+
+def read_fasta_buffers(fasta_filename:str, chunk_size:int = 2**26):
+    """
+    Read the content of a FASTA file as byte buffers that start at record boundaries.
+    Uncompressed files are memory mapped as a single buffer.
+    Gzip compressed files are decompressed in chunks of chunk_size bytes. The record that is cut at the end of a chunk is carried over to the next buffer, so that only about one chunk is kept in memory.
+    Args:
+        fasta_filename (str): fasta.
+        chunk_size (int, optional): number of decompressed bytes that are read at once. Defaults to 2**26.
+    Yields:
+        np.ndarray: uint8 array with the content of complete records.
+    """
+    with open(fasta_filename, "rb") as handle:
+        is_gzip = handle.read(2) == b'\x1f\x8b'
+
+    if not is_gzip:
+        if os.path.getsize(fasta_filename) > 0:
+            yield np.memmap(fasta_filename, dtype=np.uint8, mode="r")
+        return
+
+    carry = np.zeros(0, dtype=np.uint8)
+    with gzip.open(fasta_filename, "rb") as handle:
+        while True:
+            block = handle.read(chunk_size)
+            if not block:
+                break
+            buffer = np.concatenate([carry, np.frombuffer(block, dtype=np.uint8)])
+            cut = find_last_fasta_record_start(buffer)
+            if cut > 0:
+                yield buffer[:cut]
+                carry = buffer[cut:].copy()
+            else:
+                carry = buffer
+
+    if len(carry) > 0:
+        yield carry
+
+
+def read_fasta_records(fasta_filename:str, n_chunks:int = None, chunk_size:int = 2**26)->FastaRecords:
+    """
+    Read all entries of a (gzip compressed) FASTA file in a single pass.
+    Args:
+        fasta_filename (str): fasta.
+        n_chunks (int, optional): number of chunks that are parsed in parallel. See FastaRecords.from_buffer.
+        chunk_size (int, optional): number of decompressed bytes of gzip compressed files that are parsed at once. See read_fasta_buffers.
+    Returns:
+        FastaRecords: the entries of the FASTA file.
+    """
+    records = [FastaRecords.from_buffer(_, n_chunks) for _ in read_fasta_buffers(fasta_filename, chunk_size)]
+    if len(records) == 1:
+        return records[0]
+
+    return FastaRecords.concatenate(records)
+
 
 def read_fasta_file(fasta_filename:str=""):
     """
-    Read a FASTA file line by line
+    Read a FASTA file entry by entry
     Args:
         fasta_filename (str): fasta.
     Yields:
         dict {id:str, name:str, description:str, sequence:str}: protein information.
     """
-    with open(fasta_filename, "rt") as handle:
-        iterator = SeqIO.parse(handle, "fasta")
-        while iterator:
-            try:
-                record = next(iterator)
-                parts = record.id.split("|")  # pipe char
-                if len(parts) > 1:
-                    id = parts[1]
-                else:
-                    id = record.name
-                sequence = str(record.seq)
-                entry = {
-                    "id": id,
-                    "name": record.name,
-                    "description": record.description,
-                    "sequence": sequence,
-                }
-
-                yield entry
-            except StopIteration:
-                break
+    yield from read_fasta_records(fasta_filename)
 
 
 def read_fasta_file_entries(fasta_filename=""):
@@ -692,17 +1402,7 @@ def read_fasta_file_entries(fasta_filename=""):
     Returns:
         int: number of entries.
     """
-    with open(fasta_filename, "rt") as handle:
-        iterator = SeqIO.parse(handle, "fasta")
-        count = 0
-        while iterator:
-            try:
-                record = next(iterator)
-                count+=1
-            except StopIteration:
-                break
-
-        return count
+    return sum(count_fasta_records(_) for _ in read_fasta_buffers(fasta_filename))
 
 
 def check_sequence(element:dict, AAs:set, verbose:bool = False)->bool:
@@ -723,8 +1423,6 @@ def check_sequence(element:dict, AAs:set, verbose:bool = False)->bool:
     else:
         return True
 
-
-
 # Cell
 def add_to_pept_dict(pept_dict:dict, new_peptides:list, i:int)->tuple:
     """
@@ -774,6 +1472,189 @@ def merge_pept_dicts(list_of_pept_dicts:list)->dict:
 
     return new_pept_dict
 
+# Cell
+import pandas as pd
+import alphapept.io
+
+class PeptideProteinMap(object):
+    """Dictionary-like mapping of peptide sequences to protein indices in CSR format."""
+
+    def __init__(self, sequences:np.ndarray, protein_indptr:np.ndarray, protein_indices:np.ndarray):
+        """Create a map from CSR arrays.
+
+        Args:
+            sequences (np.ndarray): Unique peptide sequences.
+            protein_indptr (np.ndarray): Proteins of sequence i are stored at protein_indices[protein_indptr[i]:protein_indptr[i+1]].
+            protein_indices (np.ndarray): Flat array with the protein indices.
+        """
+        self.sequences = np.asarray(sequences, dtype=object)
+        self.protein_indptr = np.asarray(protein_indptr, dtype=np.int64)
+        self.protein_indices = np.asarray(protein_indices, dtype=np.int64)
+
+        if len(self.protein_indptr) != len(self.sequences) + 1:
+            raise ValueError('protein_indptr needs to have one element more than sequences.')
+
+        self._index = None
+
+    @classmethod
+    def from_dict(cls, pept_dict:dict):
+        """Create a map from a peptide dict. See add_to_pept_dict()."""
+        if isinstance(pept_dict, cls):
+            return pept_dict
+
+        sequences = np.array(list(pept_dict), dtype=object)
+        protein_indptr = np.zeros(len(sequences) + 1, dtype=np.int64)
+        protein_indptr[1:] = np.cumsum([len(pept_dict[_]) for _ in sequences])
+        protein_indices = np.fromiter((p for _ in sequences for p in pept_dict[_]), dtype=np.int64, count=protein_indptr[-1])
+
+        return cls(sequences, protein_indptr, protein_indices)
+
+    @classmethod
+    def from_pairs(cls, sequences:np.ndarray, protein_indices:np.ndarray, drop_duplicates:bool = False):
+        """Create a map from (sequence, protein index) pairs.
+
+        Sequences keep the order of their first occurrence, and the proteins of each sequence keep the order in which they were passed.
+
+        Args:
+            sequences (np.ndarray): Peptide sequence of each pair.
+            protein_indices (np.ndarray): Protein index of each pair.
+            drop_duplicates (bool, optional): Flag to remove duplicate pairs. Defaults to False.
+        """
+        codes, uniques = pd.factorize(np.asarray(sequences, dtype=object))
+        protein_indices = np.asarray(protein_indices, dtype=np.int64)
+
+        if drop_duplicates and len(codes) > 0:
+            keep = ~pd.DataFrame({'c': codes, 'p': protein_indices}).duplicated().values
+            codes, protein_indices = codes[keep], protein_indices[keep]
+
+        order = np.argsort(codes, kind='stable')
+        protein_indptr = np.zeros(len(uniques) + 1, dtype=np.int64)
+        protein_indptr[1:] = np.cumsum(np.bincount(codes, minlength=len(uniques)))
+
+        return cls(np.asarray(uniques, dtype=object), protein_indptr, protein_indices[order])
+
+    @classmethod
+    def merge(cls, list_of_maps:list, drop_duplicates:bool = False):
+        """Merge a list of maps or peptide dicts into a single map. See merge_pept_dicts().
+
+        Args:
+            list_of_maps (list): maps or peptide dicts.
+            drop_duplicates (bool, optional): Flag to remove proteins that are listed for a sequence in more than one map. Defaults to False.
+        """
+        if len(list_of_maps) == 0:
+            raise ValueError('Need to pass at least 1 element.')
+
+        maps = [cls.from_dict(_) for _ in list_of_maps]
+        sequences = np.concatenate([np.repeat(_.sequences, np.diff(_.protein_indptr)) for _ in maps])
+        protein_indices = np.concatenate([_.protein_indices for _ in maps])
+
+        return cls.from_pairs(sequences, protein_indices, drop_duplicates=drop_duplicates)
+
+    @property
+    def index(self)->pd.Index:
+        """Hashed index of the sequences, built on first use."""
+        if self._index is None:
+            self._index = pd.Index(self.sequences)
+
+        return self._index
+
+    def get_loc(self, sequences:np.ndarray)->np.ndarray:
+        """Get the positions of multiple sequences in the map.
+
+        Args:
+            sequences (np.ndarray): Peptide sequences.
+
+        Raises:
+            KeyError: If a sequence is not in the map.
+
+        Returns:
+            np.ndarray: Position of each sequence.
+        """
+        locs = self.index.get_indexer(np.asarray(sequences, dtype=object))
+        if (locs < 0).any():
+            missing = np.asarray(sequences, dtype=object)[locs < 0]
+            raise KeyError(f'{len(missing):,} sequences not in peptide map, e.g. {missing[0]}.')
+
+        return locs
+
+    def n_proteins(self, sequences:np.ndarray)->np.ndarray:
+        """Get the number of proteins of multiple sequences."""
+        locs = self.get_loc(sequences)
+
+        return self.protein_indptr[locs + 1] - self.protein_indptr[locs]
+
+    def get_proteins(self, sequences:np.ndarray)->(np.ndarray, np.ndarray):
+        """Get the proteins of multiple sequences.
+
+        Args:
+            sequences (np.ndarray): Peptide sequences.
+
+        Returns:
+            np.ndarray: Indices of the proteins, the proteins of sequence i are stored at indices[i]:indices[i+1].
+            np.ndarray: Flat array with the protein indices.
+        """
+        locs = self.get_loc(sequences)
+        indices, positions = alphapept.io.gather_ragged(self.protein_indptr, locs)
+
+        return indices, self.protein_indices[positions]
+
+    def __getitem__(self, sequence:str)->list:
+        loc = self.index.get_indexer([sequence])[0]
+        if loc < 0:
+            raise KeyError(sequence)
+
+        return self.protein_indices[self.protein_indptr[loc]:self.protein_indptr[loc + 1]].tolist()
+
+    def __contains__(self, sequence:str)->bool:
+        return sequence in self.index
+
+    def __len__(self)->int:
+        return len(self.sequences)
+
+    def __iter__(self):
+        return iter(self.sequences)
+
+    def keys(self):
+        return iter(self.sequences)
+
+    def values(self):
+        for start, end in zip(self.protein_indptr[:-1], self.protein_indptr[1:]):
+            yield self.protein_indices[start:end].tolist()
+
+    def items(self):
+        return zip(self.sequences, self.values())
+
+    def get(self, sequence:str, default=None):
+        if sequence in self:
+            return self[sequence]
+
+        return default
+
+    def to_dict(self)->dict:
+        """Convert the map to a peptide dict. See add_to_pept_dict()."""
+        return dict(self.items())
+
+    def __eq__(self, other)->bool:
+        if isinstance(other, dict):
+            other = PeptideProteinMap.from_dict(other)
+        if not isinstance(other, PeptideProteinMap):
+            return NotImplemented
+
+        return (
+            np.array_equal(self.sequences, other.sequences)
+            and np.array_equal(self.protein_indptr, other.protein_indptr)
+            and np.array_equal(self.protein_indices, other.protein_indices)
+        )
+
+    def __getstate__(self)->dict:
+        state = self.__dict__.copy()
+        state['_index'] = None
+
+        return state
+
+    def __repr__(self)->str:
+        return f'PeptideProteinMap with {len(self):,} sequences and {len(self.protein_indices):,} protein entries'
+
 # Cell
 from collections import OrderedDict
 
@@ -784,33 +1665,19 @@ def generate_fasta_list(fasta_paths:list, callback = None, **kwargs)->tuple:
         fasta_paths (str or list of str): fasta path or a list of fasta paths.
         callback (function, optional): callback function.
     Returns:
-        fasta_list (list of dict): list of protein entry dict {id:str, name:str, description:str, sequence:str}.
+        fasta_list (FastaRecords): compact container of the protein entries, indexing returns the protein entry dict {id:str, name:str, description:str, sequence:str}.
         fasta_dict (dict{int:dict}): the key is the protein id, the value is the protein entry dict.
     """
-    fasta_list = []
-
-    fasta_dict = OrderedDict()
-
-    fasta_index = 0
-
     if type(fasta_paths) is str:
         fasta_paths = [fasta_paths]
-        n_fastas = 1
-
-    elif type(fasta_paths) is list:
-        n_fastas = len(fasta_paths)
-
-    for f_id, fasta_file in enumerate(fasta_paths):
-        n_entries = read_fasta_file_entries(fasta_file)
 
-        fasta_generator = read_fasta_file(fasta_file)
+    fasta_list = FastaRecords.concatenate([read_fasta_records(fasta_file) for fasta_file in fasta_paths])
 
-        for element in fasta_generator:
-            check_sequence(element, constants.AAs)
-            fasta_list.append(element)
-            fasta_dict[fasta_index] = element
-            fasta_index += 1
+    n_invalid = len(fasta_list) - np.sum(fasta_list.valid_sequences(constants.AAs))
+    if n_invalid > 0:
+        logging.info(f'{n_invalid:,} FASTA entries contain unknown AAs - Peptides with unknown AAs will be skipped.')
 
+    fasta_dict = OrderedDict(enumerate(fasta_list))
 
     return fasta_list, fasta_dict
 
@@ -844,14 +1711,13 @@ def generate_database(mass_dict:dict, fasta_paths:list, callback = None, **kwarg
         n_fastas = len(fasta_paths)
 
     for f_id, fasta_file in enumerate(fasta_paths):
-        n_entries = read_fasta_file_entries(fasta_file)
-
-        fasta_generator = read_fasta_file(fasta_file)
+        fasta_records = read_fasta_records(fasta_file)
+        n_entries = len(fasta_records)
 
-        for element in fasta_generator:
+        for element in fasta_records:
 
             fasta_dict[fasta_index] = element
-            mod_peptides = generate_peptides(element["sequence"], **kwargs)
+            mod_peptides = generate_peptides_compiled(element["sequence"], **kwargs)
             pept_dict, added_seqs = add_to_pept_dict(pept_dict, mod_peptides, fasta_index)
             if len(added_seqs) > 0:
                 to_add.extend(added_seqs)
@@ -936,8 +1802,21 @@ from multiprocessing import Pool
 from alphapept import constants
 mass_dict = constants.mass_dict
 
+# Peptides that are already in a database and need no spectra, see update_database
+_known_peptides = None
+
+def set_known_peptides(sequences:np.ndarray):
+    """
+    Set peptides for which digest_fasta_block does not generate spectra. Used as initializer of worker processes.
+
+    Args:
+        sequences (np.ndarray): peptide sequences or None.
+    """
+    global _known_peptides
+    _known_peptides = set(sequences) if sequences is not None else None
+
 #This function is a wrapper function and to be tested by the integration test
-def digest_fasta_block(to_process:tuple)-> (list, dict):
+def digest_fasta_block(to_process:tuple)-> (list, PeptideProteinMap):
     """
     Digest and create spectra for a whole fasta_block for multiprocessing. See generate_database_parallel.
     """
@@ -951,8 +1830,10 @@ def digest_fasta_block(to_process:tuple)-> (list, dict):
     pept_dict = {}
     for element in fasta_block:
         sequence = element["sequence"]
-        mod_peptides = generate_peptides(sequence, **settings['fasta'])
+        mod_peptides = generate_peptides_compiled(sequence, **settings['fasta'])
         pept_dict, added_peptides = add_to_pept_dict(pept_dict, mod_peptides, fasta_index+f_index)
+        if _known_peptides is not None:
+            added_peptides = [_ for _ in added_peptides if _ not in _known_peptides]
         if len(added_peptides) > 0:
             to_add.extend(added_peptides)
         f_index += 1
@@ -962,7 +1843,7 @@ def digest_fasta_block(to_process:tuple)-> (list, dict):
         for specta_block in blocks(to_add, settings['fasta']['spectra_block']):
             spectra.extend(generate_spectra(specta_block, mass_dict))
 
-    return (spectra, pept_dict)
+    return (spectra, PeptideProteinMap.from_dict(pept_dict))
 
 import alphapept.performance
 
@@ -974,7 +1855,7 @@ def generate_database_parallel(settings:dict, callback = None):
         settings: alphapept settings.
     Returns:
         list: theoretical spectra. See generate_spectra()
-        dict: peptide dict. See add_to_pept_dict()
+        PeptideProteinMap: peptide dict. See PeptideProteinMap.
         dict: fasta_dict. See generate_fasta_list()
     """
 
@@ -1005,7 +1886,7 @@ def generate_database_parallel(settings:dict, callback = None):
     spectra_set = [spectra[idx] for idx in range(len(spectra)-1) if spectra[idx][1] != spectra[idx+1][1]]
     spectra_set.append(spectra[-1])
 
-    pept_dict = merge_pept_dicts(pept_dicts)
+    pept_dict = PeptideProteinMap.merge(pept_dicts)
 
     return spectra_set, pept_dict, fasta_dict
 
@@ -1013,7 +1894,7 @@ def generate_database_parallel(settings:dict, callback = None):
 #This function is a wrapper function and to be tested by the integration test
 def pept_dict_from_search(settings:dict):
     """
-    Generates a peptide dict from a large search.
+    Generates a peptide dict from a large search. See PeptideProteinMap.
     """
 
     paths = settings['experiment']['file_paths']
@@ -1044,73 +1925,67 @@ def pept_dict_from_search(settings:dict):
         ).assign(**{lst_col:np.concatenate(df[lst_col].values)})[df.columns]
 
     df_['fasta_index'] = df_['fasta_index'].astype('int')
-    df_grouped = df_.groupby(['sequence'])['fasta_index'].unique()
+    df_ = df_.sort_values('sequence', kind='mergesort')
 
-    pept_dict = {}
-    for keys, vals in zip(df_grouped.index, df_grouped.values):
-        pept_dict[keys] = vals.tolist()
+    pept_dict = PeptideProteinMap.from_pairs(df_['sequence'].values, df_['fasta_index'].values, drop_duplicates=True)
 
     return pept_dict
 
 # Cell
 import alphapept.io
 import pandas as pd
+from typing import Union
 
-def save_database(spectra:list, pept_dict:dict, fasta_dict:dict, database_path:str, **kwargs):
+def save_database(spectra:list, pept_dict:Union[dict, PeptideProteinMap], fasta_dict:dict, database_path:str, **kwargs):
     """
     Function to save a database to the *.hdf format. Write the database into hdf.
 
     Args:
         spectra (list): list: theoretical spectra. See generate_spectra().
-        pept_dict (dict): peptide dict. See add_to_pept_dict().
+        pept_dict (Union[dict, PeptideProteinMap]): peptide dict. See add_to_pept_dict() and PeptideProteinMap.
         fasta_dict (dict): fasta_dict. See generate_fasta_list().
         database_path (str): Path to database.
     """
 
     precmasses, seqs, fragmasses, fragtypes = zip(*spectra)
-    sortindex = np.argsort(precmasses)
-    fragmasses = np.array(fragmasses, dtype=object)[sortindex]
-    fragtypes = np.array(fragtypes, dtype=object)[sortindex]
-
-    lens = [len(_) for _ in fragmasses]
-
-    n_frags = sum(lens)
-
-    frags = np.zeros(n_frags, dtype=fragmasses[0].dtype)
-    frag_types = np.zeros(n_frags, dtype=fragtypes[0].dtype)
+    precmasses = np.array(precmasses)
+    seqs = np.array(seqs, dtype=object)
+    # Sort by precursor mass, ties by sequence so that the order is reproducible
+    sortindex = np.lexsort((seqs, precmasses))
 
-    indices = np.zeros(len(lens) + 1, np.int64)
-    indices[1:] = lens
-    indices = np.cumsum(indices)
-
-    #Fill data
-
-    for _ in range(len(indices)-1):
-
-        start = indices[_]
-        end = indices[_+1]
-        frags[start:end] = fragmasses[_]
-        frag_types[start:end] = fragtypes[_]
+    indices = np.zeros(len(sortindex) + 1, np.int64)
+    indices[1:] = np.cumsum([len(fragmasses[_]) for _ in sortindex])
 
     to_save = {}
 
-    to_save["precursors"] = np.array(precmasses)[sortindex]
-    to_save["seqs"] = np.array(seqs, dtype=object)[sortindex]
+    to_save["precursors"] = precmasses[sortindex]
+    to_save["seqs"] = seqs[sortindex]
     to_save["proteins"] = pd.DataFrame(fasta_dict).T
 
-    to_save["fragmasses"] = frags
-    to_save["fragtypes"] = frag_types
+    to_save["fragmasses"] = np.concatenate([fragmasses[_] for _ in sortindex])
+    to_save["fragtypes"] = np.concatenate([fragtypes[_] for _ in sortindex])
     to_save["indices"] = indices
 
     db_file = alphapept.io.HDF_File(database_path, is_new_file=True)
-    for key, value in to_save.items():
-        db_file.write(value, dataset_name=key)
+    with db_file.session():
+        for key, value in to_save.items():
+            db_file.write(value, dataset_name=key)
+
+        write_pept_dict(db_file, pept_dict)
+
+
+def write_pept_dict(db_file:alphapept.io.HDF_File, pept_dict:Union[dict, PeptideProteinMap]):
+    """
+    Write a peptide dict in CSR format to the peptides group of a database.
 
-    peps = np.array(list(pept_dict), dtype=object)
-    indices = np.empty(len(peps) + 1, dtype=np.int64)
-    indices[0] = 0
-    indices[1:] = np.cumsum([len(pept_dict[i]) for i in peps])
-    proteins = np.concatenate([pept_dict[i] for i in peps])
+    Args:
+        db_file (alphapept.io.HDF_File): the database file.
+        pept_dict (Union[dict, PeptideProteinMap]): peptide dict. See add_to_pept_dict() and PeptideProteinMap.
+    """
+    pept_map = PeptideProteinMap.from_dict(pept_dict)
+    peps = pept_map.sequences
+    indices = pept_map.protein_indptr
+    proteins = pept_map.protein_indices
 
     db_file.write("peptides")
     db_file.write(
@@ -1163,16 +2038,686 @@ def read_database(database_path:str, array_name:str=None)->dict:
             dataset_name="protein_indices",
             group_name="peptides"
         )
-        db_data["pept_dict"] = np.array(
-            {
-                pep: (protein_indices[s: e]).tolist() for pep, s, e in zip(
-                    peps,
-                    protein_indptr[:-1],
-                    protein_indptr[1:],
-                )
-            }
+        db_data["pept_dict"] = np.empty((), dtype=object)
+        db_data["pept_dict"][()] = PeptideProteinMap(
+            peps,
+            protein_indptr,
+            protein_indices
         )
         db_data["seqs"] = db_data["seqs"].astype(str)
     else:
         db_data = db_file.read(dataset_name=array_name)
-    return db_data
\ No newline at end of file
+    return db_data
+
+# Cell
+import h5py
+
+class Database(object):
+    """Lazy, dictionary-like accessor to a database that was saved with `save_database`."""
+
+    PEPTIDE_ARRAYS = ['sequences', 'protein_indptr', 'protein_indices']
+
+    def __init__(self, database_path:str, mmap:bool = True):
+        """Open a database for lazy access.
+
+        Args:
+            database_path (str): Path to the database.
+            mmap (bool, optional): Flag to memory-map numeric arrays instead of reading them. Defaults to True.
+        """
+        self.database_path = database_path
+        self.mmap = mmap
+        self._db_file = alphapept.io.HDF_File(database_path)
+        self._arrays = {}
+
+    def keys(self)->list:
+        """Return the names of all arrays in the database."""
+        keys = [_ for _ in self._db_file.read() if _ not in ("proteins", "peptides")]
+
+        return keys + self.PEPTIDE_ARRAYS + ["fasta_dict", "pept_dict"]
+
+    def __contains__(self, key:str)->bool:
+        return key in self.keys()
+
+    def __getitem__(self, key:str):
+        if key not in self._arrays:
+            self._arrays[key] = self._load(key)
+
+        return self._arrays[key]
+
+    def _load(self, key:str):
+        if key == "fasta_dict":
+            return collections.OrderedDict(self._db_file.read(dataset_name="proteins").T)
+        if key == "pept_dict":
+            return PeptideProteinMap(
+                self["sequences"],
+                self["protein_indptr"],
+                self["protein_indices"]
+            )
+        if key not in self.keys():
+            raise KeyError(f"{key} not in database {self.database_path}.")
+
+        group_name = "peptides" if key in self.PEPTIDE_ARRAYS else None
+
+        array = self._db_file.read(dataset_name=key, group_name=group_name, mmap=self.mmap)
+        if key == "seqs":
+            array = array.astype(str)
+
+        return array
+
+# Cell
+import os
+import shutil
+import tempfile
+from typing import Callable
+
+#This function is a wrapper function and to be tested by the integration test
+def digest_fasta_block_to_shard(to_process:tuple)->(str, int, PeptideProteinMap):
+    """
+    Digest a fasta_block and write the spectra to a temporary database shard. See generate_database_streaming.
+
+    Args:
+        to_process (tuple): fasta_index, fasta_block, settings and the path of the shard.
+
+    Returns:
+        str: path of the shard or None if no spectra were generated.
+        int: number of spectra in the shard.
+        PeptideProteinMap: peptide dict of the block.
+    """
+    fasta_index, fasta_block, settings, shard_path = to_process
+
+    spectra, pept_dict = digest_fasta_block((fasta_index, fasta_block, settings))
+
+    if len(spectra) == 0:
+        return None, 0, pept_dict
+
+    save_database(spectra, pept_dict, {}, shard_path)
+
+    return shard_path, len(spectra), pept_dict
+
+
+def _copy_to_dataset(hdf_file:h5py.File, dataset_name:str, raw_path:str, dtype:np.dtype, chunk_size:int):
+    """Copy a raw binary file chunk-wise into a new contiguous dataset."""
+    n = os.path.getsize(raw_path) // np.dtype(dtype).itemsize
+    dataset = hdf_file.create_dataset(dataset_name, shape=(n,), dtype=dtype)
+    if n > 0:
+        raw = np.memmap(raw_path, mode='r', dtype=dtype, shape=(n,))
+        for start in range(0, n, chunk_size):
+            dataset[start:start + chunk_size] = raw[start:start + chunk_size]
+        del raw
+
+
+def merge_database_shards(shard_paths:list, pept_dict:Union[dict, PeptideProteinMap], fasta_dict:dict, database_path:str, chunk_size:int = 1000000, callback:Callable = None)->int:
+    """
+    Merge database shards that are sorted by precursor mass into a single database.
+    All arrays, including the sequences, are written to temporary files per round,
+    so memory use depends on chunk_size and not on the size of the database.
+
+    Args:
+        shard_paths (list of str): paths to the shards. See digest_fasta_block_to_shard().
+        pept_dict (Union[dict, PeptideProteinMap]): peptide dict of the whole database.
+        fasta_dict (dict): fasta_dict. See generate_fasta_list().
+        database_path (str): Path to database.
+        chunk_size (int, optional): Number of spectra that are merged per round. Defaults to 1000000.
+        callback (Callable, optional): Callback function to indicate progress. Defaults to None.
+
+    Returns:
+        int: number of unique spectra in the database.
+    """
+    shards = [Database(_) for _ in shard_paths]
+    n_shards = len(shards)
+    shard_chunk = max(1, chunk_size // max(n_shards, 1))
+
+    precursors = [_["precursors"] for _ in shards]
+    n_spectra = np.array([len(_) for _ in precursors], dtype=np.int64)
+    cursors = np.zeros(n_shards, dtype=np.int64)
+
+    seq_files = [h5py.File(_, "r") for _ in shard_paths]
+    seq_datasets = [_["seqs"].asstr() for _ in seq_files]
+
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(database_path)))
+    raw_paths = {_: os.path.join(temp_dir, _ + '.bin') for _ in ["precursors", "fragmasses", "fragtypes", "lens"]}
+    raw_dtypes = {"precursors": np.float64, "lens": np.int64}
+    for _ in ["fragmasses", "fragtypes"]:
+        raw_dtypes[_] = shards[0][_].dtype if n_shards > 0 else np.float64
+
+    seq_out_file = None
+
+    try:
+        raw_files = {_: open(raw_paths[_], 'wb') for _ in raw_paths}
+        seq_out_file = h5py.File(os.path.join(temp_dir, 'seqs.hdf'), "w")
+        seq_out = seq_out_file.create_dataset("seqs", shape=(0,), maxshape=(None,), chunks=True, dtype=h5py.string_dtype())
+
+        while (cursors < n_spectra).any():
+            active = np.flatnonzero(cursors < n_spectra)
+
+            # All spectra up to the smallest window end of non-exhausted shards can be merged safely
+            threshold = np.inf
+            for i in active:
+                window_end = cursors[i] + shard_chunk
+                if window_end < n_spectra[i]:
+                    threshold = min(threshold, precursors[i][window_end - 1])
+
+            precs, seqs, lens, masses, types = [], [], [], [], []
+            for i in active:
+                start = cursors[i]
+                end = start + np.searchsorted(precursors[i][start:], threshold, side="right")
+                if end == start:
+                    continue
+                indices = shards[i]["indices"][start:end + 1]
+
+                precs.append(np.asarray(precursors[i][start:end]))
+                seqs.append(np.asarray(seq_datasets[i][start:end], dtype=object))
+                lens.append(np.diff(indices))
+                masses.append(np.asarray(shards[i]["fragmasses"][indices[0]:indices[-1]]))
+                types.append(np.asarray(shards[i]["fragtypes"][indices[0]:indices[-1]]))
+                cursors[i] = end
+
+            precs = np.concatenate(precs)
+            seqs = np.concatenate(seqs)
+            lens = np.concatenate(lens)
+            masses = np.concatenate(masses)
+            types = np.concatenate(types)
+
+            order = np.lexsort((seqs, precs))
+            unique = np.ones(len(order), dtype=np.bool_)
+            unique[1:] = (precs[order][1:] != precs[order][:-1]) | (seqs[order][1:] != seqs[order][:-1])
+            order = order[unique]
+
+            indptr = np.zeros(len(lens) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum(lens)
+            _, positions = alphapept.io.gather_ragged(indptr, order)
+
+            precs[order].tofile(raw_files["precursors"])
+            lens[order].tofile(raw_files["lens"])
+            masses[positions].tofile(raw_files["fragmasses"])
+            types[positions].tofile(raw_files["fragtypes"])
+            n_seqs = len(seq_out)
+            seq_out.resize((n_seqs + len(order),))
+            seq_out[n_seqs:] = seqs[order]
+
+            if callback:
+                callback(cursors.sum() / n_spectra.sum())
+
+        for _ in raw_files.values():
+            _.close()
+
+        for _ in seq_files:
+            _.close()
+
+        lens = np.fromfile(raw_paths["lens"], dtype=np.int64)
+        indices = np.zeros(len(lens) + 1, dtype=np.int64)
+        indices[1:] = np.cumsum(lens)
+        del lens
+
+        db_file = alphapept.io.HDF_File(database_path, is_new_file=True)
+        db_file.write(np.fromfile(raw_paths["precursors"], dtype=np.float64), dataset_name="precursors")
+        db_file.write(pd.DataFrame(fasta_dict).T, dataset_name="proteins")
+        db_file.write(indices, dataset_name="indices")
+
+        with h5py.File(db_file.file_name, "a") as hdf_file:
+            seqs = hdf_file.create_dataset("seqs", shape=seq_out.shape, dtype=h5py.string_dtype())
+            for start in range(0, len(seq_out), chunk_size):
+                seqs[start:start + chunk_size] = seq_out[start:start + chunk_size]
+            for _ in ["fragmasses", "fragtypes"]:
+                _copy_to_dataset(hdf_file, _, raw_paths[_], raw_dtypes[_], chunk_size * 50)
+
+        write_pept_dict(db_file, pept_dict)
+
+    finally:
+        for _ in seq_files:
+            _.close()
+        if seq_out_file is not None:
+            seq_out_file.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return len(indices) - 1
+
+
+#This function is a wrapper function and to be tested by the integration test
+def generate_database_streaming(settings:dict, database_path:str, callback:Callable = None, chunk_size:int = 1000000)->(int, PeptideProteinMap, dict):
+    """
+    Generate a database from a fasta file in parallel and write it with bounded memory.
+
+    Args:
+        settings (dict): alphapept settings.
+        database_path (str): Path to database.
+        callback (Callable, optional): Callback function to indicate progress. Defaults to None.
+        chunk_size (int, optional): Number of spectra that are merged per round. Defaults to 1000000.
+
+    Returns:
+        int: number of spectra in the database.
+        PeptideProteinMap: peptide dict. See PeptideProteinMap.
+        dict: fasta_dict. See generate_fasta_list().
+    """
+    n_processes = alphapept.performance.set_worker_count(
+        worker_count=settings['general']['n_processes'],
+        set_global=False
+    )
+
+    fasta_list, fasta_dict = generate_fasta_list(fasta_paths = settings['experiment']['fasta_paths'], **settings['fasta'])
+
+    logging.info(f'FASTA contains {len(fasta_list):,} entries.')
+
+    shard_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(database_path)))
+
+    try:
+        to_process = [
+            (idx_start, fasta_list[idx_start:idx_end], settings, os.path.join(shard_dir, f'shard_{i}.hdf')) for i, (idx_start, idx_end) in enumerate(block_idx(len(fasta_list), settings['fasta']['fasta_block']))
+        ]
+
+        shard_paths = []
+        pept_dicts = []
+        with Pool(n_processes) as p:
+            max_ = len(to_process)
+            for i, (shard_path, n_spectra, pept_dict) in enumerate(p.imap(digest_fasta_block_to_shard, to_process)):
+                if callback:
+                    callback((i+1)/max_/2)
+                if shard_path is not None:
+                    shard_paths.append(shard_path)
+                if len(pept_dict) > 0:
+                    pept_dicts.append(pept_dict)
+
+        pept_dict = PeptideProteinMap.merge(pept_dicts)
+
+        if callback:
+            merge_callback = lambda x: callback(0.5 + x/2)
+        else:
+            merge_callback = None
+
+        n_spectra = merge_database_shards(shard_paths, pept_dict, fasta_dict, database_path, chunk_size=chunk_size, callback=merge_callback)
+        write_database_attributes(database_path, settings['experiment']['fasta_paths'], settings['fasta'])
+
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    return n_spectra, pept_dict, fasta_dict
+
+# Cell
+import hashlib
+import json
+import time
+import alphapept.paths
+from .__main__ import VERSION_NO
+
+DATABASE_CACHE_IGNORED_SETTINGS = ['spectra_block', 'fasta_block', 'save_db', 'fasta_size_max', 'database_cache', 'database_cache_path', 'database_cache_size', 'database_cache_lease', 'database_update']
+
+def hash_file(file_path:str, block_size:int = 2**20)->str:
+    """
+    Calculate the SHA-256 hash of a file.
+
+    Args:
+        file_path (str): Path to the file.
+        block_size (int, optional): Number of bytes that are read at once. Defaults to 2**20.
+
+    Returns:
+        str: hex digest of the hash.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def get_database_key(fasta_paths:list, fasta_settings:dict)->str:
+    """
+    Get the content-addressed key of the database for FASTA files and digestion settings.
+
+    Args:
+        fasta_paths (list of str): Paths to the FASTA files.
+        fasta_settings (dict): The fasta section of the alphapept settings.
+
+    Returns:
+        str: hex digest of the key.
+    """
+    settings = {key: value for key, value in fasta_settings.items() if key not in DATABASE_CACHE_IGNORED_SETTINGS}
+
+    sha = hashlib.sha256()
+    sha.update(VERSION_NO.encode())
+    sha.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    for fasta_path in fasta_paths:
+        sha.update(hash_file(fasta_path).encode())
+
+    return sha.hexdigest()
+
+
+def write_database_attributes(database_path:str, fasta_paths:list, fasta_settings:dict):
+    """
+    Store the key, the FASTA hashes and the digestion settings in a database. See update_database().
+
+    Args:
+        database_path (str): Path to database.
+        fasta_paths (list of str): Paths to the FASTA files.
+        fasta_settings (dict): The fasta section of the alphapept settings.
+    """
+    settings = {key: value for key, value in fasta_settings.items() if key not in DATABASE_CACHE_IGNORED_SETTINGS}
+
+    db_file = alphapept.io.HDF_File(database_path, is_read_only=False, is_overwritable=True)
+    db_file.write(get_database_key(fasta_paths, fasta_settings), attr_name="database_key")
+    db_file.write(json.dumps([hash_file(_) for _ in fasta_paths]), attr_name="fasta_hashes")
+    db_file.write(json.dumps(settings, sort_keys=True, default=str), attr_name="fasta_settings")
+
+
+def validate_database(database_path:str)->bool:
+    """
+    Check that a database contains all arrays and that the CSR indices are consistent.
+
+    Args:
+        database_path (str): Path to database.
+
+    Returns:
+        bool: True if the database is valid.
+    """
+    try:
+        with h5py.File(database_path, "r") as hdf_file:
+            for _ in ["precursors", "seqs", "fragmasses", "fragtypes", "indices", "proteins", "peptides/sequences", "peptides/protein_indptr", "peptides/protein_indices"]:
+                if _ not in hdf_file:
+                    return False
+
+            n_precursors = len(hdf_file["precursors"])
+            indices = hdf_file["indices"]
+            protein_indptr = hdf_file["peptides/protein_indptr"]
+
+            if len(hdf_file["seqs"]) != n_precursors or len(indices) != n_precursors + 1:
+                return False
+            if len(hdf_file["fragmasses"]) != len(hdf_file["fragtypes"]) or indices[-1] != len(hdf_file["fragmasses"]):
+                return False
+            if len(protein_indptr) != len(hdf_file["peptides/sequences"]) + 1 or protein_indptr[-1] != len(hdf_file["peptides/protein_indices"]):
+                return False
+    except (OSError, KeyError, ValueError):
+        return False
+
+    return True
+
+
+class DatabaseCache(object):
+    """Content-addressed cache of databases with least recently used eviction.
+
+    Databases that were used within the lease time are never evicted, as other runs sharing the cache may still be searching them.
+    """
+
+    def __init__(self, cache_path:str = None, max_size:float = 50, lease_time:float = 24):
+        """Open a database cache.
+
+        Args:
+            cache_path (str, optional): Folder of the cache. Defaults to None, i.e. the database_cache folder in the alphapept folder of the user.
+            max_size (float, optional): Maximum size of the cache in GB. Defaults to 50.
+            lease_time (float, optional): Hours after the last use of a database during which it is not evicted. Defaults to 24.
+        """
+        if cache_path is None:
+            cache_path = os.path.join(alphapept.paths.AP_PATH, "database_cache")
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.lease_time = lease_time
+
+        os.makedirs(self.cache_path, exist_ok=True)
+
+    def get_database_path(self, key:str)->str:
+        return os.path.join(self.cache_path, key + ".hdf")
+
+    def get_info_path(self, key:str)->str:
+        return os.path.join(self.cache_path, key + ".json")
+
+    def get_temp_path(self)->str:
+        """Get a path in the cache folder to generate a new database to."""
+        handle, temp_path = tempfile.mkstemp(suffix='.hdf.tmp', dir=self.cache_path)
+        os.close(handle)
+
+        return temp_path
+
+    def _read_info(self, key:str)->dict:
+        try:
+            with open(self.get_info_path(key), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_info(self, key:str, info:dict):
+        temp_path = self.get_info_path(key) + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(info, file)
+        os.replace(temp_path, self.get_info_path(key))
+
+    def keys(self)->list:
+        """Return the keys of all databases in the cache."""
+        return [os.path.splitext(_)[0] for _ in os.listdir(self.cache_path) if _.endswith('.json')]
+
+    def remove(self, key:str):
+        """Remove a database from the cache."""
+        for path in [self.get_database_path(key), self.get_info_path(key)]:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def get(self, key:str, verify_checksum:bool = False)->str:
+        """Get the path of a cached database and mark it as used, which renews its lease.
+
+        Args:
+            key (str): Key of the database. See get_database_key().
+            verify_checksum (bool, optional): Flag to verify the SHA-256 checksum of the database. Defaults to False.
+
+        Returns:
+            str: Path to the database or None if the database is not in the cache or is invalid.
+        """
+        database_path = self.get_database_path(key)
+        info = self._read_info(key)
+
+        if info is None or not os.path.isfile(database_path):
+            return None
+
+        valid = os.path.getsize(database_path) == info['size'] and validate_database(database_path)
+        if valid and verify_checksum:
+            valid = hash_file(database_path) == info['checksum']
+
+        if not valid:
+            logging.warning(f'Removing invalid database {database_path} from cache.')
+            self.remove(key)
+            return None
+
+        info['last_access'] = time.time()
+        self._write_info(key, info)
+
+        return database_path
+
+    def add(self, key:str, database_path:str)->str:
+        """Move a database into the cache and evict old databases if the cache is too large.
+
+        Args:
+            key (str): Key of the database. See get_database_key().
+            database_path (str): Path to the database. The file is moved.
+
+        Raises:
+            ValueError: If the database is not valid.
+
+        Returns:
+            str: Path to the database in the cache.
+        """
+        if not validate_database(database_path):
+            raise ValueError(f'Database {database_path} is not valid.')
+
+        alphapept.io.HDF_File(database_path, is_read_only=False, is_overwritable=True).write(key, attr_name="database_key")
+
+        cache_database_path = self.get_database_path(key)
+        shutil.move(database_path, cache_database_path)
+
+        info = {
+            'size': os.path.getsize(cache_database_path),
+            'checksum': hash_file(cache_database_path),
+            'last_access': time.time(),
+        }
+        self._write_info(key, info)
+
+        self.evict(keep=[key])
+
+        return cache_database_path
+
+    def evict(self, keep:list = []):
+        """Remove least recently used databases until the size of the cache is within its limit.
+
+        Databases used within the lease time are kept, even if the cache stays above its limit.
+
+        Args:
+            keep (list of str, optional): Keys of databases that are not removed. Defaults to [].
+        """
+        leased_since = time.time() - self.lease_time * 3600
+
+        entries = []
+        for key in self.keys():
+            info = self._read_info(key)
+            if info is None:
+                self.remove(key)
+            else:
+                entries.append((info['last_access'], info['size'], key))
+
+        entries.sort()
+        total_size = sum(_[1] for _ in entries)
+
+        for last_access, size, key in entries:
+            if total_size <= self.max_size * 1024**3:
+                break
+            if key in keep or last_access > leased_since:
+                continue
+            logging.info(f'Removing least recently used database {self.get_database_path(key)} from cache.')
+            self.remove(key)
+            total_size -= size
+
+# Cell
+DATABASE_EXTENDABLE_LISTS = ['mods_variable', 'mods_variable_terminal', 'mods_variable_terminal_prot']
+
+def check_database_extension(old_settings:dict, new_settings:dict)->bool:
+    """
+    Check whether new digestion settings extend old ones, i.e. generate all peptides of the old settings.
+
+    Args:
+        old_settings (dict): digestion settings of the database.
+        new_settings (dict): new digestion settings.
+
+    Raises:
+        ValueError: If the new settings do not extend the old settings.
+
+    Returns:
+        bool: True if the settings were extended, False if they are the same.
+    """
+    old_settings = {key: value for key, value in old_settings.items() if key not in DATABASE_CACHE_IGNORED_SETTINGS}
+    new_settings = json.loads(json.dumps({key: value for key, value in new_settings.items() if key not in DATABASE_CACHE_IGNORED_SETTINGS}, default=str))
+
+    if old_settings == new_settings:
+        return False
+
+    def no_limit(value):
+        return np.inf if not value else value
+
+    for key in set(old_settings) | set(new_settings):
+        old, new = old_settings.get(key), new_settings.get(key)
+        if key in DATABASE_EXTENDABLE_LISTS:
+            extended = set(old or []).issubset(set(new or []))
+        elif key in ['n_missed_cleavages', 'pep_length_max', 'isoforms_max']:
+            extended = new >= old
+        elif key == 'pep_length_min':
+            extended = new <= old
+        elif key == 'n_modifications_max':
+            extended = no_limit(new) >= no_limit(old)
+        else:
+            extended = old == new
+
+        if not extended:
+            raise ValueError(f'Setting {key} changed from {old} to {new}, which can not be applied incrementally.')
+
+    return True
+
+
+#This function is a wrapper function and to be tested by the integration test
+def update_database(settings:dict, database_path:str, callback:Callable = None, chunk_size:int = 1000000)->(int, PeptideProteinMap, dict):
+    """
+    Update a database incrementally for appended FASTA files or extended digestion settings.
+
+    Args:
+        settings (dict): alphapept settings.
+        database_path (str): Path to a database that was written with generate_database_streaming.
+        callback (Callable, optional): Callback function to indicate progress. Defaults to None.
+        chunk_size (int, optional): Number of spectra that are merged per round. Defaults to 1000000.
+
+    Raises:
+        ValueError: If the database can not be updated incrementally.
+
+    Returns:
+        int: number of spectra in the database.
+        PeptideProteinMap: peptide dict. See PeptideProteinMap.
+        dict: fasta_dict. See generate_fasta_list().
+    """
+    attributes = alphapept.io.HDF_File(database_path).read(attr_name="")
+    if "fasta_hashes" not in attributes or "fasta_settings" not in attributes:
+        raise ValueError(f'Database {database_path} has no FASTA hashes or settings and can not be updated incrementally.')
+
+    fasta_paths = settings['experiment']['fasta_paths']
+    old_hashes = json.loads(attributes["fasta_hashes"])
+    hashes = [hash_file(_) for _ in fasta_paths]
+    if hashes[:len(old_hashes)] != old_hashes:
+        raise ValueError('The FASTA files of the database were changed or reordered. New FASTA files can only be appended.')
+
+    new_fasta_paths = fasta_paths[len(old_hashes):]
+    settings_extended = check_database_extension(json.loads(attributes["fasta_settings"]), settings['fasta'])
+
+    db = Database(database_path, mmap=False)
+    fasta_dict = db['fasta_dict']
+    pept_dict = db['pept_dict']
+    n_spectra = len(db['precursors'])
+    del db
+
+    if len(new_fasta_paths) == 0 and not settings_extended:
+        logging.info(f'Database {database_path} is up to date.')
+        return n_spectra, pept_dict, fasta_dict
+
+    n_proteins = len(fasta_dict)
+    new_fasta_list, _ = generate_fasta_list(fasta_paths = new_fasta_paths, **settings['fasta'])
+    for i, element in enumerate(new_fasta_list):
+        fasta_dict[n_proteins + i] = element
+
+    if settings_extended:
+        fasta_list, fasta_offset = list(fasta_dict.values()), 0
+    else:
+        fasta_list, fasta_offset = new_fasta_list, n_proteins
+
+    logging.info(f'Adding {len(new_fasta_list):,} proteins and digesting {len(fasta_list):,} proteins to update the database.')
+
+    n_processes = alphapept.performance.set_worker_count(
+        worker_count=settings['general']['n_processes'],
+        set_global=False
+    )
+
+    shard_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(database_path)))
+
+    try:
+        to_process = [
+            (fasta_offset + idx_start, fasta_list[idx_start:idx_end], settings, os.path.join(shard_dir, f'shard_{i}.hdf')) for i, (idx_start, idx_end) in enumerate(block_idx(len(fasta_list), settings['fasta']['fasta_block']))
+        ]
+
+        shard_paths = [database_path]
+        pept_dicts = [pept_dict]
+        with Pool(n_processes, initializer=set_known_peptides, initargs=(pept_dict.sequences,)) as p:
+            max_ = len(to_process)
+            for i, (shard_path, _, block_pept_dict) in enumerate(p.imap(digest_fasta_block_to_shard, to_process)):
+                if callback:
+                    callback((i+1)/max_/2)
+                if shard_path is not None:
+                    shard_paths.append(shard_path)
+                if len(block_pept_dict) > 0:
+                    pept_dicts.append(block_pept_dict)
+
+        pept_dict = PeptideProteinMap.merge(pept_dicts, drop_duplicates=True)
+
+        if callback:
+            merge_callback = lambda x: callback(0.5 + x/2)
+        else:
+            merge_callback = None
+
+        temp_path = os.path.join(shard_dir, 'database.hdf')
+        n_spectra = merge_database_shards(shard_paths, pept_dict, fasta_dict, temp_path, chunk_size=chunk_size, callback=merge_callback)
+        write_database_attributes(temp_path, fasta_paths, settings['fasta'])
+
+        os.replace(temp_path, database_path)
+
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    return n_spectra, pept_dict, fasta_dict
\ No newline at end of file
@@ -100,6 +100,7 @@ def create_database(
 
     """
     import alphapept.fasta
+    import alphapept.io
     if not logger_set:
         set_logger()
     if not settings_parsed:
@@ -128,6 +129,40 @@ def create_database(
                 database_path
             )
         )
+        fasta_paths = settings['experiment']['fasta_paths']
+        if len(fasta_paths) > 0 and all(os.path.isfile(_) for _ in fasta_paths):
+            try:
+                saved_key = alphapept.io.HDF_File(database_path).read(attr_name='database_key')
+            except KeyError:
+                saved_key = None
+            if saved_key is not None and saved_key != alphapept.fasta.get_database_key(fasta_paths, settings['fasta']):
+                if settings['fasta'].get('database_update', False):
+                    try:
+                        n_spectra, _, fasta_dict = alphapept.fasta.update_database(
+                            settings,
+                            database_path,
+                            callback=callback
+                        )
+                        logging.info(
+                            'Updated database {} to {:,} proteins and {:,} spectra.'.format(
+                                database_path,
+                                len(fasta_dict),
+                                n_spectra
+                            )
+                        )
+                    except ValueError as e:
+                        logging.warning(
+                            'Database {} can not be updated: {}'.format(
+                                database_path,
+                                e
+                            )
+                        )
+                else:
+                    logging.warning(
+                        'Database {} was created from different FASTA files or settings.'.format(
+                            database_path
+                        )
+                    )
     else:
         logging.info(
             'Database path {} is not a file.'.format(database_path)
@@ -165,6 +200,32 @@ def create_database(
 
             return settings
 
+        database_key = alphapept.fasta.get_database_key(
+            settings['experiment']['fasta_paths'],
+            settings['fasta']
+        )
+
+        if settings['fasta'].get('database_cache', False):
+            database_cache = alphapept.fasta.DatabaseCache(
+                settings['fasta'].get('database_cache_path'),
+                settings['fasta'].get('database_cache_size', 50),
+                settings['fasta'].get('database_cache_lease', 24)
+            )
+            cached_database_path = database_cache.get(database_key)
+
+            if cached_database_path is not None:
+                logging.info(
+                    'Using database {} from cache.'.format(cached_database_path)
+                )
+                settings['experiment']['database_path'] = cached_database_path
+
+                return settings
+
+            output_path = database_cache.get_temp_path()
+        else:
+            database_cache = None
+            output_path = database_path
+
         logging.info('Creating a new database from FASTA.')
 
         if not callback:
@@ -173,27 +234,23 @@ def create_database(
             cb = callback
 
         (
-            spectra,
+            n_spectra,
             pept_dict,
             fasta_dict
-        ) = alphapept.fasta.generate_database_parallel(
+        ) = alphapept.fasta.generate_database_streaming(
             temp_settings,
+            output_path,
             callback=cb
         )
         logging.info(
             'Digested {:,} proteins and generated {:,} spectra'.format(
                 len(fasta_dict),
-                len(spectra)
+                n_spectra
             )
         )
 
-        alphapept.fasta.save_database(
-            spectra,
-            pept_dict,
-            fasta_dict,
-            database_path = database_path,
-            **settings['fasta']
-        )
+        if database_cache is not None:
+            database_path = database_cache.add(database_key, output_path)
         logging.info(
             'Database saved to {}. Filesize of database is {:.2f} GB'.format(
                 database_path,
@@ -317,10 +374,20 @@ def search_data(
     else:
         cb = callback
 
+    shared_database = settings['search'].get('shared_database', False) and len(settings['experiment']['file_paths']) > 1
+
     if first_search:
         logging.info('Starting first search.')
         if settings['experiment']['database_path'] is not None:
-            settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search), callback = cb)
+            if shared_database:
+                shms, shared_info = alphapept.search.create_shared_database(settings['experiment']['database_path'])
+            else:
+                shms, shared_info = [], None
+
+            try:
+                settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search, shared_database = shared_info), callback = cb)
+            finally:
+                alphapept.search.release_shared_database(shms)
 
             db_data = alphapept.fasta.read_database(settings['experiment']['database_path'])
 
@@ -345,7 +412,15 @@ def search_data(
         logging.info('Starting second search with DB.')
 
         if settings['experiment']['database_path'] is not None:
-            settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search), callback = cb)
+            if shared_database:
+                shms, shared_info = alphapept.search.create_shared_database(settings['experiment']['database_path'])
+            else:
+                shms, shared_info = [], None
+
+            try:
+                settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search, shared_database = shared_info), callback = cb)
+            finally:
+                alphapept.search.release_shared_database(shms)
 
             db_data = alphapept.fasta.read_database(settings['experiment']['database_path'])
 
@@ -481,6 +556,10 @@ def score(
         fasta_dict = db_data['fasta_dict'].item()
         pept_dict = db_data['pept_dict'].item()
 
+    if settings['score'].get('shared_classifier', False) and settings['score']['method'] in ['random_forest', *alphapept.score.CLASSIFIERS]:
+        logging.info('Training shared classifier.')
+        alphapept.score.train_shared_classifier(settings)
+
     settings = parallel_execute(settings, alphapept.score.score_hdf, callback = cb)
 
     return settings
@@ -1123,7 +1202,13 @@ def parallel_execute(
 
         if step.__name__ == 'search_db':
             memory_available = psutil.virtual_memory().available/1024**3
-            n_processes = max((int(memory_available //8 ), 1)) # 8 gb per file: Todo: make this better
+            memory_budget = settings['search'].get('memory_budget', 8)
+            shared_database = getattr(step, 'keywords', {}).get('shared_database')
+            if shared_database:
+                # The shared database is already allocated and not copied per process
+                shared_gb = sum([np.prod(shape) * np.dtype(dtype).itemsize for _, shape, dtype in shared_database.values()])/1024**3
+                memory_budget = max(memory_budget - shared_gb, 0.5)
+            n_processes = max((int(memory_available // memory_budget), 1))
             logging.info(f'Searching. Setting Process limit to {n_processes}.')
 
 
@@ -3,7 +3,7 @@
 __all__ = ['load_thermo_raw', 'load_bruker_raw', 'one_over_k0_to_CCS', 'check_sanity', 'extract_mzml_info',
            'load_mzml_data', '__extract_nested', 'extract_mq_settings', 'parse_mq_seq', 'get_peaks', 'get_centroid',
            'gaussian_estimator', 'centroid_data', 'get_most_abundant', 'list_to_numpy_f32', 'HDF_File', 'MS_Data_File',
-           'index_ragged_list', 'raw_conversion']
+           'index_ragged_list', 'gather_ragged', 'raw_conversion']
 
 # Cell
 def load_thermo_raw(
@@ -697,6 +697,7 @@ def list_to_numpy_f32(
 import h5py
 import os
 import time
+from contextlib import contextmanager
 from .__main__ import VERSION_NO
 
 
@@ -769,6 +770,7 @@ class HDF_File(object):
 
         """
         self.__file_name = os.path.abspath(file_name)
+        self._session_file = None
         if is_new_file:
             is_read_only = False
             if not os.path.exists(self.directory):
@@ -780,13 +782,71 @@ class HDF_File(object):
                 hdf_file.attrs["version"] = VERSION_NO
                 hdf_file.attrs["last_updated"] = current_time
         else:
-            with h5py.File(self.file_name, "r") as hdf_file:
+            with self._open("r"):
                 self.check()
         if is_overwritable:
             is_read_only = False
         self.__is_read_only = is_read_only
         self.__is_overwritable = is_overwritable
 
+    @contextmanager
+    def session(self, swmr: bool = False, read_only: bool = None):
+        """Keep the HDF file open for all reads and writes within this context.
+
+        Without a session, every read and write opens and closes the file.
+        Within a session, a single handle is reused and changes are flushed when the session ends.
+        Nested sessions reuse the outer handle.
+
+        Args:
+            swmr (bool): Open the file in swmr mode so that other processes can keep reading it.
+                Only allowed for read-only sessions. Defaults to False.
+            read_only (bool): If True, open the file in read mode, even if this HDF_File is writable.
+                If None, use is_read_only. Defaults to None.
+
+        Yields:
+            HDF_File: This object.
+
+        Raises:
+            ValueError: When swmr mode is requested for a session that is not read-only.
+
+        """
+        if self._session_file is not None:
+            yield self
+            return
+        if read_only is None:
+            read_only = self.is_read_only
+        if read_only:
+            mode = "r"
+        elif self.is_read_only:
+            raise IOError(
+                f"Trying to write to {self}, which is read_only."
+            )
+        elif swmr:
+            raise ValueError(
+                f"{self} can only be opened in swmr mode when it is read-only."
+            )
+        else:
+            mode = "a"
+        with self._open(mode, swmr=swmr):
+            yield self
+
+    @contextmanager
+    def _open(self, mode: str, swmr: bool = False):
+        """Yield the handle of the active session or open the file until the context ends."""
+        if self._session_file is not None:
+            if (mode != "r") and (self._session_file.mode == "r"):
+                raise IOError(
+                    f"Trying to write to {self}, which is opened read-only."
+                )
+            yield self._session_file
+        else:
+            with h5py.File(self.file_name, mode, swmr=swmr) as hdf_file:
+                self._session_file = hdf_file
+                try:
+                    yield hdf_file
+                finally:
+                    self._session_file = None
+
     def __eq__(self, other):
         return self.file_name == other.file_name
 
@@ -837,6 +897,33 @@ import pandas as pd
 from fastcore.foundation import patch
 
 
+def _memmap_dataset(dataset: h5py.Dataset) -> np.memmap:
+    """Map a contiguous, uncompressed numeric dataset directly from disk.
+
+    Args:
+        dataset (h5py.Dataset): The dataset to map.
+
+    Returns:
+        np.memmap: A copy-on-write memory map of the data or None if the dataset cannot be mapped.
+
+    """
+    if dataset.dtype.kind not in 'biuf' or dataset.chunks is not None or dataset.compression is not None:
+        return None
+    offset = dataset.id.get_offset()
+    if offset is None or dataset.size == 0:
+        return None
+    if dataset.file.mode != "r":
+        # Data written in the same session might not be on disk yet
+        dataset.file.flush()
+    return np.memmap(
+        dataset.file.filename,
+        mode="c",
+        dtype=dataset.dtype,
+        shape=dataset.shape,
+        offset=offset,
+    )
+
+
 @patch
 def read(
     self: HDF_File,
@@ -847,6 +934,7 @@ def read(
     return_dataset_dtype: bool = False,
     return_dataset_slice: slice = slice(None),
     swmr: bool = False,
+    mmap: bool = False,
 ):
     """Read contents of an HDF_File.
 
@@ -869,7 +957,12 @@ def read(
             Defaults to False.
         return_dataset_slice (slice): Do not read complete dataset to minimize RAM and IO usage.
             Defaults to slice(None).
-        swmr (bool): Use swmr mode to read data. Defaults to False.
+        swmr (bool): Use swmr mode to read data.
+            Ignored within a session(). Defaults to False.
+        mmap (bool): Memory-map contiguous, uncompressed numeric datasets instead of reading them.
+            Pages are only read when accessed and are shared between processes.
+            Changes to the returned array are not written to the file.
+            Other datasets are read as usual. Defaults to False.
 
     Returns:
         type: Depending on what is requested, a dict, value, np.ndarray or pd.dataframe is returned.
@@ -881,7 +974,7 @@ def read(
         ValueError: When the requested dataset is not a np.ndarray or pd.dataframe.
 
     """
-    with h5py.File(self.file_name, "r", swmr=swmr) as hdf_file:
+    with self._open("r", swmr=swmr) as hdf_file:
         if group_name is None:
             group = hdf_file
             group_name = "/"
@@ -920,6 +1013,12 @@ def read(
                     elif return_dataset_dtype:
                         return dataset.dtype
                     else:
+                        array = None
+                        if mmap:
+                            array = _memmap_dataset(dataset)
+                        if array is not None:
+                            # Plain arrays can be passed to numba functions
+                            return array[return_dataset_slice].view(np.ndarray)
                         array = dataset[return_dataset_slice]
                         # TODO: This assumes any object array is a string array
                         if array.dtype == object:
@@ -999,7 +1098,8 @@ def write(
             Defaults to None.
         dataset_compression (str): The compression type to use for datasets.
             Defaults to None.
-        swmr (bool): Open files in swmr mode. Defaults to False.
+        swmr (bool): Open files in swmr mode.
+            Ignored within a session(). Defaults to False.
 
     Raises:
         IOError: When the object is read-only.
@@ -1013,7 +1113,7 @@ def write(
         )
     if overwrite is None:
         overwrite = self.is_overwritable
-    with h5py.File(self.file_name, "a", swmr=swmr) as hdf_file:
+    with self._open("a", swmr=swmr) as hdf_file:
 
         if group_name is None:
             group = hdf_file
@@ -1253,59 +1353,60 @@ def _save_DDA_query_data(
     """
 #     if vendor == "Bruker":
 #         raise NotImplementedError("Unclear what are ms1 and ms2 attributes for bruker")
-    if "Raw" not in self.read():
-        self.write("Raw")
-    self.write(vendor, group_name="Raw", attr_name="vendor")
-    self.write(acquisition_date_time, group_name="Raw", attr_name="acquisition_date_time")
-    if "MS1_scans" not in self.read(group_name="Raw"):
-        self.write("MS1_scans", group_name="Raw")
-    if "MS2_scans" not in self.read(group_name="Raw"):
-        self.write("MS2_scans", group_name="Raw")
-    for key, value in query_data.items():
-        if key.endswith("1"):
-#             TODO: Weak check for ms2, imporve to _ms1 if consistency in naming is guaranteed
-            if key == "mass_list_ms1":
-                indices = index_ragged_list(value)
+    with self.session():
+        if "Raw" not in self.read():
+            self.write("Raw")
+        self.write(vendor, group_name="Raw", attr_name="vendor")
+        self.write(acquisition_date_time, group_name="Raw", attr_name="acquisition_date_time")
+        if "MS1_scans" not in self.read(group_name="Raw"):
+            self.write("MS1_scans", group_name="Raw")
+        if "MS2_scans" not in self.read(group_name="Raw"):
+            self.write("MS2_scans", group_name="Raw")
+        for key, value in query_data.items():
+            if key.endswith("1"):
+#                 TODO: Weak check for ms2, imporve to _ms1 if consistency in naming is guaranteed
+                if key == "mass_list_ms1":
+                    indices = index_ragged_list(value)
+                    self.write(
+                        indices,
+                        dataset_name="indices_ms1",
+                        group_name=f"Raw/MS1_scans"
+                    )
+                    value = np.concatenate(value)
+                elif key == "int_list_ms1":
+                    value = np.concatenate(value)
                 self.write(
-                    indices,
-                    dataset_name="indices_ms1",
+                    value,
+#                     TODO: key should be trimmed: xxx_ms1 should just be e.g. xxx
+                    dataset_name=key,
                     group_name=f"Raw/MS1_scans"
                 )
-                value = np.concatenate(value)
-            elif key == "int_list_ms1":
-                value = np.concatenate(value)
-            self.write(
-                value,
-#                 TODO: key should be trimmed: xxx_ms1 should just be e.g. xxx
-                dataset_name=key,
-                group_name=f"Raw/MS1_scans"
-            )
-        elif key.endswith("2"):
-#             TODO: Weak check for ms2, imporve to _ms2 if consistency in naming is guaranteed
-            if key == "mass_list_ms2":
-                indices = index_ragged_list(value)
+            elif key.endswith("2"):
+#                 TODO: Weak check for ms2, imporve to _ms2 if consistency in naming is guaranteed
+                if key == "mass_list_ms2":
+                    indices = index_ragged_list(value)
+                    self.write(
+                        indices,
+                        dataset_name="indices_ms2",
+                        group_name=f"Raw/MS2_scans"
+                    )
+                    if len(value) > 1: #in case there is no MS2
+                        value = np.concatenate(value)
+                    else:
+                        value = np.array(value)
+                elif key == "int_list_ms2":
+                    if len(value) > 1: #in case there is no MS2
+                        value = np.concatenate(value)
+                    else:
+                        value = np.array(value)
                 self.write(
-                    indices,
-                    dataset_name="indices_ms2",
+                    value,
+#                     TODO: key should be trimmed: xxx_ms2 should just be e.g. xxx
+                    dataset_name=key,
                     group_name=f"Raw/MS2_scans"
                 )
-                if len(value) > 1: #in case there is no MS2
-                    value = np.concatenate(value)
-                else:
-                    value = np.array(value)
-            elif key == "int_list_ms2":
-                if len(value) > 1: #in case there is no MS2
-                    value = np.concatenate(value)
-                else:
-                    value = np.array(value)
-            self.write(
-                value,
-#                 TODO: key should be trimmed: xxx_ms2 should just be e.g. xxx
-                dataset_name=key,
-                group_name=f"Raw/MS2_scans"
-            )
-        else:
-            raise KeyError("Unspecified scan type")
+            else:
+                raise KeyError("Unspecified scan type")
     return
 #     to_save["bounds"] = np.sum(to_save['mass_list_ms2']>=0,axis=0).astype(np.int64)
 #     logging.info('Converted file saved to {}'.format(save_path))
@@ -1318,6 +1419,7 @@ def read_DDA_query_data(
     calibrated_fragments:bool=False,
     force_recalibrate:bool=False,
     swmr:bool=False,
+    mmap:bool=False,
     **kwargs
 ) -> dict:
     """Read query data from this ms_data object and return it as a query_dict.
@@ -1330,6 +1432,7 @@ def read_DDA_query_data(
             recalibrate mzs values even if a recalibration is already provided.
             Defaults to False.
         swmr (bool): Open the file in swmr mode. Defaults to False.
+        mmap (bool): Memory-map the MS1 and MS2 arrays instead of reading them. Defaults to False.
         **kwargs (type): Can contain a database file name that was used for recalibration.
 
     Returns:
@@ -1337,20 +1440,24 @@ def read_DDA_query_data(
 
     """
     query_data = {}
-    for dataset_name in self.read(group_name="Raw/MS1_scans"):
-        values = self.read(
-            dataset_name=dataset_name,
-            group_name="Raw/MS1_scans",
-            swmr=swmr,
-        )
-        query_data[dataset_name] = values
-    for dataset_name in self.read(group_name="Raw/MS2_scans"):
-        values = self.read(
-            dataset_name=dataset_name,
-            group_name="Raw/MS2_scans",
-            swmr=swmr
-        )
-        query_data[dataset_name] = values
+    with self.session(swmr=swmr, read_only=True):
+        for dataset_name in self.read(group_name="Raw/MS1_scans"):
+            values = self.read(
+                dataset_name=dataset_name,
+                group_name="Raw/MS1_scans",
+                swmr=swmr,
+                mmap=mmap,
+            )
+            query_data[dataset_name] = values
+        for dataset_name in self.read(group_name="Raw/MS2_scans"):
+            values = self.read(
+                dataset_name=dataset_name,
+                group_name="Raw/MS2_scans",
+                swmr=swmr,
+                mmap=mmap,
+            )
+            query_data[dataset_name] = values
+        vendor = self.read(attr_name="vendor", group_name="Raw")
 #     indices_ms1 = query_data["indices_ms1"]
 #     mz_ms1 = query_data["mass_list_ms1"]
 #     query_data["mass_list_ms1"] = np.array(
@@ -1369,7 +1476,7 @@ def read_DDA_query_data(
 #     query_data["int_list_ms2"] = np.array(
 #         [int_ms2[s:e] for s,e in zip(indices_ms2[:-1], indices_ms2[1:])]
 #     )
-    if self.read(attr_name="vendor", group_name="Raw") == "Bruker":
+    if vendor == "Bruker":
         query_data["mobility"] = query_data["mobility2"]
         query_data["prec_id"] = query_data["prec_id2"]
     if calibrated_fragments:
@@ -1381,13 +1488,41 @@ def read_DDA_query_data(
                 kwargs["database_file_name"],
                 self.file_name,
             )
-        query_data["mass_list_ms2"] *= (
+        query_data["mass_list_ms2"] = query_data["mass_list_ms2"] * (
             1 - self.read(
                 dataset_name="corrected_fragment_mzs", swmr=swmr
             ) / 10**6
         )
     return query_data
 
+# Cell
+from numba import njit
+
+@njit
+def gather_ragged(indices: np.ndarray, selection: np.ndarray) -> (np.ndarray, np.ndarray):
+    """Gather selected elements from a ragged array that is stored as a flat array and indices.
+
+    Args:
+        indices (np.ndarray): Indices of the ragged array, element i is stored at indices[i]:indices[i+1].
+        selection (np.ndarray): Array with the elements to gather.
+
+    Returns:
+        np.ndarray: Indices of the gathered ragged array.
+        np.ndarray: Positions of the gathered values in the flat array.
+    """
+    new_indices = np.zeros(len(selection) + 1, np.int64)
+    for i in range(len(selection)):
+        new_indices[i + 1] = new_indices[i] + indices[selection[i] + 1] - indices[selection[i]]
+
+    positions = np.empty(new_indices[-1], np.int64)
+    for i in range(len(selection)):
+        start = indices[selection[i]]
+        for j in range(new_indices[i + 1] - new_indices[i]):
+            positions[new_indices[i] + j] = start + j
+
+    return new_indices, positions
+
+
 # Cell
 
 def raw_conversion(
@@ -220,6 +220,14 @@ def calibrate_hdf(
         except KeyError: #no elements in search
             psms = pd.DataFrame()
 
+        if settings["search"].get("open_search", False) and len(psms) > 0:
+            # Psms with large offsets stem from unknown modifications and are not used for calibration
+            if settings["search"]["ppm"]:
+                near_zero = np.abs(psms['prec_offset_ppm']) <= settings["search"]["prec_tol"]
+            else:
+                near_zero = np.abs(psms['prec_offset']) <= settings["search"]["prec_tol"]
+            psms = psms[near_zero].reset_index(drop=True)
+
         if len(psms) > 0 :
             df = score_x_tandem(
                 psms,
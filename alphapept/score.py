@@ -1,15 +1,147 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/06_score.ipynb (unless otherwise specified).
 
-__all__ = ['filter_score', 'filter_precursor', 'get_q_values', 'cut_fdr', 'cut_global_fdr', 'get_x_tandem_score',
-           'score_x_tandem', 'filter_with_x_tandem', 'filter_with_score', 'score_psms', 'get_ML_features', 'train_RF',
-           'score_ML', 'filter_with_ML', 'assign_proteins', 'get_shared_proteins', 'get_protein_groups',
-           'perform_protein_grouping', 'get_ion', 'ion_dict', 'ecdf', 'score_hdf', 'protein_grouping_all']
+__all__ = ['get_group_codes', 'get_group_order', 'get_dense_rank_grouped', 'get_dense_rank', 'get_first_per_group',
+           'filter_score', 'filter_precursor', 'get_q_values', 'get_fdr', 'cut_fdr', 'get_max_per_group',
+           'cut_global_fdr', 'get_x_tandem_score', 'score_x_tandem', 'filter_with_x_tandem', 'filter_with_score',
+           'score_psms', 'get_ML_features', 'get_training_set', 'train_RF', 'get_classifier', 'get_ML_score',
+           'train_classifier', 'score_ML', 'filter_with_ML', 'CLASSIFIERS', 'assign_proteins', 'get_razor_groups',
+           'get_shared_proteins', 'get_protein_groups', 'perform_protein_grouping', 'get_ion_positions', 'get_ions',
+           'format_ion_types', 'get_ion', 'ion_dict', 'ecdf', 'ECDFMapper', 'read_psms', 'get_classifier_path',
+           'get_ecdf_path', 'save_classifier', 'load_classifier', 'sample_psms', 'read_shared_psms',
+           'train_shared_classifier', 'score_hdf', 'protein_grouping_all']
 
 # Cell
 import numpy as np
 import pandas as pd
 import logging
 import alphapept.io
+from numba import njit
+
+def get_group_codes(values: np.ndarray) -> np.ndarray:
+    """
+    Encode the values of a column as integer group codes from 0 to n_groups-1 in order of first occurrence.
+
+    Args:
+        values (np.ndarray): Values to group by, e.g. query_idx or precursor strings.
+
+    Returns:
+        np.ndarray: Group code of each value.
+    """
+    codes, uniques = pd.factorize(values)
+
+    return codes
+
+@njit
+def get_group_order(codes: np.ndarray, n_groups: int) -> (np.ndarray, np.ndarray):
+    """
+    Stable counting sort of elements by their group code.
+
+    Args:
+        codes (np.ndarray): Group codes from 0 to n_groups-1.
+        n_groups (int): Number of groups.
+
+    Returns:
+        np.ndarray: Indices of the elements sorted by group.
+        np.ndarray: Index pointer of each group in the sorted indices.
+    """
+    indptr = np.zeros(n_groups + 1, dtype=np.int64)
+    for code in codes:
+        indptr[code + 1] += 1
+    indptr = np.cumsum(indptr)
+
+    order = np.empty(len(codes), dtype=np.int64)
+    position = indptr[:-1].copy()
+    for i in range(len(codes)):
+        order[position[codes[i]]] = i
+        position[codes[i]] += 1
+
+    return order, indptr
+
+@njit
+def get_dense_rank_grouped(codes: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Dense rank of values within each group (ascending).
+    The elements are bucketed by group with get_group_order, so only the values within each group need to be sorted.
+
+    Args:
+        codes (np.ndarray): Group codes from 0 to n_groups-1.
+        values (np.ndarray): Values to rank.
+        n_groups (int): Number of groups.
+
+    Returns:
+        np.ndarray: Dense rank starting at 1 within each group.
+    """
+    order, indptr = get_group_order(codes, n_groups)
+
+    ranks = np.ones(len(codes), dtype=np.int64)
+    for group in range(n_groups):
+        start = indptr[group]
+        end = indptr[group + 1]
+        if end - start > 64:
+            group_order = order[start:end]
+            order[start:end] = group_order[np.argsort(values[group_order])]
+        elif end - start > 1:
+            # Insertion sort, groups are typically small
+            for i in range(start + 1, end):
+                idx = order[i]
+                j = i - 1
+                while (j >= start) and (values[order[j]] > values[idx]):
+                    order[j + 1] = order[j]
+                    j -= 1
+                order[j + 1] = idx
+
+        if end - start > 1:
+            rank = 1
+            for i in range(start + 1, end):
+                if values[order[i]] != values[order[i-1]]:
+                    rank += 1
+                ranks[order[i]] = rank
+
+    return ranks
+
+def get_dense_rank(codes: np.ndarray, values: np.ndarray, ascending: bool=True) -> np.ndarray:
+    """
+    Dense rank of values within each group, equivalent to df.groupby(codes)[values].rank('dense').
+
+    Args:
+        codes (np.ndarray): Group codes from 0 to n_groups-1.
+        values (np.ndarray): Values to rank.
+        ascending (bool, optional): Rank the smallest value first. Defaults to True.
+
+    Returns:
+        np.ndarray: Dense rank starting at 1 within each group.
+    """
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    keys = values.astype(np.float64)
+    if not ascending:
+        keys = -keys
+
+    return get_dense_rank_grouped(codes, keys, np.max(codes) + 1)
+
+@njit
+def get_first_per_group(codes: np.ndarray) -> np.ndarray:
+    """
+    Select the first occurrence of each group, equivalent to df.drop_duplicates(column).
+
+    Args:
+        codes (np.ndarray): Group codes from 0 to n_groups-1.
+
+    Returns:
+        np.ndarray: Boolean mask that is True for the first element of each group.
+    """
+    n_groups = 0
+    if len(codes) > 0:
+        n_groups = np.max(codes) + 1
+    seen = np.zeros(n_groups, dtype=np.bool_)
+    first = np.zeros(len(codes), dtype=np.bool_)
+    for i in range(len(codes)):
+        if not seen[codes[i]]:
+            seen[codes[i]] = True
+            first[i] = True
+
+    return first
 
 def filter_score(df: pd.DataFrame, mode: str='multiple') -> pd.DataFrame:
     """
@@ -25,19 +157,19 @@ def filter_score(df: pd.DataFrame, mode: str='multiple') -> pd.DataFrame:
     Returns:
         pd.DataFrame: table containing the filtered psms results.
     """
-    df["rank"] = df.groupby("query_idx")["score"].rank("dense", ascending=False).astype("int")
+    df["rank"] = get_dense_rank(get_group_codes(df["query_idx"].values), df["score"].values, ascending=False)
     df = df[df["rank"] == 1]
 
     # in case two hits have the same score and therfore the same rank only accept the first one
-    df = df.drop_duplicates("query_idx")
+    df = df[get_first_per_group(get_group_codes(df["query_idx"].values))]
 
     if 'dist' in df.columns:
-        df["feature_rank"] = df.groupby("feature_idx")["dist"].rank("dense", ascending=True).astype("int")
-        df["raw_rank"] = df.groupby("raw_idx")["score"].rank("dense", ascending=False).astype("int")
+        df["feature_rank"] = get_dense_rank(get_group_codes(df["feature_idx"].values), df["dist"].values, ascending=True)
+        df["raw_rank"] = get_dense_rank(get_group_codes(df["raw_idx"].values), df["score"].values, ascending=False)
 
         if mode == 'single':
             df_filtered = df[(df["feature_rank"] == 1) & (df["raw_rank"] == 1) ]
-            df_filtered = df_filtered.drop_duplicates("raw_idx")
+            df_filtered = df_filtered[get_first_per_group(get_group_codes(df_filtered["raw_idx"].values))]
 
         elif mode == 'multiple':
             df_filtered = df[(df["feature_rank"] == 1)]
@@ -65,9 +197,7 @@ def filter_precursor(df: pd.DataFrame) -> pd.DataFrame:
         pd.DataFrame: table containing the filtered psms results.
 
     """
-    df["rank_precursor"] = (
-        df.groupby("precursor")["score"].rank("dense", ascending=False).astype("int")
-    )
+    df["rank_precursor"] = get_dense_rank(get_group_codes(df["precursor"].values), df["score"].values, ascending=False)
     df_filtered = df[df["rank_precursor"] == 1]
 
     return df_filtered
@@ -95,6 +225,38 @@ def get_q_values(fdr_values: np.ndarray) -> np.ndarray:
 
     return q_values
 
+@njit(error_model='numpy')
+def get_fdr(decoy: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+    """
+    Calculate the cumulative target and decoy counts, fdr and q-values for psms sorted by descending score.
+
+    Args:
+        decoy (np.ndarray): Boolean decoy flag of each psm, sorted by descending score.
+
+    Returns:
+        np.ndarray: Cumulative number of targets.
+        np.ndarray: Cumulative number of decoys.
+        np.ndarray: fdr values.
+        np.ndarray: q-values.
+    """
+    target_cum = np.empty(len(decoy), dtype=np.int64)
+    decoys_cum = np.empty(len(decoy), dtype=np.int64)
+    fdr_values = np.empty(len(decoy), dtype=np.float64)
+
+    n_targets = 0
+    n_decoys = 0
+    for i in range(len(decoy)):
+        if decoy[i]:
+            n_decoys += 1
+        else:
+            n_targets += 1
+        target_cum[i] = n_targets
+        decoys_cum[i] = n_decoys
+        fdr_values[i] = n_decoys / n_targets
+
+    return target_cum, decoys_cum, fdr_values, get_q_values(fdr_values)
+
+
 # Cell
 import numpy as np
 import pandas as pd
@@ -118,17 +280,19 @@ def cut_fdr(df: pd.DataFrame, fdr_level:float=0.01, plot:bool=True) -> (float, p
 
     df["target"] = ~df["decoy"]
 
-    df = df.sort_values(by=["score","decoy"], ascending=False)
+    # Sort by descending score, decoys first for equal scores
+    order = np.lexsort((df["target"].values, -df["score"].values.astype(np.float64)))
+    df = df.iloc[order]
     df = df.reset_index()
 
-    df["target_cum"] = np.cumsum(df["target"])
-    df["decoys_cum"] = np.cumsum(df["decoy"])
+    target_cum, decoys_cum, fdr_values, q_values = get_fdr(df["decoy"].values)
+    df["target_cum"] = target_cum
+    df["decoys_cum"] = decoys_cum
+    df["fdr"] = fdr_values
+    df["q_value"] = q_values
 
-    df["fdr"] = df["decoys_cum"] / df["target_cum"]
-    df["q_value"] = get_q_values(df["fdr"].values)
-
-    last_q_value = df["q_value"].iloc[-1]
-    first_q_value = df["q_value"].iloc[0]
+    last_q_value = q_values[-1]
+    first_q_value = q_values[0]
 
     if last_q_value <= fdr_level:
         logging.info('Last q_value {:.3f} of dataset is smaller than fdr_level {:.3f}'.format(last_q_value, fdr_level))
@@ -139,7 +303,7 @@ def cut_fdr(df: pd.DataFrame, fdr_level:float=0.01, plot:bool=True) -> (float, p
         cutoff_index = 0
 
     else:
-        cutoff_index = df[df["q_value"].gt(fdr_level)].index[0] - 1
+        cutoff_index = np.argmax(q_values > fdr_level) - 1
 
     cutoff_value = df.loc[cutoff_index]["score"]
     cutoff = df[df["score"] >= cutoff_value]
@@ -180,6 +344,26 @@ def cut_fdr(df: pd.DataFrame, fdr_level:float=0.01, plot:bool=True) -> (float, p
 
 # Cell
 
+@njit
+def get_max_per_group(codes: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Maximum of values within each group.
+
+    Args:
+        codes (np.ndarray): Group codes from 0 to n_groups-1.
+        values (np.ndarray): Values.
+        n_groups (int): Number of groups.
+
+    Returns:
+        np.ndarray: Maximum value of each group.
+    """
+    max_values = np.full(n_groups, -np.inf)
+    for i in range(len(codes)):
+        if values[i] > max_values[codes[i]]:
+            max_values[codes[i]] = values[i]
+
+    return max_values
+
 def cut_global_fdr(data: pd.DataFrame, analyte_level: str='sequence', fdr_level: float=0.01, plot: bool=True, **kwargs) -> pd.DataFrame:
     """
     Function to estimate and filter by global peptide or protein fdr
@@ -195,30 +379,47 @@ def cut_global_fdr(data: pd.DataFrame, analyte_level: str='sequence', fdr_level:
 
     """
     logging.info('Global FDR on {}'.format(analyte_level))
-    data_sub = data[[analyte_level,'score','decoy']]
-    data_sub_unique = data_sub.groupby([analyte_level,'decoy'], as_index=False).agg({"score": "max"})
 
     analyte_levels = ['precursor', 'sequence', 'protein_group','protein']
 
-    if analyte_level in analyte_levels:
-        agg_score = data_sub_unique.groupby([analyte_level,'decoy'])['score'].max().reset_index()
-    else:
+    if analyte_level not in analyte_levels:
         raise Exception('analyte_level should be either sequence or protein. The selected analyte_level was: {}'.format(analyte_level))
 
+    # Best score per analyte and decoy flag, in the sorted order of a groupby
+    analyte_codes, analytes = pd.factorize(data[analyte_level].values, sort=True)
+    decoy = data['decoy'].values.astype(np.int64)
+    valid = analyte_codes >= 0
+    keys = analyte_codes[valid] * 2 + decoy[valid]
+    present = np.bincount(keys, minlength=2 * len(analytes)) > 0
+    groups = np.flatnonzero(present)
+    group_codes = (np.cumsum(present) - 1)[keys]
+    scores = get_max_per_group(group_codes, data['score'].values[valid], len(groups)).astype(data['score'].dtype)
+
+    agg_score = pd.DataFrame({analyte_level: analytes[groups // 2], 'decoy': (groups % 2).astype(bool), 'score': scores})
+
     agg_cval, agg_cutoff = cut_fdr(agg_score, fdr_level=fdr_level, plot=plot)
 
-    agg_report = pd.merge(data,
-                          agg_cutoff,
-                          how = 'inner',
-                          on = [analyte_level,'decoy'],
-                          suffixes=('', '_'+analyte_level),
-                          validate="many_to_one")
+    # Join the cutoff back to data, equivalent to an inner pd.merge on [analyte_level, 'decoy']
+    cutoff_rows = np.full(len(groups), -1, dtype=np.int64)
+    cutoff_rows[agg_cutoff['index'].values] = np.arange(len(agg_cutoff))
+    rows = np.full(len(data), -1, dtype=np.int64)
+    rows[valid] = cutoff_rows[group_codes]
+
+    # Like pd.merge, the rows are grouped by the keys in order of their first appearance
+    selected = np.flatnonzero(rows >= 0)
+    join_key = get_group_codes(rows[selected])
+    selected = selected[get_group_order(join_key, np.max(join_key, initial=-1) + 1)[0]]
+
+    agg_report = data.iloc[selected].reset_index(drop=True)
+    for column in agg_cutoff.columns:
+        if column not in [analyte_level, 'decoy']:
+            name = column + '_' + analyte_level if column in data.columns else column
+            agg_report[name] = agg_cutoff[column].values[rows[selected]]
+
     return agg_report
 
 # Cell
 
-import networkx as nx
-
 def get_x_tandem_score(df: pd.DataFrame) -> np.ndarray:
     """
     Function to calculate the x tandem score
@@ -333,12 +534,21 @@ def score_psms(df: pd.DataFrame, score: str='y_hits', fdr_level: float=0.01, plo
 import numpy as np
 import pandas as pd
 import sys
+from typing import Union
 
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.pipeline import Pipeline
 from sklearn.model_selection import GridSearchCV
+from sklearn.svm import LinearSVC
+
+try:
+    from sklearn.ensemble import HistGradientBoostingClassifier
+except ImportError:
+    # scikit-learn < 1.0 requires explicitly enabling the estimator
+    from sklearn.experimental import enable_hist_gradient_boosting
+    from sklearn.ensemble import HistGradientBoostingClassifier
 
 import matplotlib.pyplot as plt
 
@@ -371,6 +581,55 @@ def get_ML_features(df: pd.DataFrame, protease: str='trypsin', **kwargs) -> pd.D
 
     return df
 
+def get_training_set(df: pd.DataFrame,
+                     score: np.ndarray,
+                     train_fdr_level: float = 0.1,
+                     min_train: int = 1000,
+                     random_state: int = 42) -> pd.DataFrame:
+    """
+    Selects a balanced set of high scoring targets and decoys for semi-supervised learning.
+
+    Args:
+        df (pd.DataFrame): psms table of search results from alphapept.
+        score (np.ndarray): score per psm that is used to select the high scoring targets.
+        train_fdr_level (float, optional): Only targets below the train_fdr_level cutoff are selected. Defaults to 0.1.
+        min_train (int, optional): Minimum number of targets and decoys in the training set. Defaults to 1000.
+        random_state (int, optional): Random state for sampling the psms. Defaults to 42.
+
+    Raises:
+        ValueError: When fewer high scoring targets or decoys than min_train are available.
+
+    Returns:
+        pd.DataFrame: psms table with the same number of targets and decoys.
+    """
+    # Prepare target and decoy df
+    df['decoy'] = df['sequence'].str[-1].str.islower()
+    df['target'] = ~df['decoy']
+    df['score'] = score
+    dfT = df[~df.decoy]
+    dfD = df[df.decoy]
+
+    # Select high scoring targets (<= train_fdr_level)
+    df_prescore = filter_score(df)
+    df_prescore = filter_precursor(df_prescore)
+    scored = cut_fdr(df_prescore, fdr_level = train_fdr_level, plot=False)[1]
+    highT = scored[scored.decoy==False]
+    dfT_high = dfT[dfT['query_idx'].isin(highT.query_idx)]
+    dfT_high = dfT_high[dfT_high['db_idx'].isin(highT.db_idx)]
+
+    # Determine the number of psms for semi-supervised learning
+    n_train = int(dfT_high.shape[0])
+    if dfD.shape[0] < n_train:
+        n_train = int(dfD.shape[0])
+        logging.info("The total number of available decoys is lower than the initial set of high scoring targets.")
+    if n_train < min_train:
+        raise ValueError("There are fewer high scoring targets or decoys than required by 'min_train'.")
+
+    # Subset the targets and decoys datasets to result in a balanced dataset
+    df_training = dfT_high.sample(n=n_train, random_state=random_state).append(dfD.sample(n=n_train, random_state=random_state))
+
+    return df_training
+
 def train_RF(df: pd.DataFrame,
              exclude_features: list = ['precursor_idx','ion_idx','fasta_index','feature_rank','raw_rank','rank','db_idx', 'feature_idx', 'precursor', 'query_idx', 'raw_idx','sequence','decoy','naked_sequence','target'],
              train_fdr_level:  float = 0.1,
@@ -423,31 +682,8 @@ def train_RF(df: pd.DataFrame,
     cv = GridSearchCV(pipeline, param_grid=parameters, cv=5, scoring=scoring,
                      verbose=0,return_train_score=True,n_jobs=n_jobs)
 
-    # Prepare target and decoy df
-    df['decoy'] = df['sequence'].str[-1].str.islower()
-    df['target'] = ~df['decoy']
-    df['score'] = df[ini_score]
-    dfT = df[~df.decoy]
-    dfD = df[df.decoy]
-
-    # Select high scoring targets (<= train_fdr_level)
-    df_prescore = filter_score(df)
-    df_prescore = filter_precursor(df_prescore)
-    scored = cut_fdr(df_prescore, fdr_level = train_fdr_level, plot=False)[1]
-    highT = scored[scored.decoy==False]
-    dfT_high = dfT[dfT['query_idx'].isin(highT.query_idx)]
-    dfT_high = dfT_high[dfT_high['db_idx'].isin(highT.db_idx)]
-
-    # Determine the number of psms for semi-supervised learning
-    n_train = int(dfT_high.shape[0])
-    if dfD.shape[0] < n_train:
-        n_train = int(dfD.shape[0])
-        logging.info("The total number of available decoys is lower than the initial set of high scoring targets.")
-    if n_train < min_train:
-        raise ValueError("There are fewer high scoring targets or decoys than required by 'min_train'.")
-
-    # Subset the targets and decoys datasets to result in a balanced dataset
-    df_training = dfT_high.sample(n=n_train, random_state=random_state).append(dfD.sample(n=n_train, random_state=random_state))
+    # Select a balanced set of high scoring targets and decoys
+    df_training = get_training_set(df, df[ini_score].values, train_fdr_level=train_fdr_level, min_train=min_train, random_state=random_state)
 
     # Select training and test sets
     X = df_training[features]
@@ -486,8 +722,123 @@ def train_RF(df: pd.DataFrame,
 
     return cv, features
 
+CLASSIFIERS = {
+    'hist_gradient_boosting': (HistGradientBoostingClassifier, {'learning_rate': 0.1, 'max_iter': 200, 'max_leaf_nodes': 31, 'min_samples_leaf': 20, 'l2_regularization': 0.0, 'early_stopping': True, 'validation_fraction': 0.1, 'n_iter_no_change': 10}),
+    'linear_svm': (LinearSVC, {'C': 1.0, 'class_weight': 'balanced', 'dual': False, 'max_iter': 1000}),
+}
+
+def get_classifier(method: str = 'hist_gradient_boosting', random_state: int = 42, **kwargs) -> Pipeline:
+    """
+    Creates an untrained scaling + classification pipeline with the fixed hyperparameters of a rescoring engine.
+
+    Args:
+        method (str, optional): Name of the rescoring engine, needs to be a key of CLASSIFIERS. Defaults to 'hist_gradient_boosting'.
+        random_state (int, optional): Random state for initializing the classifier. Defaults to 42.
+        **kwargs: Hyperparameters that overwrite the defaults of the engine.
+
+    Raises:
+        NotImplementedError: When the method is not a key of CLASSIFIERS.
+
+    Returns:
+        Pipeline: sklearn Pipeline with a StandardScaler and the classifier.
+    """
+    if method not in CLASSIFIERS:
+        raise NotImplementedError('Classifier {} not implemented. Choose from {}.'.format(method, list(CLASSIFIERS)))
+
+    classifier, parameters = CLASSIFIERS[method]
+    parameters = {**parameters, **kwargs}
+
+    return Pipeline([('scaler', StandardScaler()), ('clf', classifier(random_state=random_state, **parameters))])
+
+def get_ML_score(trained_classifier: Union[GridSearchCV, Pipeline], X: np.ndarray) -> np.ndarray:
+    """
+    Calculates the probability of being a target for each psm.
+    For classifiers without probability estimates, the decision function is mapped to [0, 1] with a logistic function.
+
+    Args:
+        trained_classifier (Union[GridSearchCV, Pipeline]): Classifier returned by train_RF or train_classifier.
+        X (np.ndarray): Feature matrix.
+
+    Returns:
+        np.ndarray: Score between 0 and 1 for each psm.
+    """
+    if hasattr(trained_classifier, 'predict_proba'):
+        return trained_classifier.predict_proba(X)[:,1]
+    else:
+        return 1 / (1 + np.exp(-trained_classifier.decision_function(X)))
+
+def train_classifier(df: pd.DataFrame,
+             method: str = 'hist_gradient_boosting',
+             exclude_features: list = ['precursor_idx','ion_idx','fasta_index','feature_rank','raw_rank','rank','db_idx', 'feature_idx', 'precursor', 'query_idx', 'raw_idx','sequence','decoy','naked_sequence','target'],
+             train_fdr_level:  float = 0.1,
+             ini_score: str = 'x_tandem',
+             min_train: int = 1000,
+             test_size: float = 0.2,
+             n_iterations: int = 3,
+             random_state: int = 42,
+             classifier_params: dict = {},
+             **kwargs) -> (Union[GridSearchCV, Pipeline], list):
+    """
+    Function to train a classifier to separate targets from decoys via semi-supervised learning.
+    The random forest is trained by train_RF. All other engines use the fixed hyperparameters from CLASSIFIERS.
+    Similar to Percolator, the psms are rescored with the trained classifier and the training set is reselected
+    for up to n_iterations. The iterations stop early once the number of targets below the train_fdr_level does not increase.
+
+    Args:
+        df (pd.DataFrame): psms table of search results from alphapept.
+        method (str, optional): Name of the rescoring engine, 'random_forest' or a key of CLASSIFIERS. Defaults to 'hist_gradient_boosting'.
+        exclude_features (list, optional): list with features to exclude for ML. Defaults to ['precursor_idx','ion_idx','fasta_index','feature_rank','raw_rank','rank','db_idx', 'feature_idx', 'precursor', 'query_idx', 'raw_idx','sequence','decoy','naked_sequence','target'].
+        train_fdr_level (float, optional): Only targets below the train_fdr_level cutoff are considered for training the classifier. Defaults to 0.1.
+        ini_score (str, optional): Initial score to select psms set for semi-supervised learning. Defaults to 'x_tandem'.
+        min_train (int, optional): Minimum number of psms in the training set. Defaults to 1000.
+        test_size (float, optional): Fraction of psms used for testing. Defaults to 0.2.
+        n_iterations (int, optional): Maximum number of training iterations. Defaults to 3.
+        random_state (int, optional): Random state for initializing the classifier. Defaults to 42.
+        classifier_params (dict, optional): Hyperparameters that overwrite the defaults of the engine. Defaults to {}.
+
+    Returns:
+        [Union[GridSearchCV, Pipeline], list]: Trained classifier. list: list of features used for training the classifier.
+    """
+    if method == 'random_forest':
+        return train_RF(df, exclude_features=exclude_features, train_fdr_level=train_fdr_level, ini_score=ini_score, min_train=min_train, random_state=random_state, **kwargs)
+
+    features = [_ for _ in df.columns if _ not in exclude_features]
+
+    score = df[ini_score].values
+    n_targets = 0
+    trained_classifier = None
+
+    for iteration in range(n_iterations):
+        try:
+            df_training = get_training_set(df, score, train_fdr_level=train_fdr_level, min_train=min_train, random_state=random_state)
+        except ValueError:
+            if trained_classifier is None:
+                raise
+            break
+
+        n_high = int(df_training['target'].sum())
+        if n_high <= n_targets:
+            logging.info('No improvement in iteration {}. Stopping.'.format(iteration))
+            break
+        n_targets = n_high
+
+        X = df_training[features].values
+        y = df_training['target'].astype(int).values
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state, stratify=y)
+
+        classifier = get_classifier(method, random_state=random_state, **classifier_params)
+        logging.info('Iteration {}: Training {} on {} targets and {} decoys'.format(iteration, method, np.sum(y_train), X_train.shape[0]-np.sum(y_train)))
+        classifier.fit(X_train, y_train)
+        logging.info('The train accuracy was {}'.format(classifier.score(X_train, y_train)))
+        logging.info('The test accuracy was {}'.format(classifier.score(X_test, y_test)))
+
+        trained_classifier = classifier
+        score = get_ML_score(trained_classifier, df[features].values)
+
+    return trained_classifier, features
+
 def score_ML(df: pd.DataFrame,
-             trained_classifier: GridSearchCV,
+             trained_classifier: Union[GridSearchCV, Pipeline],
              features: list = None,
              fdr_level: float = 0.01,
              plot: bool = True,
@@ -497,8 +848,8 @@ def score_ML(df: pd.DataFrame,
 
     Args:
         df (pd.DataFrame): psms table of search results from alphapept.
-        trained_classifier (GridSearchCV): GridSearchCV object returned by train_RF.
-        features (list): list with features returned by train_RF. Defaults to 'None'.
+        trained_classifier (Union[GridSearchCV, Pipeline]): Classifier returned by train_RF or train_classifier.
+        features (list): list with features returned by train_RF or train_classifier. Defaults to 'None'.
         fdr_level (float, optional): fdr level that should be used for filtering. The value should lie between 0 and 1. Defaults to 0.01.
         plot (bool, optional): flag to enable plot. Defaults to 'True'.
 
@@ -509,7 +860,7 @@ def score_ML(df: pd.DataFrame,
     logging.info('Scoring using Machine Learning')
     # Apply the classifier to the entire dataset
     df_new = df.copy()
-    df_new['score'] = trained_classifier.predict_proba(df_new[features])[:,1]
+    df_new['score'] = get_ML_score(trained_classifier, df_new[features].values)
     df_new = filter_score(df_new)
     df_new = filter_precursor(df_new)
     cval, cutoff = cut_fdr(df_new, fdr_level, plot)
@@ -518,7 +869,7 @@ def score_ML(df: pd.DataFrame,
 
 
 def filter_with_ML(df: pd.DataFrame,
-             trained_classifier: GridSearchCV,
+             trained_classifier: Union[GridSearchCV, Pipeline],
              features: list = None,
              **kwargs) -> pd.DataFrame:
 
@@ -528,8 +879,8 @@ def filter_with_ML(df: pd.DataFrame,
 
     Args:
         df (pd.DataFrame): psms table of search results from alphapept.
-        trained_classifier (GridSearchCV): GridSearchCV object returned by train_RF.
-        features (list): list with features returned by train_RF. Defaults to 'None'.
+        trained_classifier (Union[GridSearchCV, Pipeline]): Classifier returned by train_RF or train_classifier.
+        features (list): list with features returned by train_RF or train_classifier. Defaults to 'None'.
 
     Returns:
         pd.DataFrame: psms table with an extra 'score' column from the trained_classifier by ML, filtered for no feature or precursor to be assigned multiple times.
@@ -537,14 +888,16 @@ def filter_with_ML(df: pd.DataFrame,
     logging.info('Filter df with x_tandem score')
     # Apply the classifier to the entire dataset
     df_new = df.copy()
-    df_new['score'] = trained_classifier.predict_proba(df_new[features])[:,1]
+    df_new['score'] = get_ML_score(trained_classifier, df_new[features].values)
     df_new = filter_score(df_new)
     df_new = filter_precursor(df_new)
 
     return df_new
 
 # Cell
-import networkx as nx
+import scipy.sparse
+import scipy.sparse.csgraph
+import alphapept.fasta
 
 def assign_proteins(data: pd.DataFrame, pept_dict: dict) -> (pd.DataFrame, dict):
     """
@@ -554,7 +907,7 @@ def assign_proteins(data: pd.DataFrame, pept_dict: dict) -> (pd.DataFrame, dict)
 
     Args:
         data (pd.DataFrame): psms table of scored and filtered search results from alphapept.
-        pept_dict (dict): dictionary that matches peptide sequences to proteins
+        pept_dict (dict): dictionary that matches peptide sequences to proteins, either a dict or a PeptideProteinMap
 
     Returns:
         pd.DataFrame: psms table of search results from alphapept appended with the number of matched proteins.
@@ -563,111 +916,173 @@ def assign_proteins(data: pd.DataFrame, pept_dict: dict) -> (pd.DataFrame, dict)
     """
 
     data = data.reset_index(drop=True)
+    pept_map = alphapept.fasta.PeptideProteinMap.from_dict(pept_dict)
 
-    data['n_possible_proteins'] = data['sequence'].apply(lambda x: len(pept_dict[x]))
+    locs = pept_map.get_loc(data['sequence'].values)
+    data['n_possible_proteins'] = pept_map.protein_indptr[locs + 1] - pept_map.protein_indptr[locs]
     unique_peptides = (data['n_possible_proteins'] == 1).sum()
     shared_peptides = (data['n_possible_proteins'] > 1).sum()
 
     logging.info(f'A total of {unique_peptides:,} unique and {shared_peptides:,} shared peptides.')
 
-    sub = data[data['n_possible_proteins']==1]
-    psms_to_protein = sub['sequence'].apply(lambda x: pept_dict[x])
+    unique = (data['n_possible_proteins'] == 1).values
+    proteins = pept_map.protein_indices[pept_map.protein_indptr[locs[unique]]]
 
     found_proteins = {}
-    for idx, _ in enumerate(psms_to_protein):
-        idx_ = psms_to_protein.index[idx]
-        p_str = 'p' + str(_[0])
-        if p_str in found_proteins:
-            found_proteins[p_str] = found_proteins[p_str] + [str(idx_)]
-        else:
-            found_proteins[p_str] = [str(idx_)]
+    for idx_, protein in zip(data.index[unique], proteins):
+        found_proteins.setdefault('p' + str(protein), []).append(str(idx_))
 
     return data, found_proteins
 
-def get_shared_proteins(data: pd.DataFrame, found_proteins: dict, pept_dict: dict) -> dict:
+@njit
+def get_razor_groups(protein_indptr: np.ndarray, protein_psms: np.ndarray, psm_indptr: np.ndarray, psm_proteins: np.ndarray, n_unique: np.ndarray, protein_rank: np.ndarray, component_indptr: np.ndarray, component_proteins: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
     """
-    Assign peptides to razor proteins.
+    Greedy razor assignment on a bipartite psm - protein graph.
+    Within each connected component, the protein with the most remaining psms (shared + unique) becomes the razor protein and its psms are removed.
+    Ties are broken by protein_rank. Proteins following the razor protein in this order that have the same psms are merged into a protein group.
 
     Args:
-        data (pd.DataFrame): psms table of scored and filtered search results from alphapept, appended with `n_possible_proteins`.
-        found_proteins (dict): dictionary mapping psms indices to proteins
-        pept_dict (dict): dictionary mapping peptide indices to the originating proteins as a list
+        protein_indptr (np.ndarray): Index pointer of the shared psms per protein.
+        protein_psms (np.ndarray): Shared psms per protein.
+        psm_indptr (np.ndarray): Index pointer of the proteins per shared psm.
+        psm_proteins (np.ndarray): Proteins per shared psm.
+        n_unique (np.ndarray): Number of unique psms per protein.
+        protein_rank (np.ndarray): Rank of each protein to break ties.
+        component_indptr (np.ndarray): Index pointer of the proteins per connected component.
+        component_proteins (np.ndarray): Proteins sorted by connected component.
 
     Returns:
-        dict: dictionary mapping peptides to razor proteins
-
+        np.ndarray: Razor group of each shared psm.
+        np.ndarray: Index pointer of the proteins per razor group.
+        np.ndarray: Proteins per razor group, starting with the razor protein.
     """
+    n_proteins = len(protein_indptr) - 1
+    n_psms = len(psm_indptr) - 1
+
+    counts = np.diff(protein_indptr) + n_unique
+    alive = np.ones(n_psms, dtype=np.bool_)
+    done = np.zeros(n_proteins, dtype=np.bool_)
+    marker = np.full(n_psms, -1, dtype=np.int64)
+
+    psm_group = np.full(n_psms, -1, dtype=np.int64)
+    group_indptr = np.zeros(n_proteins + 1, dtype=np.int64)
+    group_proteins = np.zeros(n_proteins, dtype=np.int64)
+    n_groups = 0
+    n_grouped = 0
+
+    for component in range(len(component_indptr) - 1):
+        proteins = component_proteins[component_indptr[component]:component_indptr[component + 1]]
+        n_left = len(proteins)
+
+        while n_left > 0:
+            max_count = -1
+            for protein in proteins:
+                if not done[protein] and counts[protein] > max_count:
+                    max_count = counts[protein]
+
+            candidates = np.array([protein for protein in proteins if not done[protein] and counts[protein] == max_count])
+            candidates = candidates[np.argsort(protein_rank[candidates])[::-1]]
+
+            razor = candidates[0]
+            for i in range(protein_indptr[razor], protein_indptr[razor + 1]):
+                if alive[protein_psms[i]]:
+                    marker[protein_psms[i]] = razor
+
+            n_members = 1
+            if n_unique[razor] == 0:
+                for candidate in candidates[1:]:
+                    if n_unique[candidate] != 0:
+                        break
+                    identical = True
+                    for i in range(protein_indptr[candidate], protein_indptr[candidate + 1]):
+                        if alive[protein_psms[i]] and marker[protein_psms[i]] != razor:
+                            identical = False
+                            break
+                    if not identical:
+                        break
+                    n_members += 1
 
-    G = nx.Graph()
+            for candidate in candidates[:n_members]:
+                done[candidate] = True
+            n_left -= n_members
 
-    sub = data[data['n_possible_proteins']>1]
+            if max_count > 0:
+                for candidate in candidates[:n_members]:
+                    group_proteins[n_grouped] = candidate
+                    n_grouped += 1
+                group_indptr[n_groups + 1] = n_grouped
 
-    for i in range(len(sub)):
-        seq, score = sub.iloc[i][['sequence','score']]
-        idx = sub.index[i]
-        possible_proteins = pept_dict[seq]
+                for i in range(protein_indptr[razor], protein_indptr[razor + 1]):
+                    psm = protein_psms[i]
+                    if alive[psm]:
+                        alive[psm] = False
+                        psm_group[psm] = n_groups
+                        for j in range(psm_indptr[psm], psm_indptr[psm + 1]):
+                            counts[psm_proteins[j]] -= 1
 
-        for p in possible_proteins:
-            G.add_edge(str(idx), 'p'+str(p), score=score)
+                n_groups += 1
 
-    connected_groups = np.array([list(c) for c in sorted(nx.connected_components(G), key=len, reverse=True)], dtype=object)
-    n_groups = len(connected_groups)
+    return psm_group, group_indptr[:n_groups + 1], group_proteins[:n_grouped]
 
-    logging.info('A total of {} ambigious proteins'.format(len(connected_groups)))
+def get_shared_proteins(data: pd.DataFrame, found_proteins: dict, pept_dict: dict) -> dict:
+    """
+    Assign peptides to razor proteins.
+    The shared psms and their proteins are stored as a sparse bipartite matrix, which is split into connected components with scipy.sparse.csgraph and solved with get_razor_groups.
 
-    #Solving with razor:
-    found_proteins_razor = {}
-    for a in connected_groups[::-1]:
-        H = G.subgraph(a).copy()
-        shared_proteins = list(np.array(a)[np.array(list(i[0] == 'p' for i in a))])
+    Args:
+        data (pd.DataFrame): psms table of scored and filtered search results from alphapept, appended with `n_possible_proteins`.
+        found_proteins (dict): dictionary mapping psms indices to proteins
+        pept_dict (dict): dictionary mapping peptide indices to the originating proteins as a list, either a dict or a PeptideProteinMap
 
-        while len(shared_proteins) > 0:
-            neighbors_list = []
+    Returns:
+        dict: dictionary mapping peptides to razor proteins
 
-            for node in shared_proteins:
-                shared_peptides = list(H.neighbors(node))
+    """
+    sub = data[data['n_possible_proteins']>1]
+    if len(sub) == 0:
+        return {}
 
-                if node in G:
-                    if node in found_proteins.keys():
-                        shared_peptides += found_proteins[node]
+    pept_map = alphapept.fasta.PeptideProteinMap.from_dict(pept_dict)
 
-                n_neigbhors = len(shared_peptides)
+    indices, proteins = pept_map.get_proteins(sub['sequence'].values)
+    psms = np.repeat(np.arange(len(sub)), np.diff(indices))
+    unique_proteins, proteins = np.unique(proteins, return_inverse=True)
+    n_psms = len(sub)
+    n_proteins = len(unique_proteins)
 
-                neighbors_list.append((n_neigbhors, node, shared_peptides))
+    psm_matrix = scipy.sparse.csr_matrix((np.ones(len(psms), dtype=np.int8), (psms, proteins)), shape=(n_psms, n_proteins))
+    psm_matrix.sum_duplicates()
+    protein_matrix = psm_matrix.tocsc()
 
+    graph = scipy.sparse.bmat([[None, psm_matrix], [psm_matrix.T, None]], format='csr')
+    n_components, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+    protein_labels = labels[n_psms:]
+    component_proteins = np.argsort(protein_labels, kind='stable')
+    component_indptr = np.zeros(n_components + 1, dtype=np.int64)
+    component_indptr[1:] = np.cumsum(np.bincount(protein_labels, minlength=n_components))
 
-            #Check if we have a protein_group (e.g. they share the same everythin)
-            neighbors_list.sort()
+    logging.info('A total of {} ambigious proteins'.format(n_components))
 
-            # Check for protein group
-            node_ = [neighbors_list[-1][1]]
-            idx = 1
-            while idx < len(neighbors_list): #Check for protein groups
-                if neighbors_list[-idx][0] == neighbors_list[-idx-1][0]: #lenght check
-                    if set(neighbors_list[-idx][2]) == set(neighbors_list[-idx-1][2]): #identical peptides
-                        node_.append(neighbors_list[-idx-1][1])
-                        idx += 1
-                    else:
-                        break
-                else:
-                    break
+    # Proteins were identified by their string 'p' + index, ties are broken in the same order
+    protein_names = np.char.add('p', unique_proteins.astype(str))
+    protein_rank = np.argsort(np.argsort(protein_names, kind='stable'))
+    n_unique = np.array([len(found_proteins.get(_, [])) for _ in protein_names], dtype=np.int64)
 
-            #Remove the last entry:
-            shared_peptides = neighbors_list[-1][2]
-            for node in node_:
-                shared_proteins.remove(node)
+    psm_group, group_indptr, group_proteins = get_razor_groups(protein_matrix.indptr.astype(np.int64), protein_matrix.indices.astype(np.int64), psm_matrix.indptr.astype(np.int64), psm_matrix.indices.astype(np.int64), n_unique, protein_rank, component_indptr, component_proteins.astype(np.int64))
 
-            for _ in shared_peptides:
-                if _ in H:
-                    H.remove_node(_)
+    order = np.argsort(psm_group, kind='stable')
+    psm_indptr = np.searchsorted(psm_group[order], np.arange(len(group_indptr)))
+    psm_names = sub.index.values[order].astype(str)
 
-            if len(shared_peptides) > 0:
-                if len(node_) > 1:
-                    node_ = tuple(node_)
-                else:
-                    node_ = node_[0]
+    found_proteins_razor = {}
+    for group in range(len(group_indptr) - 1):
+        node_ = tuple(protein_names[group_proteins[group_indptr[group]:group_indptr[group + 1]]].tolist())
+        shared_peptides = psm_names[psm_indptr[group]:psm_indptr[group + 1]].tolist() + found_proteins.get(node_[0], [])
 
-                found_proteins_razor[node_] = shared_peptides
+        if len(node_) > 1:
+            found_proteins_razor[node_] = shared_peptides
+        else:
+            found_proteins_razor[node_[0]] = shared_peptides
 
     return found_proteins_razor
 
@@ -787,11 +1202,74 @@ ion_dict[0] = ''
 ion_dict[1] = '-H20'
 ion_dict[2] = '-NH3'
 
+def get_ion_positions(ion_idx: np.ndarray, n_ions: np.ndarray)-> (np.ndarray, np.ndarray):
+    """
+    Helper function to get the positions of the ion-hits of several PSMs in the ion table.
+    The ions of a PSM are stored at ion_idx:ion_idx+n_ions in the ion table.
+
+    Args:
+        ion_idx (np.ndarray): Index of the first ion of each PSM.
+        n_ions (np.ndarray): Number of ions of each PSM.
+
+    Returns:
+        np.ndarray: Indices of the ragged array, the ions of PSM i are at positions[indptr[i]:indptr[i+1]].
+        np.ndarray: Positions of the ions in the ion table.
+    """
+    n_ions = np.asarray(n_ions, dtype=np.int64)
+    indptr = np.zeros(len(n_ions) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(n_ions)
+
+    positions = np.arange(indptr[-1], dtype=np.int64) + np.repeat(np.asarray(ion_idx, dtype=np.int64) - indptr[:-1], n_ions)
+
+    return indptr, positions
+
+def get_ions(df: pd.DataFrame, ions: pd.DataFrame)-> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+    """
+    Helper function to extract the ion-hits for all PSMs of a DataFrame as ragged arrays.
+    The ion annotations can be formatted with `format_ion_types`.
+
+    Args:
+        df (pd.DataFrame): DataFrame with PSMs
+        ions (pd.DataFrame): DataFrame with ion hits
+
+    Returns:
+        np.ndarray: Indices of the ragged arrays, the ions of PSM i are at indptr[i]:indptr[i+1].
+        np.ndarray: Array with the ion index (b-ions > 0, y-ions < 0).
+        np.ndarray: Array with the ion type (loss).
+        np.ndarray: Array with intensity information
+    """
+    indptr, positions = get_ion_positions(df['ion_idx'].values, df['n_ions'].values)
+
+    ion_index = ions['ion_index'].values[positions]
+    ion_type = ions['ion_type'].values[positions]
+    ion_int = ions['ion_int'].values[positions]
+
+    return indptr, ion_index, ion_type, ion_int
+
+def format_ion_types(ion_index: np.ndarray, ion_type: np.ndarray)-> np.ndarray:
+    """
+    Helper function to describe ion-hits as strings, e.g. 'b1', 'y1-H20'.
+
+    Args:
+        ion_index (np.ndarray): Array with the ion index (b-ions > 0, y-ions < 0).
+        ion_type (np.ndarray): Array with the ion type (loss).
+
+    Returns:
+        np.ndarray: Array with strings that describe the ion type.
+    """
+    ion_index = np.asarray(ion_index).astype(np.int64)
+    losses = np.array([ion_dict[_] for _ in sorted(ion_dict)])
+
+    ion = np.char.add(np.where(ion_index >= 0, 'b', 'y'), np.abs(ion_index).astype(str))
+
+    return np.char.add(ion, losses[np.asarray(ion_type).astype(np.int64)])
+
 def get_ion(i: int, df: pd.DataFrame, ions: pd.DataFrame)-> (list, np.ndarray):
     """
     Helper function to extract the ion-hits for a given DataFrame index.
     This function extracts the hit type and the intensities.
     E.g.: ['b1','y1'], np.array([10,20]).
+    To extract the ion-hits of many PSMs, use `get_ions`.
 
     Args:
         i (int): Row index for the DataFrame
@@ -802,13 +1280,10 @@ def get_ion(i: int, df: pd.DataFrame, ions: pd.DataFrame)-> (list, np.ndarray):
         list: List with strings that describe the ion type.
         np.ndarray: Array with intensity information
     """
-    start = df['ion_idx'].iloc[i]
-    end = df['n_ions'].iloc[i]+start
+    _, ion_index, ion_type, ion_int = get_ions(df.iloc[i:i+1], ions)
 
-    ion = [('b'+str(int(_))).replace('b-','y') for _ in ions.iloc[start:end]['ion_index']]
-    losses = [ion_dict[int(_)] for _ in ions.iloc[start:end]['ion_type']]
-    ion = [a+b for a,b in zip(ion, losses)]
-    ints = ions.iloc[start:end]['ion_int'].astype('int').values
+    ion = format_ion_types(ion_index, ion_type).tolist()
+    ints = ion_int.astype('int')
 
     return ion, ints
 
@@ -832,11 +1307,220 @@ def ecdf(data:np.ndarray)-> (np.ndarray, np.ndarray):
 
     return (x,y)
 
+class ECDFMapper(object):
+    """Calibrated mapping of scores to [0,1] with the ECDF of a reference score distribution."""
+
+    def __init__(self, x:np.ndarray, y:np.ndarray):
+        """Create a mapper from an ECDF.
+
+        Args:
+            x (np.ndarray): Sorted, unique reference scores.
+            y (np.ndarray): Fraction of reference scores smaller or equal than x.
+        """
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+
+    @classmethod
+    def from_scores(cls, data:np.ndarray):
+        """Create a mapper from reference scores, e.g. the scores of all targets."""
+        x, y = ecdf(data)
+        # For tied scores, keep the fraction of scores smaller or equal
+        last = np.append(x[1:] != x[:-1], True)
+
+        return cls(x[last], y[last])
+
+    def __call__(self, scores:np.ndarray) -> np.ndarray:
+        """Map scores to [0,1] by linear interpolation of the ECDF.
+        Scores outside of the reference range are mapped to the smallest and largest ECDF value.
+        """
+        return np.interp(scores, self.x, self.y)
+
+    def save(self, path:str):
+        """Save the mapper to an .npz file."""
+        np.savez(path, x=self.x, y=self.y)
+
+    @classmethod
+    def load(cls, path:str):
+        """Load a mapper that was saved with save()."""
+        with np.load(path) as data:
+            return cls(data['x'], data['y'])
+
+
 # Cell
 import os
 from multiprocessing import Pool
-from scipy.interpolate import interp1d
 from typing import Callable, Union
+import pickle
+
+def read_psms(ms_file_: alphapept.io.MS_Data_File) -> pd.DataFrame:
+    """Read the psms of the second search or, if not present, of the first search.
+
+    Args:
+        ms_file_ (alphapept.io.MS_Data_File): The ms_data file.
+
+    Returns:
+        pd.DataFrame: psms table. Empty if no search results are present.
+    """
+    try:
+        df = ms_file_.read(dataset_name='second_search')
+        logging.info('Found second search psms for scoring.')
+    except KeyError:
+        try:
+            df = ms_file_.read(dataset_name='first_search')
+            logging.info('No second search psms for scoring found. Using first search.')
+        except KeyError:
+            df = pd.DataFrame()
+
+    return df
+
+def get_classifier_path(settings: dict) -> str:
+    """Path of the experiment-level classifier next to the results file.
+
+    Args:
+        settings (dict): Settings file for the experiment.
+
+    Returns:
+        str: Path of the classifier file.
+    """
+    base, ext = os.path.splitext(settings['experiment']['results_path'])
+
+    return base + '_classifier.pkl'
+
+def get_ecdf_path(settings: dict) -> str:
+    """Path of the experiment-level ECDFMapper next to the results file.
+
+    Args:
+        settings (dict): Settings file for the experiment.
+
+    Returns:
+        str: Path of the ECDF file.
+    """
+    base, ext = os.path.splitext(settings['experiment']['results_path'])
+
+    return base + '_ecdf.npz'
+
+def save_classifier(path: str, trained_classifier: Union[GridSearchCV, Pipeline], features: list):
+    """Save a trained classifier together with its feature list.
+
+    Args:
+        path (str): Path of the classifier file.
+        trained_classifier (Union[GridSearchCV, Pipeline]): Classifier returned by train_classifier.
+        features (list): list with features returned by train_classifier.
+    """
+    with open(path, 'wb') as file:
+        pickle.dump({'classifier': trained_classifier, 'features': features}, file)
+
+def load_classifier(path: str) -> (Union[GridSearchCV, Pipeline], list):
+    """Load a classifier that was saved with save_classifier.
+
+    Args:
+        path (str): Path of the classifier file.
+
+    Returns:
+        [Union[GridSearchCV, Pipeline], list]: Trained classifier. list: list of features used for training the classifier.
+    """
+    with open(path, 'rb') as file:
+        data = pickle.load(file)
+
+    return data['classifier'], data['features']
+
+def sample_psms(df: pd.DataFrame, n_queries: int, random_state: int = 42) -> pd.DataFrame:
+    """Randomly sample spectra and keep all their psms, so that the best psm per spectrum can still be determined.
+
+    Args:
+        df (pd.DataFrame): psms table of search results from alphapept.
+        n_queries (int): Number of spectra to sample.
+        random_state (int, optional): Random state for sampling. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: psms of the sampled spectra.
+    """
+    queries = df['query_idx'].unique()
+    if len(queries) > n_queries:
+        queries = np.random.default_rng(random_state).choice(queries, n_queries, replace=False)
+        df = df[df['query_idx'].isin(queries)].copy()
+
+    return df
+
+def read_shared_psms(settings: dict, callback: Callable = None) -> pd.DataFrame:
+    """Sample psms from all files of an experiment and pool them into one table.
+    The same number of spectra is sampled from each file (settings['score']['shared_classifier_queries'] in total).
+    Spectrum, feature and raw indices are offset per file and the file index is appended to the precursor,
+    so that psms of different files are not filtered against each other.
+
+    Args:
+        settings (dict): Settings file for the experiment.
+        callback (Callable): Optional callback.
+
+    Returns:
+        pd.DataFrame: psms table with ML features of all files. Empty if no psms are present.
+    """
+    file_paths = settings['experiment']['file_paths']
+    n_queries = max(settings['score']['shared_classifier_queries'] // max(len(file_paths), 1), 1)
+
+    dfs = []
+    offsets = {}
+    for index, file_name in enumerate(file_paths):
+        base_file_name, ext = os.path.splitext(file_name)
+        df = read_psms(alphapept.io.MS_Data_File(base_file_name+".ms_data.hdf"))
+
+        if len(df) > 0:
+            df = sample_psms(df, n_queries, random_state=index)
+            df = get_ML_features(df, **settings['fasta'])
+            for column in ['query_idx', 'feature_idx', 'raw_idx']:
+                if column in df.columns:
+                    df[column] += offsets.get(column, 0)
+                    offsets[column] = df[column].max() + 1
+            if 'precursor' in df.columns:
+                df['precursor'] = df['precursor'] + f'_{index}'
+            dfs.append(df)
+
+        if callback:
+            callback((index+1)/len(file_paths))
+
+    if len(dfs) == 0:
+        return pd.DataFrame()
+
+    return pd.concat(dfs, join='inner', ignore_index=True)
+
+def train_shared_classifier(settings: dict, callback: Callable = None) -> Union[str, None]:
+    """Train one classifier on psms from all files of an experiment and save it to get_classifier_path.
+    The psms are sampled and pooled with read_shared_psms.
+    If no classifier can be trained, an ECDFMapper of the x_tandem scores is saved to get_ecdf_path instead.
+
+    Args:
+        settings (dict): Settings file for the experiment.
+        callback (Callable): Optional callback.
+
+    Returns:
+        Union[str, None]: Path of the saved classifier or None if no classifier could be trained.
+    """
+    path = get_classifier_path(settings)
+    ecdf_path = get_ecdf_path(settings)
+    for _ in [path, ecdf_path]:
+        if os.path.isfile(_):
+            os.remove(_)
+
+    df = read_shared_psms(settings, callback=callback)
+    if len(df) == 0:
+        logging.info('No psms present. Skipping training of shared classifier.')
+        return None
+
+    logging.info(f'Training shared classifier on {len(df):,} psms from {len(settings["experiment"]["file_paths"])} files.')
+
+    try:
+        trained_classifier, features = train_classifier(df, method=settings["score"]["method"])
+    except ValueError as e:
+        logging.info(f'Training of shared classifier failed. Training classifiers per file. {e}')
+        # Files that cannot be scored with ML fall back to the x_tandem score, calibrated on all files
+        ECDFMapper.from_scores(df[~df['decoy']]['x_tandem'].values).save(ecdf_path)
+        logging.info(f'Shared ECDF saved to {ecdf_path}.')
+        return None
+
+    save_classifier(path, trained_classifier, features)
+    logging.info(f'Shared classifier saved to {path}.')
+
+    return path
 
 #This function has no unit test and is covered by the quick_test
 def score_hdf(to_process: tuple, callback: Callable = None, parallel: bool=False) -> Union[bool, str]:
@@ -861,15 +1545,7 @@ def score_hdf(to_process: tuple, callback: Callable = None, parallel: bool=False
 
         ms_file_ = alphapept.io.MS_Data_File(ms_file, is_overwritable=True)
 
-        try:
-            df = ms_file_.read(dataset_name='second_search')
-            logging.info('Found second search psms for scoring.')
-        except KeyError:
-            try:
-                df = ms_file_.read(dataset_name='first_search')
-                logging.info('No second search psms for scoring found. Using first search.')
-            except KeyError:
-                df = pd.DataFrame()
+        df = read_psms(ms_file_)
 
         if len(df) == 0:
             skip = True
@@ -878,9 +1554,20 @@ def score_hdf(to_process: tuple, callback: Callable = None, parallel: bool=False
         if not skip:
             df_ = get_ML_features(df, **settings['fasta'])
 
-            if settings["score"]["method"] == 'random_forest':
+            if settings["score"]["method"] in ['random_forest', *CLASSIFIERS]:
                 try:
-                    cv, features = train_RF(df)
+                    cv = None
+                    classifier_path = get_classifier_path(settings)
+                    if settings['score'].get('shared_classifier', False) and os.path.isfile(classifier_path):
+                        cv, features = load_classifier(classifier_path)
+                        if set(features).issubset(df_.columns):
+                            logging.info(f'Using shared classifier from {classifier_path}.')
+                        else:
+                            logging.info('Features of shared classifier not present. Training classifier for this file.')
+                            cv = None
+
+                    if cv is None:
+                        cv, features = train_classifier(df, method=settings["score"]["method"])
                     df = filter_with_ML(df_, cv, features = features)
                 except ValueError as e:
                     logging.info('ML failed. Defaulting to x_tandem score')
@@ -888,10 +1575,14 @@ def score_hdf(to_process: tuple, callback: Callable = None, parallel: bool=False
 
                     logging.info('Converting x_tandem score to probabilities')
 
-                    x_, y_ = ecdf(df_[~df_['decoy']]['score'].values)
-                    f = interp1d(x_, y_, bounds_error = False, fill_value=(y_.min(), y_.max()))
+                    ecdf_path = get_ecdf_path(settings)
+                    if settings['score'].get('shared_classifier', False) and os.path.isfile(ecdf_path):
+                        mapper = ECDFMapper.load(ecdf_path)
+                        logging.info(f'Using shared ECDF from {ecdf_path}.')
+                    else:
+                        mapper = ECDFMapper.from_scores(df_[~df_['decoy']]['x_tandem'].values)
 
-                    df_['score'] = df_['score'].apply(lambda x: f(x))
+                    df_['score'] = mapper(df_['x_tandem'].values)
                     df = filter_with_score(df_)
 
             elif settings["score"]["method"] == 'x_tandem':
@@ -908,27 +1599,8 @@ def score_hdf(to_process: tuple, callback: Callable = None, parallel: bool=False
 
             logging.info('FDR on peptides complete. For {} FDR found {:,} targets and {:,} decoys.'.format(settings["search"]["peptide_fdr"], df['target'].sum(), df['decoy'].sum()) )
 
-            # Insert here
-
-            try:
-                logging.info('Extracting ions')
-                ions = ms_file_.read(dataset_name='ions')
-
-                ion_list = []
-                ion_ints = []
-
-                for i in range(len(df)):
-                    ion, ints = get_ion(i, df, ions)
-                    ion_list.append(ion)
-                    ion_ints.append(ints)
-
-                df['ion_int'] = ion_ints
-                df['ion_types'] = ion_list
-
-                logging.info('Extracting ions complete.')
-
-            except KeyError:
-                logging.info('No ions present.')
+            # The ion hits are not copied to the PSMs, they stay in the ions dataset and are linked with ion_idx and n_ions.
+            # They can be extracted for all PSMs at once with get_ions and formatted with format_ion_types.
 
             ms_file_.write(df, dataset_name="peptide_fdr")
 
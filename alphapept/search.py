@@ -1,9 +1,14 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/05_search.ipynb (unless otherwise specified).
 
-__all__ = ['compare_frags', 'ppm_to_dalton', 'get_idxs', 'compare_spectrum_parallel', 'query_data_to_features',
-           'get_psms', 'frag_delta', 'intensity_fraction', 'add_column', 'remove_column', 'get_hits', 'score',
-           'LOSS_DICT', 'LOSSES', 'get_sequences', 'get_score_columns', 'plot_psms', 'store_hdf', 'search_db',
-           'search_fasta_block', 'mass_dict', 'filter_top_n', 'ion_extractor', 'search_parallel']
+__all__ = ['compare_frags', 'ppm_to_dalton', 'get_idxs', 'sort_top_n', 'heap_insert', 'heap_insert_numba',
+           'compare_spectrum_parallel', 'frag_to_bin', 'build_fragment_index', 'score_frags',
+           'compare_spectrum_fragment_index', 'query_data_to_features', 'get_query_blocks', 'get_psms', 'frag_delta',
+           'intensity_fraction', 'add_column', 'remove_column', 'count_hits', 'fill_hits', 'get_hits', 'ION_DTYPE',
+           'score_psms', 'score', 'LOSS_DICT', 'LOSSES', 'get_sequences', 'get_score_columns', 'plot_psms',
+           'get_offset_histogram', 'annotate_offsets', 'find_offset_peaks', 'get_confident_offsets',
+           'create_shared_database', 'attach_shared_database', 'release_shared_database', 'SHARED_DB_ARRAYS',
+           'store_hdf', 'search_db', 'read_query_data_cached', 'search_fasta_block', 'mass_dict', 'filter_top_n',
+           'extract_ions', 'ion_extractor', 'search_parallel']
 
 # Cell
 import logging
@@ -93,6 +98,63 @@ def get_idxs(db_masses:np.ndarray, query_masses:np.ndarray, prec_tol:float, ppm:
 
 import alphapept.performance
 
+def _heap_insert(best_hits:np.ndarray, score:np.ndarray, query_idx:int, db_idx:int, hits:float):
+    """Inserts a hit into the min-heap that is stored in a row of best_hits and score.
+    The root of the heap is the worst hit; for equal scores, the hit with the higher db_idx is considered worse.
+
+    Args:
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        query_idx (int): Row of the query in best_hits and score.
+        db_idx (int): Index of the database entry.
+        hits (float): Score of the comparison.
+    """
+    if (hits < score[query_idx, 0]) or (hits == score[query_idx, 0] and db_idx >= best_hits[query_idx, 0]):
+        return
+
+    len_ = best_hits.shape[1]
+    i = 0
+
+    while 2 * i + 1 < len_:
+        child = 2 * i + 1
+        right = child + 1
+        if right < len_:
+            if (score[query_idx, right] < score[query_idx, child]) or (score[query_idx, right] == score[query_idx, child] and best_hits[query_idx, right] > best_hits[query_idx, child]):
+                child = right
+
+        if (score[query_idx, child] < hits) or (score[query_idx, child] == hits and best_hits[query_idx, child] > db_idx):
+            score[query_idx, i] = score[query_idx, child]
+            best_hits[query_idx, i] = best_hits[query_idx, child]
+            i = child
+        else:
+            break
+
+    score[query_idx, i] = hits
+    best_hits[query_idx, i] = db_idx
+
+heap_insert = alphapept.performance.compile_function(_heap_insert)
+heap_insert_numba = alphapept.performance.compile_function(compilation_mode="numba")(_heap_insert)
+
+
+def sort_top_n(best_hits:np.ndarray, score:np.ndarray)-> (np.ndarray, np.ndarray):
+    """Sorts each row of best_hits and score by descending score and ascending db_idx.
+
+    Args:
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+
+    Returns:
+        np.ndarray: Sorted best_hits.
+        np.ndarray: Sorted score.
+    """
+    order = np.lexsort((best_hits, -score))
+
+    return np.take_along_axis(best_hits, order, axis=1), np.take_along_axis(score, order, axis=1)
+
+# Cell
+
+import alphapept.performance
+
 @alphapept.performance.performance_function
 def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool):
     """Compares a spectrum and writes to the best_hits and score.
@@ -159,31 +221,191 @@ def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower
             elif delta_mass > 0:
                 d += 1
 
-        len_ = best_hits.shape[1]
-        for i in range(len_):
-            if score[query_idx, i] < hits:
+        heap_insert(best_hits, score, query_idx, db_idx, hits)
+
+# Cell
+
+@njit
+def frag_to_bin(masses:np.ndarray, frag_tol:float, ppm:bool)->np.ndarray:
+    """Function to convert fragment masses to the bins of a fragment index.
+
+    Args:
+        masses (np.ndarray): Array with fragment masses.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+
+    Returns:
+        np.ndarray: Array with the bin of each mass.
+    """
+    if ppm:
+        bins = np.floor(np.log(masses) / np.log1p(frag_tol * 1e-6))
+    else:
+        bins = np.floor(masses / frag_tol)
+
+    return bins.astype(np.int64)
+
+
+def build_fragment_index(db_frags:np.ndarray, db_indices:np.ndarray, frag_tol:float, ppm:bool)-> (np.ndarray, np.ndarray, int):
+    """Function to build an inverted index that maps fragment bins to database entries.
+
+    Args:
+        db_frags (np.ndarray): Array with database fragments.
+        db_indices (np.ndarray): Array with indices to the database fragments.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+
+    Returns:
+        np.ndarray: Array with indices to index_db_idx for each bin.
+        np.ndarray: Array with database indices, sorted by bin and database index.
+        int: Bin of the lowest fragment mass.
+    """
+    frag_bins = frag_to_bin(db_frags, frag_tol, ppm)
+    db_idx = np.repeat(np.arange(len(db_indices) - 1), np.diff(db_indices))
+
+    # db_idx is already sorted, a stable sort keeps it sorted within a bin
+    sortindex = np.argsort(frag_bins, kind='stable')
+    frag_bins = frag_bins[sortindex]
+    db_idx = db_idx[sortindex]
+
+    # A database entry should only be counted once per bin
+    unique = np.ones(len(db_idx), dtype=np.bool_)
+    unique[1:] = (frag_bins[1:] != frag_bins[:-1]) | (db_idx[1:] != db_idx[:-1])
+    frag_bins = frag_bins[unique]
+    db_idx = db_idx[unique]
+
+    if len(frag_bins) == 0:
+        return np.zeros(1, dtype=np.int64), db_idx, 0
+
+    min_bin = frag_bins[0]
+    index_indptr = np.zeros(frag_bins[-1] - min_bin + 2, dtype=np.int64)
+    index_indptr[1:] = np.cumsum(np.bincount(frag_bins - min_bin))
+
+    return index_indptr, db_idx, min_bin
+
+# Cell
+
+@njit
+def score_frags(query_frag:np.ndarray, query_int:np.ndarray, query_int_sum:float, db_frag:np.ndarray, frag_tol:float, ppm:bool)->float:
+    """Compare query and database frags and calculate the number of hits plus the matched intensity fraction.
+    This is the same score as used in `compare_spectrum_parallel`.
+
+    Args:
+        query_frag (np.ndarray): Array with query fragments.
+        query_int (np.ndarray): Array with query intensities.
+        query_int_sum (float): Summed intensity of the query.
+        db_frag (np.ndarray): Array with database fragments.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+
+    Returns:
+        float: Score of the comparison.
+    """
+    q_max = len(query_frag)
+    d_max = len(db_frag)
+
+    hits = 0
+
+    q, d = 0, 0  # q > query, d > database
+    while q < q_max and d < d_max:
+        mass1 = query_frag[q]
+        mass2 = db_frag[d]
+        delta_mass = mass1 - mass2
+
+        if ppm:
+            sum_mass = mass1 + mass2
+            mass_difference = 2 * delta_mass / sum_mass * 1e6
+        else:
+            mass_difference = delta_mass
+
+        if abs(mass_difference) <= frag_tol:
+            hits += 1
+            hits += query_int[q]/query_int_sum
+            d += 1
+            q += 1  # Only one query for each db element
+        elif delta_mass < 0:
+            q += 1
+        elif delta_mass > 0:
+            d += 1
+
+    return hits
+
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def compare_spectrum_fragment_index(query_idx:int, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, index_indptr:np.ndarray, index_db_idx:np.ndarray, min_bin:int, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, n_candidates:int, min_shared:int):
+    """Compares a spectrum with the candidates from a fragment index and writes to the best_hits and score.
+
+    Args:
+        query_idx (int): Integer to the query_spectrum that should be compared.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_indices (np.ndarray):  Array with indices to the database data.
+        db_frags (np.ndarray): Array with frag types of the db data.
+        index_indptr (np.ndarray): Array with indices to index_db_idx for each bin, see `build_fragment_index`.
+        index_db_idx (np.ndarray): Array with database indices sorted by bin, see `build_fragment_index`.
+        min_bin (int): Bin of the lowest fragment mass in the index.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        n_candidates (int): Number of candidates with the most shared peaks that are compared exactly.
+        min_shared (int): Minimum number of shared peaks for a candidate to be compared exactly.
+    """
+    idx_low = idxs_lower[query_idx]
+    idx_high = idxs_higher[query_idx]
+
+    n_db = idx_high - idx_low
 
-                # This is mean to report the hit in our top-n array
-                # The code below looks weird but is necessary to be used with cuda
-                # It should be equivalent to this code:
+    if n_db > 0:
+        query_idx_start = query_indices[query_idx]
+        query_idx_end = query_indices[query_idx + 1]
+        query_frag = query_frags[query_idx_start:query_idx_end]
+        query_int = query_ints[query_idx_start:query_idx_end]
+
+        query_int_sum = 0
+        for qi in query_int:
+            query_int_sum += qi
+
+        # Mass range of the database fragments that can match a query fragment
+        if ppm:
+            tol = frag_tol * 1e-6
+            lower_bins = frag_to_bin(query_frag * (2 - tol) / (2 + tol), frag_tol, ppm)
+            upper_bins = frag_to_bin(query_frag * (2 + tol) / (2 - tol), frag_tol, ppm)
+        else:
+            lower_bins = frag_to_bin(query_frag - frag_tol, frag_tol, ppm)
+            upper_bins = frag_to_bin(query_frag + frag_tol, frag_tol, ppm)
+
+        max_bin = min_bin + len(index_indptr) - 2
+
+        shared = np.zeros(n_db, dtype=np.int64)
 
-                #score_slice = score[query_idx, i:(len_-1)]
-                #hit_slice = best_hits[query_idx, i:(len_-1)]
+        for q in range(len(query_frag)):
+            for b in range(max(lower_bins[q], min_bin), min(upper_bins[q], max_bin) + 1):
+                start = index_indptr[b - min_bin]
+                end = index_indptr[b - min_bin + 1]
+                pos = start + np.searchsorted(index_db_idx[start:end], idx_low)
+                while pos < end:
+                    db_idx = index_db_idx[pos]
+                    if db_idx >= idx_high:
+                        break
+                    shared[db_idx - idx_low] += 1
+                    pos += 1
 
-                #score[query_idx, (i+1):len_] = score_slice
-                #best_hits[query_idx, (i+1):len_] = hit_slice
+        candidates = np.where(shared >= max(min_shared, 1))[0]
 
-                j = 1
+        if len(candidates) > n_candidates:
+            top = np.argsort(-shared[candidates], kind='mergesort')[:n_candidates]
+            candidates = np.sort(candidates[top])
 
-                while len_-j >= (i+1):
-                    k = len_-j
-                    score[query_idx, k] = score[query_idx, k-1]
-                    best_hits[query_idx, k] = best_hits[query_idx, k-1]
-                    j+=1
+        for candidate in candidates:
+            db_idx = idx_low + candidate
+            db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx + 1]]
 
-                score[query_idx, i] = hits
-                best_hits[query_idx, i] = db_idx
-                break
+            hits = score_frags(query_frag, query_int, query_int_sum, db_frag, frag_tol, ppm)
+
+            heap_insert_numba(best_hits, score, query_idx, db_idx, hits)
 
 # Cell
 
@@ -214,8 +436,48 @@ def query_data_to_features(query_data: dict)->pd.DataFrame:
 
     return features
 
+# Cell
+
+def get_query_blocks(query_masses:np.ndarray, n_frags:np.ndarray, top_n:int, bytes_per_frag:int, memory_budget:float = None, db_bytes:int = 0, min_block_size:int = 1000)-> list:
+    """Function to split query spectra into mass-sorted blocks that fit into a memory budget.
+
+    Args:
+        query_masses (np.ndarray): Array with query masses.
+        n_frags (np.ndarray): Array with the number of fragments of each query.
+        top_n (int): Number of best hits that are reported per query.
+        bytes_per_frag (int): Number of bytes to store a fragment (mass and intensity).
+        memory_budget (float, optional): Memory budget in GB. If None, all queries are in a single block. Defaults to None.
+        db_bytes (int, optional): Number of bytes used by the database. Defaults to 0.
+        min_block_size (int, optional): Number of queries per block if the database alone exceeds the budget. Defaults to 1000.
+
+    Returns:
+        list: List of arrays with query indices for each block.
+    """
+    n_queries = len(query_masses)
+
+    if memory_budget is None or n_queries == 0:
+        return [np.arange(n_queries)]
+
+    # Fragments, top-n hits and scores, indices and search boundaries
+    bytes_per_query = n_frags * bytes_per_frag + top_n * 16 + 32
+
+    available = memory_budget * 1024**3 - db_bytes
+
+    order = np.argsort(query_masses, kind='stable')
+
+    if available <= 0:
+        logging.warning(f'Database with {db_bytes/1024**3:.2f} GB exceeds the memory budget of {memory_budget:.2f} GB. Using blocks of {min_block_size:,} queries.')
+        block_ids = np.arange(n_queries) // min_block_size
+    else:
+        block_ids = np.cumsum(bytes_per_query[order]) // available
+
+    splits = np.where(np.diff(block_ids) != 0)[0] + 1
+
+    return np.split(order, splits)
+
 # Cell
 from typing import Callable
+import alphapept.io
 
 #this wrapper function is covered by the quick_test
 def get_psms(
@@ -230,6 +492,12 @@ def get_psms(
     callback: Callable = None,
     prec_tol_calibrated:float = None,
     frag_tol_calibrated:float = None,
+    engine:str = 'standard',
+    n_candidates:int = 50,
+    open_search:bool = False,
+    open_prec_tol:float = 500,
+    top_n:int = 5,
+    memory_budget:float = None,
     **kwargs
 )->(np.ndarray, int):
     """[summary]
@@ -246,6 +514,12 @@ def get_psms(
         callback (Callable, optional): Optional callback. Defaults to None.
         prec_tol_calibrated (float, optional): Precursor tolerance if calibration exists. Defaults to None.
         frag_tol_calibrated (float, optional): Fragment tolerance if calibration exists. Defaults to None.
+        engine (str, optional): Search engine, either 'standard' or 'fragment_index'. Defaults to 'standard'.
+        n_candidates (int, optional): Number of candidates per query that are compared exactly when using the fragment index. Defaults to 50.
+        open_search (bool, optional): Flag to perform an open search with a precursor window of open_prec_tol Dalton. The fragment index is used as engine. Defaults to False.
+        open_prec_tol (float, optional): Precursor tolerance in Dalton for open search. Defaults to 500.
+        top_n (int, optional): Number of best hits that are reported per query. Defaults to 5.
+        memory_budget (float, optional): Memory budget in GB. If set, the query spectra are searched in mass-sorted blocks that fit into the budget. Defaults to None.
 
     Returns:
         np.ndarray: Numpy recordarray storing the PSMs.
@@ -277,25 +551,6 @@ def get_psms(
         query_mz = features['mz_matched'].values
         query_rt = features['rt_matched'].values
         query_selection = features['query_idx'].values
-        indices = np.zeros(len(query_selection) + 1, np.int64)
-        indices[1:] = np.diff(query_indices)[query_selection]
-        indices = np.cumsum(indices)
-        query_frags = np.concatenate(
-            [
-                query_frags[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-
-        query_ints = np.concatenate(
-            [
-                query_ints[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-        query_indices = indices
     else:
         if prec_tol_calibrated:
             prec_tol = prec_tol_calibrated
@@ -303,54 +558,94 @@ def get_psms(
         query_masses = query_data['prec_mass_list2']
         query_mz = query_data['mono_mzs2']
         query_rt = query_data['rt_list_ms2']
+        query_selection = np.arange(len(query_masses))
+
+    if open_search:
+        prec_tol = open_prec_tol
+        engine = 'fragment_index'
+        logging.info(f'Open search with a precursor window of {prec_tol:.2f} Da.')
 
     idxs_lower, idxs_higher = get_idxs(
         db_masses,
         query_masses,
         prec_tol,
-        ppm
+        ppm and not open_search
     )
 
     n_queries = len(query_masses)
     n_db = len(db_masses)
-    top_n = 5
 
-    if alphapept.performance.COMPILATION_MODE == "cuda":
+    if engine not in ['standard', 'fragment_index']:
+        raise NotImplementedError(f'Search engine {engine} not implemented.')
+
+    n_frags = np.diff(query_indices)[query_selection]
+    db_bytes = db_masses.nbytes + db_frags.nbytes + db_indices.nbytes
+    query_blocks = get_query_blocks(query_masses, n_frags, top_n, query_frags.itemsize + query_ints.itemsize, memory_budget, db_bytes)
+
+    if engine == 'standard' and alphapept.performance.COMPILATION_MODE == "cuda":
         import cupy
         cupy = cupy
 
-        idxs_lower = cupy.array(idxs_lower)
-        idxs_higher = cupy.array(idxs_higher)
-        query_indices = cupy.array(query_indices)
-        query_ints = cupy.array(query_ints)
-        query_frags = cupy.array(query_frags)
         db_indices = cupy.array(db_indices)
         db_frags = cupy.array(db_frags)
-        db_frags = cupy.array(db_frags)
 
     else:
         import numpy
         cupy = numpy
 
-    best_hits = cupy.zeros((n_queries, top_n), dtype=cupy.int_)-1
-    score = cupy.zeros((n_queries, top_n), dtype=cupy.float_)
-
     logging.info(f'Performing search on {n_queries:,} query and {n_db:,} db entries with frag_tol = {frag_tol:.2f} and prec_tol = {prec_tol:.2f}.')
 
-    compare_spectrum_parallel(cupy.arange(n_queries), cupy.arange(n_queries), idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm)
+    if engine == 'fragment_index':
+        index_indptr, index_db_idx, min_bin = build_fragment_index(db_frags, db_indices, frag_tol, ppm)
+        logging.info(f'Fragment index with {len(index_db_idx):,} entries in {len(index_indptr)-1:,} bins created.')
 
-    query_idx, db_idx_ = cupy.where(score > min_frag_hits)
-    db_idx = best_hits[query_idx, db_idx_]
-    score_ = score[query_idx, db_idx_]
+    if len(query_blocks) > 1:
+        logging.info(f'Searching in {len(query_blocks):,} blocks to stay within the memory budget of {memory_budget:.2f} GB.')
 
-    if cupy.__name__ != 'numpy':
-        query_idx = query_idx.get()
-        db_idx = db_idx.get()
-        score_ = score_.get()
+    psms = []
 
-    psms = np.array(
-        list(zip(query_idx, db_idx, score_)), dtype=[("query_idx", int), ("db_idx", int), ("hits", float)]
-    )
+    for block in query_blocks:
+        n_block = len(block)
+
+        block_selection = query_selection[block]
+
+        block_indices, positions = alphapept.io.gather_ragged(query_indices, block_selection)
+
+        block_frags = query_frags[positions]
+        block_ints = query_ints[positions]
+
+        block_lower = cupy.array(idxs_lower[block])
+        block_higher = cupy.array(idxs_higher[block])
+
+        best_hits = cupy.zeros((n_block, top_n), dtype=cupy.int_)-1
+        score = cupy.zeros((n_block, top_n), dtype=cupy.float_)
+
+        if engine == 'fragment_index':
+            compare_spectrum_fragment_index(np.arange(n_block), block_lower, block_higher, block_indices, block_frags, block_ints, db_indices, db_frags, index_indptr, index_db_idx, min_bin, best_hits, score, frag_tol, ppm, n_candidates, min_frag_hits)
+        else:
+            block_indices = cupy.array(block_indices)
+            block_frags = cupy.array(block_frags)
+            block_ints = cupy.array(block_ints)
+
+            compare_spectrum_parallel(cupy.arange(n_block), cupy.arange(n_block), block_lower, block_higher, block_indices, block_frags, block_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm)
+
+        if cupy.__name__ != 'numpy':
+            best_hits = best_hits.get()
+            score = score.get()
+
+        best_hits, score = sort_top_n(best_hits, score)
+
+        query_idx, db_idx_ = np.where(score > min_frag_hits)
+
+        psms_ = np.zeros(len(query_idx), dtype=[("query_idx", int), ("db_idx", int), ("hits", float)])
+        psms_['query_idx'] = block[query_idx]
+        psms_['db_idx'] = best_hits[query_idx, db_idx_]
+        psms_['hits'] = score[query_idx, db_idx_]
+
+        psms.append(psms_)
+
+    psms = np.concatenate(psms)
+    psms = psms[np.argsort(psms['query_idx'], kind='stable')]
 
     logging.info('Found {:,} psms.'.format(len(psms)))
 
@@ -438,20 +733,44 @@ def remove_column(recarray:np.ndarray, name:str)->np.ndarray:
 
 # Cell
 from numba.typed import List
+
+ION_DTYPE = np.dtype([
+    ('ion_index', np.int8),
+    ('ion_type', np.int8),
+    ('ion_int', np.float32),
+    ('db_int', np.float32),
+    ('ion_mass', np.float32),
+    ('db_mass', np.float32),
+    ('query_idx', np.int32),
+    ('db_idx', np.int32),
+])
+
 @njit
-def get_hits(query_frag:np.ndarray, query_int:np.ndarray, db_frag:np.ndarray, db_int:np.ndarray, frag_type:np.ndarray, mtol:float, ppm:bool, losses:list)-> np.ndarray:
-    """Function to extract the types of hits based on a single PSMs.
+def count_hits(query_frag:np.ndarray, db_frag:np.ndarray, mtol:float, ppm:bool, losses:list)-> int:
+    """Function to count the hits of a single PSM without extracting them. See get_hits.
 
-    The reporting array stores information about the matched ions column wise:
+    Args:
+        query_frag (np.ndarray): Array with query fragments.
+        db_frag (np.ndarray): Array with database fragments.
+        mtol (float): Mass tolerance.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        losses (list): List of losses.
+
+    Returns:
+        int: Number of hits over all losses.
+    """
+    n_hits = 0
+
+    for off in losses:
+        hits = compare_frags(query_frag, db_frag-off, mtol, ppm)
+        n_hits += np.sum(hits>0)
 
-    Column 0: Type of the ion.
-    Column 1: Ion-index refering to what ion type was matched.
-    Column 2: Intensity of the matched ion.
-    Column 3: Intensity of the database ion.
-    Column 4: Experimental mass of the ion.
-    Column 5: Theoretical mass of the ion.
-    Column 6: Index to the query_frag of the ion.
-    Column 7: Index to the database_frag of the ion.
+    return n_hits
+
+
+@njit
+def fill_hits(query_frag:np.ndarray, query_int:np.ndarray, db_frag:np.ndarray, db_int:np.ndarray, frag_type:np.ndarray, mtol:float, ppm:bool, losses:list, ions:np.ndarray)-> int:
+    """Function to write the hits of a single PSM to a preallocated array. See get_hits for the fields.
 
     Args:
         query_frag (np.ndarray): Array with query fragments.
@@ -462,14 +781,11 @@ def get_hits(query_frag:np.ndarray, query_int:np.ndarray, db_frag:np.ndarray, db
         mtol (float): Mass tolerance.
         ppm (bool): Flag to use ppm instead of Dalton.
         losses (list): List of losses.
+        ions (np.ndarray): Structured array with ION_DTYPE to store the ion information, needs to be at least as long as the number of hits.
 
     Returns:
-        np.ndarray: NumPy array that stores ion information.
+        int: Number of hits that were written.
     """
-    max_array_size = len(db_frag)*len(losses)
-
-    ions = np.zeros((max_array_size, 8))
-
     pointer = 0
 
     query_range = np.arange(len(query_frag))
@@ -482,32 +798,166 @@ def get_hits(query_frag:np.ndarray, query_int:np.ndarray, db_frag:np.ndarray, db
         hitpos = hits[hits > 0] - 1
         hit = hits > 0
 
-        ions[pointer:pointer+n_hits,0] = frag_type[hits>0] #type
-        ions[pointer:pointer+n_hits,1] = idx #ion-index
+        ions['ion_index'][pointer:pointer+n_hits] = frag_type[hits>0] #type
+        ions['ion_type'][pointer:pointer+n_hits] = idx #ion-index
 
-        ions[pointer:pointer+n_hits,2] = query_int[hitpos] #query int
-        ions[pointer:pointer+n_hits,3] = db_int[hit] #db int
+        ions['ion_int'][pointer:pointer+n_hits] = query_int[hitpos] #query int
+        ions['db_int'][pointer:pointer+n_hits] = db_int[hit] #db int
 
-        ions[pointer:pointer+n_hits,4] = query_frag[hitpos] #query mass
-        ions[pointer:pointer+n_hits,5] = db_frag[hit]-off # db mass
+        ions['ion_mass'][pointer:pointer+n_hits] = query_frag[hitpos] #query mass
+        ions['db_mass'][pointer:pointer+n_hits] = db_frag[hit]-off # db mass
 
-        ions[pointer:pointer+n_hits,6] = query_range[hitpos] # index to query entry
-        ions[pointer:pointer+n_hits,7] = db_range[hit] # index to db entry
+        ions['query_idx'][pointer:pointer+n_hits] = query_range[hitpos] # index to query entry
+        ions['db_idx'][pointer:pointer+n_hits] = db_range[hit] # index to db entry
 
         pointer += n_hits
 
-    ions = ions[:pointer,:]
+    return pointer
 
-    return ions
 
+@njit
+def get_hits(query_frag:np.ndarray, query_int:np.ndarray, db_frag:np.ndarray, db_int:np.ndarray, frag_type:np.ndarray, mtol:float, ppm:bool, losses:list)-> np.ndarray:
+    """Function to extract the types of hits based on a single PSMs.
+
+    The reporting array is a structured array (ION_DTYPE) that stores information about the matched ions in the following fields:
+
+    ion_index (int8): Type of the ion.
+    ion_type (int8): Ion-index refering to what ion type was matched.
+    ion_int (float32): Intensity of the matched ion.
+    db_int (float32): Intensity of the database ion.
+    ion_mass (float32): Experimental mass of the ion.
+    db_mass (float32): Theoretical mass of the ion.
+    query_idx (int32): Index to the query_frag of the ion.
+    db_idx (int32): Index to the database_frag of the ion.
+
+    Args:
+        query_frag (np.ndarray): Array with query fragments.
+        query_int (np.ndarray): Array with query intensities.
+        db_frag (np.ndarray): Array with database fragments.
+        db_int (np.ndarray): Array with database intensities.
+        frag_type (np.ndarray): Array with fragment types.
+        mtol (float): Mass tolerance.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        losses (list): List of losses.
+
+    Returns:
+        np.ndarray: NumPy structured array that stores ion information.
+    """
+    max_array_size = len(db_frag)*len(losses)
+
+    ions = np.zeros(max_array_size, dtype=ION_DTYPE)
+
+    pointer = fill_hits(query_frag, query_int, db_frag, db_int, frag_type, mtol, ppm, losses, ions)
+
+    ions = ions[:pointer]
+
+    return ions
 
 # Cell
 from alphapept import constants
 LOSS_DICT = constants.loss_dict
 LOSSES = np.array(list(LOSS_DICT.values()))
 
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def score_psms(
+    idx: np.ndarray,
+    query_idxs: np.ndarray,
+    db_idxs: np.ndarray,
+    query_masses: np.ndarray,
+    query_masses_raw: np.ndarray,
+    query_frags: np.ndarray,
+    query_ints: np.ndarray,
+    query_indices: np.ndarray,
+    db_masses: np.ndarray,
+    db_frags: np.ndarray,
+    frag_types: np.ndarray,
+    mtol: float,
+    db_indices: np.ndarray,
+    ppm: bool,
+    db_ints: np.ndarray,
+    psms_: np.recarray,
+    ions: np.ndarray,
+    write: bool
+):
+    """Function to score a single PSM. See score.
+    In the counting pass (write=False), only the number of ions is stored in psms_['n_ions'].
+    In the writing pass, the ions are written to ions starting at psms_['ion_idx'] and the score columns are calculated.
+
+    Args:
+        idx (np.ndarray): Input index. Note that we are using the performance function so this is a range.
+        query_idxs (np.ndarray): Array with the query index of each PSM.
+        db_idxs (np.ndarray): Array with the database index of each PSM.
+        query_masses (np.ndarray): Array with query masses.
+        query_masses_raw (np.ndarray): Array with raw query masses.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        query_indices (np.ndarray): Array with indices to the query data.
+        db_masses (np.ndarray): Array with database masses.
+        db_frags (np.ndarray): Array with fragment masses.
+        frag_types (np.ndarray): Array with fragment types.
+        mtol (float): Mass tolerance.
+        db_indices (np.ndarray): Array with indices to the database array.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        db_ints (np.ndarray): Array with database intensities. If empty, all database intensities are set to 1.
+        psms_ (np.recarray): Recordarray to store the score columns.
+        ions (np.ndarray): Structured array with ION_DTYPE to store the ion information.
+        write (bool): Flag to write the ions and score columns. If False, only the ions are counted.
+    """
+    query_idx = query_idxs[idx]
+    db_idx = db_idxs[idx]
+    query_idx_start = query_indices[query_idx]
+    query_idx_end = query_indices[query_idx + 1]
+    query_frag = query_frags[query_idx_start:query_idx_end]
+    query_int = query_ints[query_idx_start:query_idx_end]
+    db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx+1]]
+    frag_type = frag_types[db_indices[db_idx]:db_indices[db_idx+1]]
+
+    if not write:
+        psms_['n_ions'][idx] = count_hits(query_frag, db_frag, mtol, ppm, LOSSES)
+        return
+
+    if len(db_ints) == 0:
+        db_int = np.ones(len(db_frag))
+    else:
+        db_int = db_ints[idx]
+
+    ion_idx = psms_['ion_idx'][idx]
+    psm_ions = ions[ion_idx:ion_idx + psms_['n_ions'][idx]]
+    fill_hits(query_frag, query_int, db_frag, db_int, frag_type, mtol, ppm, LOSSES, psm_ions)
+
+    psms_['prec_offset'][idx] = query_masses[query_idx] - db_masses[db_idx]
+    psms_['prec_offset_ppm'][idx] = 2 * psms_['prec_offset'][idx] / (query_masses[query_idx]  + db_masses[db_idx] ) * 1e6
+
+    psms_['prec_offset_raw '][idx] = query_masses_raw[query_idx] - db_masses[db_idx]
+    psms_['prec_offset_raw_ppm '][idx] = 2 * psms_['prec_offset'][idx] / (query_masses_raw[query_idx]  + db_masses[db_idx] ) * 1e6
+
+    # Full precision masses and intensities of the matched ions
+    ion_type = psm_ions['ion_type']
+    ion_index = psm_ions['ion_index']
+    ion_mass = query_frag[psm_ions['query_idx']]
+    ion_db_mass = db_frag[psm_ions['db_idx']] - LOSSES[ion_type]
+    ion_int = query_int[psm_ions['query_idx']]
+    ion_db_int = db_int[psm_ions['db_idx']]
+
+    psms_['delta_m'][idx] = np.mean(ion_mass-ion_db_mass)
+    psms_['delta_m_ppm'][idx] = np.mean(2 * psms_['delta_m'][idx] / (ion_mass  + ion_db_mass ) * 1e6)
+
+    psms_['total_int'][idx] = np.sum(query_int)
+    psms_['matched_int'][idx] = np.sum(ion_int)
+    psms_['matched_int_ratio'][idx] = psms_['matched_int'][idx] / psms_['total_int'][idx]
+    psms_['int_ratio'][idx] = np.mean(ion_int/ion_db_int)
+
+    psms_['b_hits'][idx] = np.sum(ion_index[ion_type==0]>0)
+    psms_['y_hits'][idx] = np.sum(ion_index[ion_type==0]<0)
+
+    psms_['b-H2O_hits'][idx] = np.sum(ion_index[ion_type==1]>0)
+    psms_['y-H2O_hits'][idx] = np.sum(ion_index[ion_type==1]<0)
+
+    psms_['b-NH3_hits'][idx] = np.sum(ion_index[ion_type==2]>0)
+    psms_['y-NH3_hits'][idx] = np.sum(ion_index[ion_type==2]<0)
+
+
 #This function is a wrapper and ist tested by the quick_test
-@njit
 def score(
     psms: np.recarray,
     query_masses: np.ndarray,
@@ -526,6 +976,8 @@ def score(
     parallel: bool = False
 ) -> (np.ndarray, np.ndarray):
     """Function to extract score columns when giving a recordarray with PSMs.
+    The PSMs are scored in parallel in two passes: the first pass counts the ions of each PSM,
+    the second pass writes the ions to one preallocated array and calculates the score columns.
 
     Args:
         psms (np.recarray): Recordarray containing PSMs.
@@ -545,65 +997,27 @@ def score(
         parallel (bool, optional): Flag to use parallel processing. Defaults to False.
 
     Returns:
-        np.recarray: Recordarray containing PSMs with additional columns.
-        np.ndarray: NumPy array containing ion information.
+        np.recarray: Recordarray containing PSMs with additional columns, ion_idx and n_ions link each PSM to its ions.
+        np.ndarray: NumPy structured array containing ion information, see get_hits.
     """
-
     psms_ = np.zeros(len(psms), dtype=psms_dtype)
 
-    ions_ = List()
-
-    ion_count = 0
-
-    for i in range(len(psms)):
-        query_idx = psms[i]["query_idx"]
-        db_idx = psms[i]["db_idx"]
-        query_idx_start = query_indices[query_idx]
-        query_idx_end = query_indices[query_idx + 1]
-        query_frag = query_frags[query_idx_start:query_idx_end]
-        query_int = query_ints[query_idx_start:query_idx_end]
-        db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx+1]]
-        frag_type = frag_types[db_indices[db_idx]:db_indices[db_idx+1]]
-
-        if db_ints is None:
-            db_int = np.ones(len(db_frag))
-        else:
-            db_int = db_ints[i]
-
-        ions = get_hits(query_frag, query_int, db_frag, db_int, frag_type, mtol, ppm, LOSSES)
-
-        psms_['prec_offset'][i] = query_masses[query_idx] - db_masses[db_idx]
-        psms_['prec_offset_ppm'][i] = 2 * psms_['prec_offset'][i] / (query_masses[query_idx]  + db_masses[db_idx] ) * 1e6
-
-        psms_['prec_offset_raw '][i] = query_masses_raw[query_idx] - db_masses[db_idx]
-        psms_['prec_offset_raw_ppm '][i] = 2 * psms_['prec_offset'][i] / (query_masses_raw[query_idx]  + db_masses[db_idx] ) * 1e6
-
-        psms_['delta_m'][i] = np.mean(ions[:,4]-ions[:,5])
-        psms_['delta_m_ppm'][i] = np.mean(2 * psms_['delta_m'][i] / (ions[:,4]  + ions[:,5] ) * 1e6)
-
-        psms_['total_int'][i] = np.sum(query_int)
-        psms_['matched_int'][i] = np.sum(ions[:,2])
-        psms_['matched_int_ratio'][i] = psms_['matched_int'][i] / psms_['total_int'][i]
-        psms_['int_ratio'][i] = np.mean(ions[:,2]/ions[:,3]) #3 is db_int, 2 is query_int
-
-        psms_['b_hits'][i] = np.sum(ions[ions[:,1]==0][:,0]>0)
-        psms_['y_hits'][i] = np.sum(ions[ions[:,1]==0][:,0]<0)
+    query_idxs = psms["query_idx"].astype(np.int64)
+    db_idxs = psms["db_idx"].astype(np.int64)
 
-        psms_['b-H2O_hits'][i] = np.sum(ions[ions[:,1]==1][:,0]>0)
-        psms_['y-H2O_hits'][i] = np.sum(ions[ions[:,1]==1][:,0]<0)
+    if db_ints is None:
+        db_ints = np.zeros((0, 0))
 
-        psms_['b-NH3_hits'][i] = np.sum(ions[ions[:,1]==2][:,0]>0)
-        psms_['y-NH3_hits'][i] = np.sum(ions[ions[:,1]==2][:,0]<0)
+    ions = np.zeros(0, dtype=ION_DTYPE)
 
-        n_ions = len(ions)
+    score_psms(range(len(psms)), query_idxs, db_idxs, query_masses, query_masses_raw, query_frags, query_ints, query_indices, db_masses, db_frags, frag_types, mtol, db_indices, ppm, db_ints, psms_, ions, False)
 
-        psms_['n_ions'][i] = n_ions
-        psms_['ion_idx'][i] = ion_count
+    psms_['ion_idx'][1:] = np.cumsum(psms_['n_ions'])[:-1]
+    ions = np.zeros(np.sum(psms_['n_ions']), dtype=ION_DTYPE)
 
-        ion_count += n_ions
-        ions_.append(ions)
+    score_psms(range(len(psms)), query_idxs, db_idxs, query_masses, query_masses_raw, query_frags, query_ints, query_indices, db_masses, db_frags, frag_types, mtol, db_indices, ppm, db_ints, psms_, ions, True)
 
-    return psms_, ions_
+    return psms_, ions
 
 # Cell
 
@@ -712,24 +1126,11 @@ def get_score_columns(
             query_prec_id = query_prec_id[features['query_idx'].values]
 
         query_selection = features['query_idx'].values
-        indices = np.zeros(len(query_selection) + 1, np.int64)
-        indices[1:] = np.diff(query_indices)[query_selection]
-        indices = np.cumsum(indices)
-        query_frags = np.concatenate(
-            [
-                query_frags[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-        query_ints = np.concatenate(
-            [
-                query_ints[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-        query_indices = indices
+
+        query_indices, positions = alphapept.io.gather_ragged(query_indices, query_selection)
+
+        query_frags = query_frags[positions]
+        query_ints = query_ints[positions]
     else:
         #TODO: This code is outdated, callin with features = None will crash.
         query_masses = query_data['prec_mass_list2']
@@ -742,7 +1143,7 @@ def get_score_columns(
 
     psms_dtype = np.dtype([(_,np.float32) for _ in float_fields] + [(_,np.int64) for _ in int_fields])
 
-    psms_, ions,  = score(
+    psms_, ions_ = score(
         psms,
         query_masses,
         query_masses_raw,
@@ -757,8 +1158,6 @@ def get_score_columns(
         ppm,
         psms_dtype)
 
-    ions_ = np.vstack(ions)
-
     for _ in psms_.dtype.names:
         psms = add_column(psms, psms_[_], _)
 
@@ -865,6 +1264,187 @@ def plot_psms(index, ms_file):
     plt.title(figure_title)
     plt.show()
 
+# Cell
+from .constants import mass_dict, AAs
+
+def get_offset_histogram(prec_offset:np.ndarray, bin_width:float = 0.01)-> (np.ndarray, np.ndarray):
+    """Function to calculate a histogram of precursor mass offsets.
+
+    Args:
+        prec_offset (np.ndarray): Array with precursor mass offsets in Dalton.
+        bin_width (float, optional): Bin width in Dalton. Defaults to 0.01.
+
+    Returns:
+        np.ndarray: Array with the center of each bin.
+        np.ndarray: Array with the number of offsets in each bin.
+    """
+    bins = np.floor(np.asarray(prec_offset) / bin_width).astype(np.int64)
+
+    if len(bins) == 0:
+        return np.zeros(0), np.zeros(0, dtype=np.int64)
+
+    min_bin = bins.min()
+    counts = np.bincount(bins - min_bin)
+    centers = (np.arange(len(counts)) + min_bin + 0.5) * bin_width
+
+    return centers, counts
+
+
+def annotate_offsets(offsets:np.ndarray, tol:float = 0.02)-> list:
+    """Function to map precursor mass offsets to the modifications in mass_dict.
+
+    Args:
+        offsets (np.ndarray): Array with precursor mass offsets in Dalton.
+        tol (float, optional): Tolerance in Dalton to match an offset to a modification. Defaults to 0.02.
+
+    Returns:
+        list: List with a comma-separated string of matching modifications for each offset.
+    """
+    mods = [_ for _ in mass_dict.keys() if _[0].islower() and _[-1] in AAs and len(_) > 1]
+    mod_deltas = np.array([mass_dict[_] - mass_dict[_[-1]] for _ in mods])
+
+    annotations = []
+    for offset in offsets:
+        annotations.append(','.join([mod for mod, delta in zip(mods, mod_deltas) if abs(delta - offset) <= tol]))
+
+    return annotations
+
+
+def find_offset_peaks(prec_offset:np.ndarray, bin_width:float = 0.01, min_count:int = 10, max_peaks:int = 20, tol:float = 0.02)-> pd.DataFrame:
+    """Function to find frequent precursor mass offsets.
+
+    Args:
+        prec_offset (np.ndarray): Array with precursor mass offsets in Dalton.
+        bin_width (float, optional): Bin width in Dalton. Defaults to 0.01.
+        min_count (int, optional): Minimum number of offsets to report a peak. Defaults to 10.
+        max_peaks (int, optional): Maximum number of peaks to report. Defaults to 20.
+        tol (float, optional): Tolerance in Dalton to match an offset to a modification. Defaults to 0.02.
+
+    Returns:
+        pd.DataFrame: Pandas dataframe with offset, count and matching modifications, sorted by count.
+    """
+    prec_offset = np.asarray(prec_offset)
+    centers, counts = get_offset_histogram(prec_offset, bin_width)
+
+    # A peak is a local maximum that spans up to three bins
+    padded = np.concatenate([[0], counts, [0]])
+    is_peak = (counts >= padded[:-2]) & (counts > padded[2:])
+    peaks = np.where(is_peak & (counts >= min_count))[0]
+
+    offsets, n_offsets = [], []
+    for peak in peaks:
+        lower = centers[peak] - 1.5 * bin_width
+        upper = centers[peak] + 1.5 * bin_width
+        in_peak = prec_offset[(prec_offset >= lower) & (prec_offset < upper)]
+        offsets.append(np.median(in_peak))
+        n_offsets.append(len(in_peak))
+
+    df = pd.DataFrame({'offset': offsets, 'count': n_offsets}, columns=['offset', 'count'])
+    df = df.sort_values('count', ascending=False).head(max_peaks).reset_index(drop=True)
+    df['mods'] = annotate_offsets(df['offset'].values, tol)
+
+    return df
+
+
+def get_confident_offsets(df:pd.DataFrame, fdr_level:float = 0.01)-> np.ndarray:
+    """Function to select the precursor mass offsets of confidently identified psms.
+    Only the best psm per spectrum is kept and psms are filtered with the x_tandem score at fdr_level,
+    so that lower ranked psms, decoys and random matches do not dominate the offset histogram.
+
+    Args:
+        df (pd.DataFrame): Pandas dataframe with scored psms, see get_score_columns.
+        fdr_level (float, optional): FDR level to filter psms. Defaults to 0.01.
+
+    Returns:
+        np.ndarray: Array with the precursor mass offsets of the target psms that pass the FDR filter.
+    """
+    from .score import score_x_tandem
+
+    if len(df) == 0:
+        return np.zeros(0)
+
+    cutoff = score_x_tandem(df.copy(), fdr_level=fdr_level, plot=False)
+
+    return cutoff.loc[~cutoff['decoy'], 'prec_offset'].values
+
+# Cell
+from multiprocessing import shared_memory
+from .fasta import read_database
+
+SHARED_DB_ARRAYS = ['precursors', 'fragmasses', 'indices', 'fragtypes', 'seqs', 'db_ints']
+
+_attached_databases = {}
+
+def create_shared_database(database_path:str) -> (list, dict):
+    """Load the database arrays that are needed for search and scoring into shared memory.
+
+    Args:
+        database_path (str): Path to the database.
+
+    Returns:
+        list: List of SharedMemory objects, required to release the memory.
+        dict: Dictionary with name, shape and dtype of the shared memory for each array.
+    """
+    shms = []
+    shared_info = {}
+
+    db_file = alphapept.io.HDF_File(database_path)
+    available = db_file.read()
+
+    for array_name in SHARED_DB_ARRAYS:
+        if array_name not in available:
+            continue
+
+        array = read_database(database_path, array_name = array_name)
+        if array_name == 'seqs':
+            array = array.astype(str)
+        array = np.ascontiguousarray(array)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        shared_array[:] = array[:]
+
+        shms.append(shm)
+        shared_info[array_name] = (shm.name, array.shape, array.dtype.str)
+
+    logging.info(f'Database with {sum([_.size for _ in shms])/1024**3:.2f} GB loaded into shared memory.')
+
+    return shms, shared_info
+
+
+def attach_shared_database(shared_info:dict) -> dict:
+    """Attach to a database in shared memory. The SharedMemory objects are kept per process, so that each process attaches only once.
+
+    Args:
+        shared_info (dict): Dictionary with name, shape and dtype of the shared memory for each array, see `create_shared_database`.
+
+    Returns:
+        dict: Dictionary with the database arrays.
+    """
+    db_data = {}
+
+    for array_name, (name, shape, dtype) in shared_info.items():
+        if name not in _attached_databases:
+            _attached_databases[name] = shared_memory.SharedMemory(name=name)
+
+        db_data[array_name] = np.ndarray(shape, dtype=dtype, buffer=_attached_databases[name].buf)
+
+    return db_data
+
+
+def release_shared_database(shms:list):
+    """Release a database in shared memory.
+
+    Args:
+        shms (list): List of SharedMemory objects as returned by `create_shared_database`.
+    """
+    for shm in shms:
+        attached = _attached_databases.pop(shm.name, None)
+        if attached is not None:
+            attached.close()
+        shm.close()
+        shm.unlink()
+
 # Cell
 import os
 import pandas as pd
@@ -901,7 +1481,7 @@ def store_hdf(df: pd.DataFrame, path: str, key:str, replace:bool=False, swmr:boo
                 ms_file.write(df, dataset_name=key, swmr = swmr)
 
 #This function is a wrapper and ist tested by the quick_test
-def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, first_search:bool = True) -> Union[bool, str]:
+def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, first_search:bool = True, shared_database:dict = None) -> Union[bool, str]:
     """Wrapper function to perform database search to be used by a parallel pool.
 
     Args:
@@ -909,6 +1489,7 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
         callback (Callable, optional): Callback function to indicate progress. Defaults to None.
         parallel (bool, optional): Flag to use parallel processing. Defaults to False.
         first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+        shared_database (dict, optional): Database in shared memory, see `create_shared_database`. If None, the database is memory-mapped from the database_path. Defaults to None.
 
     Returns:
         Union[bool, str]: Returns True if the search was successfull, otherwise returns a string containing the Exception.
@@ -950,19 +1531,23 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
                 logging.info(f'{e}')
 
         if not skip:
-            db_data_path = settings['experiment']['database_path']
+            if shared_database is not None:
+                db_data = attach_shared_database(shared_database)
+            else:
+                db_data = alphapept.fasta.Database(settings['experiment']['database_path'])
 
     #         TODO calibrated_fragments should be included in settings
             query_data = ms_file_.read_DDA_query_data(
                 calibrated_fragments=True,
+                mmap=True,
                 database_file_name=settings['experiment']['database_path']
             )
 
             features = ms_file_.read(dataset_name="features")
 
-            psms, num_specs_compared = get_psms(query_data, db_data_path, features, **settings["search"])
+            psms, num_specs_compared = get_psms(query_data, db_data, features, **settings["search"])
             if len(psms) > 0:
-                psms, ions = get_score_columns(psms, query_data, db_data_path, features, **settings["search"])
+                psms, ions = get_score_columns(psms, query_data, db_data, features, **settings["search"])
 
                 if first_search:
                     logging.info('Saving first_search results to {}'.format(ms_file))
@@ -972,8 +1557,12 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
                     save_field = 'second_search'
 
                 store_hdf(pd.DataFrame(psms), ms_file_, save_field, replace=True)
-                ion_columns = ['ion_index','ion_type','ion_int','db_int','ion_mass','db_mass','query_idx','db_idx']
-                store_hdf(pd.DataFrame(ions, columns = ion_columns), ms_file_, 'ions', replace=True)
+                store_hdf(pd.DataFrame(ions), ms_file_, 'ions', replace=True)
+
+                if settings['search'].get('open_search', False):
+                    offsets = find_offset_peaks(get_confident_offsets(pd.DataFrame(psms), settings['search']['peptide_fdr']))
+                    store_hdf(offsets, ms_file_, 'precursor_offsets', replace=True)
+                    logging.info(f'Most frequent precursor offsets: {offsets.head(5).to_dict("records")}')
             else:
                 logging.info('No psms found.')
 
@@ -983,9 +1572,45 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
         logging.error(f'Search of file {file_name} failed. Exception {e}.')
         return f"{e}" #Can't return exception object, cast as string
 
+# Cell
+import os
+import alphapept.io
+
+_query_data_cache = {}
+
+def read_query_data_cached(ms_file_path:str) -> (alphapept.io.MS_Data_File, dict, pd.DataFrame):
+    """Read the query and feature data of an ms_data file and keep it in a per-process cache.
+
+    Args:
+        ms_file_path (str): Path to the ms_data file.
+
+    Returns:
+        alphapept.io.MS_Data_File: MS_Data_File of the query data.
+        dict: Data structure containing the query data.
+        pd.DataFrame: Pandas dataframe containing feature data. None if no features are present.
+    """
+    key = (os.path.abspath(ms_file_path), os.path.getmtime(ms_file_path))
+
+    if key not in _query_data_cache:
+        for _ in [_ for _ in _query_data_cache if _[0] == key[0]]:
+            del _query_data_cache[_]
+
+        ms_file = alphapept.io.MS_Data_File(ms_file_path)
+        with ms_file.session(swmr=True):
+            query_data = ms_file.read_DDA_query_data(swmr=True, mmap=True)
+
+            try:
+                features = ms_file.read(dataset_name="features",swmr=True)
+            except KeyError:
+                features = None
+
+        _query_data_cache[key] = (ms_file, query_data, features)
+
+    return _query_data_cache[key]
+
 # Cell
 
-from .fasta import blocks, generate_peptides, add_to_pept_dict
+from .fasta import blocks, generate_peptides_compiled, add_to_pept_dict
 from .io import list_to_numpy_f32
 from .fasta import block_idx, generate_fasta_list, generate_spectra, check_peptide
 from alphapept import constants
@@ -1020,7 +1645,7 @@ def search_fasta_block(to_process:tuple) -> (list, int):
     pept_dict = {}
     for element in fasta_block:
         sequence = element["sequence"]
-        mod_peptides = generate_peptides(sequence, **settings_['fasta'])
+        mod_peptides = generate_peptides_compiled(sequence, **settings_['fasta'])
 
         pept_dict, added_peptides = add_to_pept_dict(pept_dict, mod_peptides, fasta_index+f_index)
 
@@ -1070,18 +1695,7 @@ def search_fasta_block(to_process:tuple) -> (list, int):
             db_data["indices"] = indices
 
             for file_idx, ms_file in enumerate(ms_files):
-                query_data = alphapept.io.MS_Data_File(
-                    f"{ms_file}"
-                ).read_DDA_query_data(swmr=True)
-
-                try:
-                    features = alphapept.io.MS_Data_File(
-                        ms_file
-                    ).read(dataset_name="features",swmr=True)
-                except FileNotFoundError:
-                    features = None
-                except KeyError:
-                    features = None
+                ms_file_, query_data, features = read_query_data_cached(ms_file)
 
                 psms, num_specs_compared = get_psms(query_data, db_data, features, **settings[file_idx]["search"])
 
@@ -1136,10 +1750,45 @@ def filter_top_n(temp:pd.DataFrame, top_n:int = 10)-> pd.DataFrame:
 # Cell
 import psutil
 import alphapept.constants as constants
-from .fasta import get_fragmass, parse
+from .fasta import get_fragmasses, list_to_numba
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def extract_ions(idx:np.ndarray, query_idxs:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, frag_masses:np.ndarray, frag_types:np.ndarray, frag_indices:np.ndarray, frag_tol:float, ppm:bool, n_ions:np.ndarray, ion_idx:np.ndarray, ions:np.ndarray, write:bool):
+    """Extracts the matched hits (ions) of a single PSM. See fill_hits.
+
+    Args:
+        idx (np.ndarray): Input index. Note that we are using the performance function so this is a range.
+        query_idxs (np.ndarray): Array with the query index of each PSM.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with the fragment masses of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        frag_masses (np.ndarray): Array with the fragment masses of each PSM.
+        frag_types (np.ndarray): Array with the fragment types of each PSM.
+        frag_indices (np.ndarray): Array with indices to the fragments of each PSM.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        n_ions (np.ndarray): Array to store the number of ions of each PSM.
+        ion_idx (np.ndarray): Array with the start of the ions of each PSM in ions.
+        ions (np.ndarray): Array to store the ions.
+        write (bool): Flag to write the ions. If False, only n_ions is determined.
+    """
+    query_idx = query_idxs[idx]
+    query_frag = query_frags[query_indices[query_idx]:query_indices[query_idx + 1]]
+    query_int = query_ints[query_indices[query_idx]:query_indices[query_idx + 1]]
+
+    db_frag = frag_masses[frag_indices[idx]:frag_indices[idx + 1]]
+    frag_type = frag_types[frag_indices[idx]:frag_indices[idx + 1]]
+    if write:
+        db_int = np.ones_like(db_frag)
+        fill_hits(query_frag, query_int, db_frag, db_int, frag_type, frag_tol, ppm, LOSSES, ions[ion_idx[idx]:ion_idx[idx] + n_ions[idx]])
+    else:
+        n_ions[idx] = count_hits(query_frag, db_frag, frag_tol, ppm, LOSSES)
+
 
 def ion_extractor(df: pd.DataFrame, ms_file, frag_tol:float, ppm:bool)->(np.ndarray, np.ndarray):
     """Extracts the matched hits (ions) from a dataframe.
+    The fragments of all PSMs are calculated at once and the ions are extracted in parallel:
+    A first pass counts the ions of each PSM, a second pass writes them to their position in the ion array.
 
     Args:
         df (pd.DataFrame): Pandas dataframe containing the results of the first search.
@@ -1152,43 +1801,31 @@ def ion_extractor(df: pd.DataFrame, ms_file, frag_tol:float, ppm:bool)->(np.ndar
         np.ndarray: Numpy recordarray storing the ions.
     """
 
-    query_data = ms_file.read_DDA_query_data()
+    query_data = ms_file.read_DDA_query_data(mmap=True)
     query_indices = query_data["indices_ms2"]
     query_frags = query_data['mass_list_ms2']
     query_ints = query_data['int_list_ms2']
 
     psms = df.to_records()
 
-    ion_count = 0
-
-    ions_ = List()
-
-    for i in range(len(psms)):
-        query_idx = psms[i]["raw_idx"]
-        db_idx = psms[i]["db_idx"]
-        query_idx_start = query_indices[query_idx]
-        query_idx_end = query_indices[query_idx + 1]
-        query_frag = query_frags[query_idx_start:query_idx_end]
-        query_int = query_ints[query_idx_start:query_idx_end]
-
-        seq = psms[i]['sequence']
+    frag_masses, frag_types, frag_indices = get_fragmasses(list_to_numba(psms['sequence']), constants.mass_dict)
 
-        db_frag, frag_type = get_fragmass(parse(seq), constants.mass_dict)
-        db_int = np.ones_like(db_frag)
-
-        ions = get_hits(query_frag, query_int, db_frag, db_int, frag_type, frag_tol, ppm, LOSSES)
+    query_idxs = psms["raw_idx"].astype(np.int64)
+    n_ions = np.zeros(len(psms), dtype=np.int64)
+    ion_idx = np.zeros(len(psms), dtype=np.int64)
+    ions = np.zeros(0, dtype=ION_DTYPE)
 
-        n_ions = len(ions)
+    extract_ions(range(len(psms)), query_idxs, query_indices, query_frags, query_ints, frag_masses, frag_types, frag_indices, frag_tol, ppm, n_ions, ion_idx, ions, False)
 
-        psms['n_ions'][i] = n_ions
-        psms['ion_idx'][i] = ion_count
+    ion_idx[1:] = np.cumsum(n_ions)[:-1]
+    ions = np.zeros(np.sum(n_ions), dtype=ION_DTYPE)
 
-        ion_count += n_ions
-        ions_.append(ions)
+    extract_ions(range(len(psms)), query_idxs, query_indices, query_frags, query_ints, frag_masses, frag_types, frag_indices, frag_tol, ppm, n_ions, ion_idx, ions, True)
 
-    ions_ = np.vstack(ions_)
+    psms['n_ions'] = n_ions
+    psms['ion_idx'] = ion_idx
 
-    return psms, ions_
+    return psms, ions
 
 
 #This function is a wrapper and ist tested by the quick_test
@@ -1295,8 +1932,7 @@ def search_parallel(settings: dict, calibration:Union[list, None] = None, fragme
             psms, ions = ion_extractor(x, ms_file, frag_tol, ppm)
 
             store_hdf(pd.DataFrame(psms), ms_file, save_field, replace=True)
-            ion_columns = ['ion_index','ion_type','ion_int','db_int','ion_mass','db_mass','query_idx','db_idx']
-            store_hdf(pd.DataFrame(ions, columns = ion_columns), ms_file, 'ions', replace=True)
+            store_hdf(pd.DataFrame(ions), ms_file, 'ions', replace=True)
 
     #Todo? Callback
     logging.info(f'Complete. Created peptides {n_seqs_:,}')